@@ -0,0 +1,98 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class AnalysisCache:
+    """Llama analyses kept in SQLite, keyed by the images' content, the prompt and the model.
+
+    Regenerating a report only sends new or changed graphs to the model. The store is
+    bounded by max_bytes of analysis text; the least recently used entries go first.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " analysis TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " used_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS analyses_used ON analyses (used_at)")
+
+    def _connect(self):
+        # One connection per thread; autocommit so every write is its own short transaction
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT analysis FROM analyses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE analyses SET used_at = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key, model, analysis):
+        now = time.time()
+        size = len(analysis.encode('utf-8'))
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO analyses (key, model, analysis, size, created_at, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, analysis, size, now, now)
+        )
+        self.evict()
+
+    def evict(self):
+        # Drops the least recently used entries until the store fits in max_bytes
+        conn = self._connect()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM analyses ORDER BY used_at"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany("DELETE FROM analyses WHERE key = ?", doomed)
+
+    def stats(self):
+        entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analyses").fetchone()
+        return {'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes}
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(image_paths, prompt, model, preprocessing=''):
+    # Same pixels, preprocessing, prompt and model give the same analysis, whatever the file is called
+    digest = hashlib.sha256()
+    for part in [model, preprocessing, prompt] + [file_sha1(image_path) for image_path in image_paths]:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
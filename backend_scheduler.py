@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import progress
+
+# Per-backend budgets shared by every export and report running in this process.
+# Waiters from interactive tasks are always served before waiters from batch tasks.
+# concurrency: requests in flight at once; rate/burst: token bucket in requests per second (None = unlimited)
+POOLS = {
+    'zabbix_api': {'concurrency': 8, 'rate': 20, 'burst': 20},
+    'zabbix_renderer': {'concurrency': 4, 'rate': 4, 'burst': 4},
+    'network_zabbix_api': {'concurrency': 4, 'rate': 10, 'burst': 10},
+    'network_zabbix_renderer': {'concurrency': 4, 'rate': 4, 'burst': 4},
+    'grafana_api': {'concurrency': 4, 'rate': None, 'burst': None},
+    'grafana_renderer': {'concurrency': 2, 'rate': 1, 'burst': 2},
+    'llama': {'concurrency': 2, 'rate': None, 'burst': None},
+    'supportpal': {'concurrency': 4, 'rate': 2, 'burst': 4},
+}
+
+# Processes for CPU-bound work (report host sections, PNG optimization), shared by every job in this process
+PROCESS_POOL_WORKERS = os.cpu_count() or 2
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Blocks until a token is available
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ResourcePool:
+    def __init__(self, name, concurrency, rate=None, burst=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.active = 0
+        self.waiting = 0
+        self.waiting_interactive = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_busy = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, priority='interactive'):
+        started = time.monotonic()
+        interactive = priority != 'batch'
+        with self._condition:
+            self.waiting += 1
+            if interactive:
+                self.waiting_interactive += 1
+            while self.active >= self.concurrency or (not interactive and self.waiting_interactive):
+                self._condition.wait()
+            self.waiting -= 1
+            if interactive:
+                self.waiting_interactive -= 1
+            self.active += 1
+        if self.bucket is not None:
+            self.bucket.acquire()
+        waited = time.monotonic() - started
+        with self._condition:
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return time.monotonic()
+
+    def release(self, acquired_at, failed=False):
+        with self._condition:
+            self.active -= 1
+            self.completed += 1
+            if failed:
+                self.failed += 1
+            self.total_busy += time.monotonic() - acquired_at
+            # Wake everyone so an interactive waiter can overtake batch waiters
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'concurrency': self.concurrency,
+                'rate': self.bucket.rate if self.bucket else None,
+                'active': self.active,
+                'waiting': self.waiting,
+                'waiting_interactive': self.waiting_interactive,
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_seconds': round(self.total_wait / self.completed, 3) if self.completed else 0.0,
+                'max_wait_seconds': round(self.max_wait, 3),
+                'avg_busy_seconds': round(self.total_busy / self.completed, 3) if self.completed else 0.0,
+            }
+
+
+_pools = {name: ResourcePool(name, **config) for name, config in POOLS.items()}
+
+
+def get_pool(name):
+    return _pools[name]
+
+
+@contextmanager
+def slot(name):
+    # with slot('zabbix_renderer'): ... holds one of the pool's slots and one rate token
+    pool = _pools[name]
+    acquired_at = pool.acquire(progress.get_priority())
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        pool.release(acquired_at, failed)
+
+
+def stats():
+    return {name: pool.stats() for name, pool in _pools.items()}
+
+
+def get_process_pool():
+    """The shared process pool, created on first use.
+
+    Forking copies only the calling thread, so locks other threads hold at that moment stay locked
+    in the children. Workers are forked only while the process still has a single thread (the web
+    app calls this at startup for that reason); otherwise they start from a forkserver.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            if threading.active_count() == 1:
+                pool = ProcessPoolExecutor(PROCESS_POOL_WORKERS, mp_context=multiprocessing.get_context('fork'))
+                # With fork every worker starts on the first submit, while no other thread exists
+                pool.submit(os.getpid).result()
+            else:
+                pool = ProcessPoolExecutor(PROCESS_POOL_WORKERS, mp_context=multiprocessing.get_context('forkserver'))
+            _process_pool = pool
+        return _process_pool
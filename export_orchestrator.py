@@ -0,0 +1,405 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import progress
+import network_topology
+import zabbix_graph_export
+import network_graph_export
+import grafana_graph_export
+import generate_report
+import generate_report_grafana
+import png_optimizer
+
+BASE_DIRECTORY = "/home/almalinux"
+
+# Month-end batches: customers processed at the same time overall and per report backend
+BATCH_MAX_WORKERS = 8
+BATCH_BACKEND_LIMITS = {'zabbix': 6, 'grafana': 3}
+
+# Logged-in sessions are reused by later runs in the same process until they get this old
+SESSION_MAX_AGE_SECONDS = 600
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def load_customer_details(customer_dir):
+    details = {}
+    with open(os.path.join(customer_dir, "customer_details.txt"), "r") as f:
+        for line in f:
+            if ": " in line:
+                key, value = line.strip().split(": ", 1)
+                details[key.strip()] = value.strip()
+    return details
+
+
+def has_network_tags(details):
+    return bool(details.get("Server Tag 1") and details.get("Rack 1"))
+
+
+def is_grafana_customer(details):
+    return details.get("Grafana Selected", "No").strip().lower() == "yes"
+
+
+def get_session(backend):
+    # backend is the exporter module; it provides zabbix_login_api/zabbix_web_login
+    with _sessions_lock:
+        entry = _sessions.get(backend.__name__)
+        if entry and time.time() - entry[0] < SESSION_MAX_AGE_SECONDS:
+            return entry[1], entry[2]
+
+        session = requests.Session()
+        auth_token = backend.zabbix_login_api(session)
+        backend.zabbix_web_login(session)
+        _sessions[backend.__name__] = (time.time(), session, auth_token)
+        return session, auth_token
+
+
+def drop_session(backend, session):
+    # Forgets the cached session unless another thread already replaced it
+    with _sessions_lock:
+        entry = _sessions.get(backend.__name__)
+        if entry and entry[1] is session:
+            del _sessions[backend.__name__]
+
+
+def clear_sessions():
+    with _sessions_lock:
+        _sessions.clear()
+
+
+def with_session(backend, func):
+    # Calls func(session, auth_token) with the cached session. If Zabbix rejects it (logout,
+    # server restart, shorter session timeout), logs in again and calls func once more.
+    session, auth_token = get_session(backend)
+    try:
+        return func(session, auth_token)
+    except network_topology.SessionRejected as e:
+        print(f"Zabbix rejected the cached {backend.__name__} session ({e}), logging in again")
+        drop_session(backend, session)
+        session, auth_token = get_session(backend)
+        return func(session, auth_token)
+
+
+def run_stage(name, func, *args, **kwargs):
+    # The exporters call sys.exit() on fatal errors; report those as a failed stage instead
+    progress.emit('stage', f"{name} started", name=name)
+    started = time.time()
+    try:
+        func(*args, **kwargs)
+        elapsed = time.time() - started
+        progress.emit('stage', f"{name} completed in {elapsed:.1f}s", name=name, seconds=round(elapsed, 1))
+        return True, f"{name} completed."
+    except SystemExit as e:
+        return False, f"{name} failed with exit code {e.code}"
+    except Exception as e:
+        traceback.print_exc()
+        return False, f"{name} failed: {str(e)}"
+
+
+def export_zabbix_stage(customer_dir, month, year, details):
+    with_session(zabbix_graph_export, lambda session, auth_token: zabbix_graph_export.export_graphs_for_customer(
+        customer_dir, month, year, session=session, auth_token=auth_token, details=details
+    ))
+
+
+def export_network_stage(customer_dir, month, year, details):
+    if not has_network_tags(details):
+        print("No Server Tags and Racks found in customer_details.txt, skipping network export.")
+        return
+    with_session(network_graph_export, lambda session, auth_token: network_graph_export.export_network_graphs(
+        customer_dir, month, year, session=session, auth_token=auth_token, details=details
+    ))
+
+
+def optimize_png_stage(customer_dir, month, year, keep_originals=False):
+    month_dir = os.path.join(customer_dir, f"{year}-{str(month).zfill(2)}")
+    png_optimizer.optimize_directory(month_dir, keep_originals=keep_originals)
+
+
+def optimize_after_export(result, customer_dir, month, year, optimize_png, keep_original_png):
+    # Recompresses the exported graphs once the export succeeded, if requested
+    if not optimize_png or not result[0]:
+        return result
+    ok, message = run_stage("png_optimize", optimize_png_stage, customer_dir, int(month), int(year), keep_original_png)
+    return result if ok else (False, message)
+
+
+def load_customer(customer_id, base_directory=BASE_DIRECTORY):
+    # Returns (customer_dir, details); details is None when the customer is not set up
+    customer_dir = os.path.join(base_directory, customer_id)
+    if not os.path.isfile(os.path.join(customer_dir, "customer_details.txt")):
+        return customer_dir, None
+    return customer_dir, load_customer_details(customer_dir)
+
+
+def missing_customer_message(customer_dir):
+    return f"Customer directory '{customer_dir}' not found or missing 'customer_details.txt'."
+
+
+def export_zabbix_graphs(month, year, customer_id, base_directory=BASE_DIRECTORY, optimize_png=False, keep_original_png=False):
+    customer_dir, details = load_customer(customer_id, base_directory)
+    if details is None:
+        return False, missing_customer_message(customer_dir)
+    result = run_stage("zabbix_graph_export", export_zabbix_stage, customer_dir, int(month), int(year), details)
+    return optimize_after_export(result, customer_dir, month, year, optimize_png, keep_original_png)
+
+
+def export_network_graphs(month, year, customer_id, base_directory=BASE_DIRECTORY, optimize_png=False, keep_original_png=False):
+    customer_dir, details = load_customer(customer_id, base_directory)
+    if details is None:
+        return False, missing_customer_message(customer_dir)
+    result = run_stage("network_graph_export", export_network_stage, customer_dir, int(month), int(year), details)
+    return optimize_after_export(result, customer_dir, month, year, optimize_png, keep_original_png)
+
+
+def export_grafana_graphs(month, year, customer_id, base_directory=BASE_DIRECTORY, optimize_png=False, keep_original_png=False):
+    customer_dir, details = load_customer(customer_id, base_directory)
+    if details is None:
+        return False, missing_customer_message(customer_dir)
+    result = run_stage(
+        "grafana_graph_export", grafana_graph_export.export_grafana_graphs, customer_dir, int(month), int(year), details=details
+    )
+    return optimize_after_export(result, customer_dir, month, year, optimize_png, keep_original_png)
+
+
+def generate_zabbix_report(month, year, customer_id, base_directory=BASE_DIRECTORY):
+    customer_dir, details = load_customer(customer_id, base_directory)
+    if details is None:
+        return False, missing_customer_message(customer_dir)
+    return run_stage("generate_report", generate_report.generate_report, int(month), int(year), customer_id, customer_details=details)
+
+
+def generate_grafana_report(month, year, customer_id, llama_selected=False, base_directory=BASE_DIRECTORY,
+                            analysis_mode=generate_report_grafana.DEFAULT_ANALYSIS_MODE):
+    customer_dir, details = load_customer(customer_id, base_directory)
+    if details is None:
+        return False, missing_customer_message(customer_dir)
+    return run_stage(
+        "generate_report_grafana", generate_report_grafana.generate_grafana_report, int(month), int(year), customer_id, llama_selected,
+        analysis_mode
+    )
+
+
+def export_and_generate_report(month, year, customer_id, base_directory=BASE_DIRECTORY, optimize_png=False,
+                               keep_original_png=False):
+    customer_dir, details = load_customer(customer_id, base_directory)
+    if details is None:
+        return False, missing_customer_message(customer_dir)
+
+    month = int(month)
+    year = int(year)
+
+    # Server and network exports run side by side, sharing the parsed details
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        zabbix_future = executor.submit(
+            progress.wrap(run_stage), "zabbix_graph_export", export_zabbix_stage, customer_dir, month, year, details
+        )
+        network_future = executor.submit(
+            progress.wrap(run_stage), "network_graph_export", export_network_stage, customer_dir, month, year, details
+        )
+        zabbix_ok, zabbix_message = zabbix_future.result()
+        network_ok, network_message = network_future.result()
+
+    if not zabbix_ok:
+        return False, zabbix_message
+    if not network_ok:
+        return False, network_message
+
+    if optimize_png:
+        optimize_ok, optimize_message = run_stage(
+            "png_optimize", optimize_png_stage, customer_dir, month, year, keep_original_png
+        )
+        if not optimize_ok:
+            return False, optimize_message
+
+    report_ok, report_message = run_stage(
+        "generate_report", generate_report.generate_report, month, year, customer_id, customer_details=details
+    )
+    if not report_ok:
+        return False, report_message
+
+    return True, "Export and report generation completed."
+
+
+def export_and_generate_grafana_report(month, year, customer_id, llama_selected=False, base_directory=BASE_DIRECTORY,
+                                       optimize_png=False, keep_original_png=False,
+                                       analysis_mode=generate_report_grafana.DEFAULT_ANALYSIS_MODE):
+    customer_dir, details = load_customer(customer_id, base_directory)
+    if details is None:
+        return False, missing_customer_message(customer_dir)
+
+    month = int(month)
+    year = int(year)
+
+    export_ok, export_message = run_stage(
+        "grafana_graph_export", grafana_graph_export.export_grafana_graphs, customer_dir, month, year, details=details
+    )
+    if not export_ok:
+        return False, export_message
+
+    if optimize_png:
+        optimize_ok, optimize_message = run_stage(
+            "png_optimize", optimize_png_stage, customer_dir, month, year, keep_original_png
+        )
+        if not optimize_ok:
+            return False, optimize_message
+
+    report_ok, report_message = run_stage(
+        "generate_report_grafana", generate_report_grafana.generate_grafana_report, month, year, customer_id, llama_selected,
+        analysis_mode
+    )
+    if not report_ok:
+        return False, report_message
+
+    return True, "Export and report generation for Grafana completed."
+
+
+def select_customers(selector, customer_ids=None, base_directory=BASE_DIRECTORY):
+    # selector is 'all', 'grafana' (Grafana-enabled only) or 'list' (customer_ids)
+    if selector == 'list':
+        candidates = list(dict.fromkeys(customer_ids or []))
+    else:
+        candidates = sorted(os.listdir(base_directory))
+
+    customers = []
+    for customer_id in candidates:
+        customer_dir, details = load_customer(customer_id, base_directory)
+        if details is None:
+            if selector == 'list':
+                print(missing_customer_message(customer_dir))
+            continue
+        if selector == 'grafana' and not is_grafana_customer(details):
+            continue
+        customers.append((customer_id, details))
+    return customers
+
+
+def run_batch(month, year, selector='all', customer_ids=None, llama_selected=False, base_directory=BASE_DIRECTORY,
+              max_workers=BATCH_MAX_WORKERS, backend_limits=None, optimize_png=False, keep_original_png=False,
+              analysis_mode=generate_report_grafana.DEFAULT_ANALYSIS_MODE):
+    customers = select_customers(selector, customer_ids, base_directory)
+    if not customers:
+        return False, "No customers matched the selection."
+    # Backends the caller leaves out keep their default limit
+    backend_limits = dict(BATCH_BACKEND_LIMITS, **(backend_limits or {}))
+
+    # Customers wait per backend so a saturated backend never holds slots another could use
+    pending = {backend: [] for backend in backend_limits}
+    for customer_id, details in customers:
+        pending['grafana' if is_grafana_customer(details) else 'zabbix'].append(customer_id)
+    running = {backend: 0 for backend in backend_limits}
+    results = {}
+    condition = threading.Condition()
+    total = len(customers)
+
+    batch_reporter = progress.get_reporter()
+    batch_output = progress.get_output()
+    batch_priority = progress.get_priority()
+    progress.emit('batch', f"Batch of {total} customers started", done=0, total=total)
+
+    def customer_reporter(customer_id):
+        # Only stage-level events of each customer reach the batch's progress stream
+        def reporter(stage, message, data):
+            if batch_reporter is not None and stage in ('stage', 'png_optimize', 'docx'):
+                batch_reporter(stage, f"[{customer_id}] {message}", dict(data, customer=customer_id))
+        return reporter
+
+    def run_customer(backend, customer_id):
+        progress.set_reporter(customer_reporter(customer_id))
+        progress.set_output(batch_output)
+        progress.set_priority(batch_priority)
+        try:
+            if backend == 'grafana':
+                result = export_and_generate_grafana_report(
+                    month, year, customer_id, llama_selected, base_directory, optimize_png, keep_original_png, analysis_mode
+                )
+            else:
+                result = export_and_generate_report(month, year, customer_id, base_directory, optimize_png, keep_original_png)
+        except Exception as e:
+            traceback.print_exc()
+            result = (False, f"Unexpected error: {str(e)}")
+        finally:
+            progress.set_reporter(None)
+            progress.set_output(None)
+            progress.set_priority(None)
+
+        with condition:
+            results[customer_id] = result
+            running[backend] -= 1
+            failed = sum(1 for ok, _ in results.values() if not ok)
+            condition.notify()
+        if batch_reporter is not None:
+            batch_reporter(
+                'batch', f"{len(results)}/{total} customers done, {failed} failed (last: {customer_id})",
+                {'done': len(results), 'total': total, 'failed': failed}
+            )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with condition:
+            while len(results) < total:
+                started = False
+                for backend, queue in pending.items():
+                    while queue and running[backend] < backend_limits[backend] and sum(running.values()) < max_workers:
+                        running[backend] += 1
+                        executor.submit(run_customer, backend, queue.pop(0))
+                        started = True
+                if not started:
+                    condition.wait()
+
+    failures = [(customer_id, message) for customer_id, (ok, message) in sorted(results.items()) if not ok]
+    summary = f"Batch finished: {total - len(failures)} of {total} customers succeeded."
+    if failures:
+        summary += "\nFailed:\n" + "\n".join(f"- {customer_id}: {message}" for customer_id, message in failures)
+        return False, summary
+    return True, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export graphs and generate reports in one process, for one customer or a batch.")
+    parser.add_argument("--month", type=int, required=True, help="Report month (1-12)")
+    parser.add_argument("--year", type=int, required=True, help="Report year (e.g., 2024)")
+    parser.add_argument("--customer", type=str, nargs='+', help="Customer Project ID(s); several IDs run as a batch")
+    parser.add_argument("--batch", choices=['all', 'grafana'], help="Run every customer, or every Grafana-enabled customer")
+    parser.add_argument("--llama", action='store_true', help="Perform Llama analysis in Grafana reports")
+    parser.add_argument("--analysis-mode", choices=generate_report_grafana.ANALYSIS_MODES,
+                        default=generate_report_grafana.DEFAULT_ANALYSIS_MODE,
+                        help="auto: assess ping, CPU, memory and disk graphs from their data and send only the rest "
+                             "to Llama; vision: send every graph to Llama")
+    parser.add_argument("--optimize-png", action='store_true', help="Losslessly recompress exported graphs before embedding them")
+    parser.add_argument("--keep-original-png", action='store_true', help="Keep each recompressed graph's original as <name>.png.orig")
+    args = parser.parse_args()
+    png_options = {'optimize_png': args.optimize_png, 'keep_original_png': args.keep_original_png}
+
+    if args.batch:
+        success, message = run_batch(
+            args.month, args.year, args.batch, llama_selected=args.llama, analysis_mode=args.analysis_mode, **png_options
+        )
+    elif args.customer and len(args.customer) > 1:
+        success, message = run_batch(
+            args.month, args.year, 'list', args.customer, llama_selected=args.llama, analysis_mode=args.analysis_mode,
+            **png_options
+        )
+    elif args.customer:
+        # Routed like a batch customer: Grafana-enabled customers get the Grafana report
+        customer_dir, details = load_customer(args.customer[0])
+        if details is not None and is_grafana_customer(details):
+            success, message = export_and_generate_grafana_report(
+                args.month, args.year, args.customer[0], args.llama, analysis_mode=args.analysis_mode, **png_options
+            )
+        else:
+            success, message = export_and_generate_report(args.month, args.year, args.customer[0], **png_options)
+    else:
+        parser.error("either --customer or --batch is required")
+    print(message)
+    if not success:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
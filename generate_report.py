@@ -2,10 +2,11 @@ import os
 import re
 import argparse
 import ticket_fetcher
-from docx import Document
+import backend_scheduler
+import progress
+import report_builder
 from docx.shared import Inches
 from datetime import datetime
-from docx.enum.text import WD_BREAK
 from docx.shared import Inches, Pt
 
 def load_customer_details(customer_dir):
@@ -19,13 +20,14 @@ def load_customer_details(customer_dir):
     print(f"Loaded customer details: {details}")
     return details
 
-def find_section_paragraph(doc, section_title):
-    for i, paragraph in enumerate(doc.paragraphs):
-        if section_title in paragraph.text:
-            print(f"Found section '{section_title}' at paragraph index: {i}")
-            return i
-    print(f"Section '{section_title}' not found.")
-    return None
+# Template sentences after which generated content is inserted
+SLA_ANCHOR = "reinforcing IP ServerOne's commitment to operational reliability and service availability."
+GRAPHS_ANCHOR = "The purpose of this section is to illustrate the performance and capacity trends for each system, supporting effective resource planning and ensuring alignment with operational requirements."
+NETWORK_ANCHOR = "This analysis helps identify network performance patterns, ensuring optimal resource allocation and supporting proactive capacity planning."
+ANCHORS = [SLA_ANCHOR, GRAPHS_ANCHOR, NETWORK_ANCHOR, ticket_fetcher.TICKETS_ANCHOR]
+
+# Host sections are built in backend_scheduler's process pool once a report has at least PARALLEL_MIN_HOSTS hosts
+PARALLEL_MIN_HOSTS = 8
 
 def collect_host_sla_data(month_dir):
     sla_data = {}
@@ -47,26 +49,26 @@ def collect_host_sla_data(month_dir):
     return sla_data
 
 
-def insert_host_and_graphs(doc, host_dir, host_full_name, insert_index, sla_data, insert_host_name=True, insert_graph_name=True):
+def build_host_section(host_dir, host_full_name, sla_percentage, heading_style_id, insert_host_name=True, insert_graph_name=True):
+    # May run in a pool process, so messages are returned rather than printed.
+    # Returns (report_builder.Fragment, or None when the host has no graphs, messages).
+    messages = []
+
     # Check if there are any PNG files in the directory
     graph_files = [f for f in os.listdir(host_dir) if f.endswith('.png')]
     if not graph_files:
-        print(f"No graphs found for host '{host_full_name}'. Skipping this host.")
-        return insert_index  # Return the original index without modification
+        messages.append(f"No graphs found for host '{host_full_name}'. Skipping this host.")
+        return None, messages
 
+    fragment = report_builder.Fragment()
     if insert_host_name:
-        print(f"Inserting host '{host_full_name}' at index {insert_index}")
-        # Insert the host name as a heading before insert_index
-        doc.paragraphs[insert_index].insert_paragraph_before(host_full_name, style="Heading 2")
-        insert_index += 1  # Move to the next position
-
-        # Get SLA uptime for the host if available
-        if sla_data:
-            sla_percentage = sla_data.get(host_full_name, None)
-            if sla_percentage:
-                # Insert SLA uptime after host name
-                doc.paragraphs[insert_index].insert_paragraph_before(f"Uptime: {sla_percentage}%")
-                insert_index += 1  # Move to the next position
+        messages.append(f"Inserting host '{host_full_name}'")
+        # Insert the host name as a heading
+        fragment.paragraph(host_full_name, heading_style_id)
+
+        # Insert SLA uptime after host name if available
+        if sla_percentage:
+            fragment.paragraph(f"Uptime: {sla_percentage}%")
 
     # Define the keyword order
     keyword_order = {
@@ -86,32 +88,51 @@ def insert_host_and_graphs(doc, host_dir, host_full_name, insert_index, sla_data
     # Insert each graph in the sorted order
     for filename in sorted_graphs:
         graph_name = re.sub(r"_\d+\.png$", "", filename).replace("_", " ").replace("^", "/")
-        print(f"Inserting graph '{graph_name}' from file '{filename}'")
+        messages.append(f"Inserting graph '{graph_name}' from file '{filename}'")
 
         if insert_graph_name:
-            # Insert graph name before insert_index
-            doc.paragraphs[insert_index].insert_paragraph_before(graph_name)
-            insert_index += 1  # Move to the next position
-
+            fragment.paragraph(graph_name)
 
-        # Insert image before insert_index
-        new_paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-        run = new_paragraph.add_run()
         image_path = os.path.join(host_dir, filename)
-        run.add_picture(image_path, width=Inches(5))
-        print(f"Inserted image '{filename}'")
-        insert_index += 1  # Move to the next position
-
-    return insert_index  # Return the updated insert_index
+        fragment.picture(image_path, width=Inches(5))
+        messages.append(f"Inserted image '{filename}'")
+
+    return fragment, messages
+
+
+def insert_host_sections(point, hosts, sla_data, heading_style_id, insert_host_name=True, insert_graph_name=True,
+                         label="Host"):
+    # hosts: (host_dir, host_full_name, page_break_after) in report order
+    jobs = [
+        (host_dir, host_full_name, sla_data.get(host_full_name) if sla_data else None, heading_style_id,
+         insert_host_name, insert_graph_name)
+        for host_dir, host_full_name, _ in hosts
+    ]
+    if len(jobs) >= PARALLEL_MIN_HOSTS:
+        # Results come back in submission order, so sections are merged as soon as they are ready
+        sections = backend_scheduler.get_process_pool().map(build_host_section, *zip(*jobs), chunksize=4)
+    else:
+        sections = (build_host_section(*job) for job in jobs)
+
+    for (host_dir, host_full_name, page_break_after), (fragment, messages) in zip(hosts, sections):
+        for message in messages:
+            print(message)
+        if fragment is not None:
+            report_builder.insert_fragment(point, fragment)
+            if page_break_after:
+                point.page_break()
+        else:
+            print(f"{label} '{host_full_name}' was skipped, not inserting page break.")
 
 
 
-def generate_report(month, year, customer_id):
+def generate_report(month, year, customer_id, customer_details=None):
     base_dir = f"/home/almalinux/{customer_id}"
     month_dir = os.path.join(base_dir, f"{year}-{str(month).zfill(2)}")
 
     # Load customer details to get Project ID and Project Name
-    customer_details = load_customer_details(base_dir)
+    if customer_details is None:
+        customer_details = load_customer_details(base_dir)
     project_id = customer_details.get("Project ID", "")
     project_name = customer_details.get("Project Name", "")
 
@@ -135,9 +156,6 @@ def generate_report(month, year, customer_id):
         template_path = "template_xnetwork.docx"
         print("Using template without network section: template_xnetwork.docx")
 
-    print(f"Loading template from: {template_path}")
-    doc = Document(template_path)
-
     # Define replacements
     replacements = {
         "<Project ID>": project_id,
@@ -147,102 +165,60 @@ def generate_report(month, year, customer_id):
         "<Today Date>": datetime.now().strftime("%Y-%m-%d"),
     }
 
-    # Apply replacements in the template with custom styles
-    for paragraph in doc.paragraphs:
-        for key, value in replacements.items():
-            if key in paragraph.text:
-                print(f"Replacing '{key}' with '{value}'")
-                for run in paragraph.runs:
-                    if key in run.text:
-                        # Replace the placeholder with the actual value
-                        run.text = run.text.replace(key, value)
-                        # Apply custom styles
-                        run.font.size = Pt(16)  # Set font size (adjust as needed)
-                        run.font.bold = True    # Set text to bold
-
+    # Fill the placeholders and locate the insertion points of the cached template
+    print(f"Loading template from: {template_path}")
+    template = report_builder.load_template(template_path, list(replacements), ANCHORS)
+    doc, points = template.instantiate(replacements)
+    heading_style_id = doc.styles["Heading 2"].style_id
 
     # Collect SLA data
     sla_data = collect_host_sla_data(month_dir)
-
-    # Find the paragraph containing the specified line
-    specified_line = "reinforcing IP ServerOne's commitment to operational reliability and service availability."
-    insert_index = None
-    for i, paragraph in enumerate(doc.paragraphs):
-        if specified_line in paragraph.text:
-            print(f"Found specified line at paragraph index: {i}")
-            insert_index = i + 1  # Insert after this paragraph
-            break
+    progress.emit('sla', f"Collected SLA for {len(sla_data)} hosts", count=len(sla_data))
 
     # Insert host SLA data after the specified line
-    if insert_index is not None:
+    sla_point = points[SLA_ANCHOR]
+    if sla_point is not None:
         for host_name, sla_percentage in sla_data.items():
-            # Create a new paragraph
-            paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
+            paragraph = sla_point.paragraph()
             # Add host name run with bold formatting
             run_host = paragraph.add_run(host_name)
             run_host.font.bold = True
             # Add the rest of the text
             run_sla = paragraph.add_run(f": Uptime {sla_percentage}%")
-            # Increment insert_index
-            insert_index += 1  # Move to the next position
     else:
         print(f"Specified line not found in the document. Cannot insert uptime data.")
 
 
     # Insert graphs and host information
-    section_index = find_section_paragraph(
-        doc,
-        "The purpose of this section is to illustrate the performance and capacity trends for each system, supporting effective resource planning and ensuring alignment with operational requirements."
-    )
-    if section_index is not None:
-        insert_index = section_index + 1
+    graphs_point = points[GRAPHS_ANCHOR]
+    if graphs_point is not None:
         host_dir_names = sorted(os.listdir(month_dir))
-        for idx, host_dir_name in enumerate(host_dir_names):
-            host_dir = os.path.join(month_dir, host_dir_name)
-            if os.path.isdir(host_dir) and host_dir_name != 'network':
-                host_full_name = host_dir_name  # Use the full directory name as the host name
-                insert_index_before = insert_index
-                insert_index = insert_host_and_graphs(doc, host_dir, host_full_name, insert_index, sla_data)
-                # Check if content was inserted
-            if insert_index > insert_index_before:
-                # Insert a page break after each host except the last one
-                if idx < len(host_dir_names) - 1:
-                    paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-                    run = paragraph.add_run()
-                    run.add_break(WD_BREAK.PAGE)
-                    insert_index += 1  # Move to the next position
-            else:
-                print(f"Host '{host_full_name}' was skipped, not inserting page break.")
+        # Use the full directory name as the host name; page break after each host except the last one
+        hosts = [
+            (os.path.join(month_dir, host_dir_name), host_dir_name, idx < len(host_dir_names) - 1)
+            for idx, host_dir_name in enumerate(host_dir_names)
+            if os.path.isdir(os.path.join(month_dir, host_dir_name)) and host_dir_name != 'network'
+        ]
+        insert_host_sections(graphs_point, hosts, sla_data, heading_style_id)
     else:
         print("Section for inserting regular graphs not found.")
 
     # Insert network graphs after specified sentence, if the network template is used
     if use_network_template:
-        network_section_sentence = "This analysis helps identify network performance patterns, ensuring optimal resource allocation and supporting proactive capacity planning."
-        network_section_index = find_section_paragraph(doc, network_section_sentence)
+        network_point = points[NETWORK_ANCHOR]
 
-        if network_section_index is not None:
-            insert_index = network_section_index + 1
+        if network_point is not None:
             if os.path.isdir(network_dir):
                 host_dir_names = [d for d in os.listdir(network_dir) if os.path.isdir(os.path.join(network_dir, d))]
                 if host_dir_names:
-                    for idx, host_dir_name in enumerate(host_dir_names):
-                        host_dir = os.path.join(network_dir, host_dir_name)
-                        host_full_name = host_dir_name
-                        insert_index_before = insert_index
-                        insert_index = insert_host_and_graphs(
-                            doc, host_dir, host_full_name, insert_index, sla_data=None, insert_host_name=False, insert_graph_name=False
-                        )
-                        # Check if content was inserted
-                        if insert_index > insert_index_before:
-                            # Insert a page break after each host except the last one
-                            if idx < len(host_dir_names) - 1:
-                                paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-                                run = paragraph.add_run()
-                                run.add_break(WD_BREAK.PAGE)
-                                insert_index += 1  # Move to the next position
-                        else:
-                            print(f"Network host '{host_full_name}' was skipped, not inserting page break.")
+                    hosts = [
+                        (os.path.join(network_dir, host_dir_name), host_dir_name, idx < len(host_dir_names) - 1)
+                        for idx, host_dir_name in enumerate(host_dir_names)
+                    ]
+                    insert_host_sections(
+                        network_point, hosts, None, heading_style_id, insert_host_name=False, insert_graph_name=False,
+                        label="Network host"
+                    )
                 else:
                     print(f"No network hosts found in {network_dir}")
             else:
@@ -253,11 +229,12 @@ def generate_report(month, year, customer_id):
         print("Skipping network graphs insertion as no network hosts are found.")
 
     # Insert tickets into the document
-    ticket_fetcher.fetch_and_insert_tickets(doc, base_dir, month, year)
+    ticket_fetcher.fetch_and_insert_tickets(doc, base_dir, month, year, points[ticket_fetcher.TICKETS_ANCHOR])
 
     print(f"Saving output to: {output_path}")
     doc.save(output_path)
     print("Report generated successfully.")
+    progress.emit('docx', f"Saved {output_filename}", path=output_path)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate Managed Service Report")
@@ -2,12 +2,13 @@ import os
 import re
 import argparse
 import ticket_fetcher
-from docx import Document
 from docx.shared import Inches, Pt
 from datetime import datetime
-from docx.enum.text import WD_BREAK
-from PIL import Image
 import llama_analysis
+import numeric_analysis
+import grafana_graph_export
+import progress
+import report_builder
 
 def load_customer_details(customer_dir):
     details_path = os.path.join(customer_dir, 'customer_details.txt')
@@ -20,17 +21,20 @@ def load_customer_details(customer_dir):
     print(f"Loaded customer details: {details}")
     return details
 
-def find_section_paragraph(doc, section_title):
-    for i, paragraph in enumerate(doc.paragraphs):
-        if section_title in paragraph.text:
-            print(f"Found section '{section_title}' at paragraph index: {i}")
-            return i
-    print(f"Section '{section_title}' not found.")
-    return None
+# Template sentences after which generated content is inserted
+PING_ANCHOR = "reinforcing IP ServerOne's commitment to operational reliability and service availability."
+GRAPHS_ANCHOR = "The purpose of this section is to illustrate the performance and capacity trends for each system, supporting effective resource planning and ensuring alignment with operational requirements."
+NETWORK_ANCHOR = "This analysis helps identify network performance patterns, ensuring optimal resource allocation and supporting proactive capacity planning."
+ANCHORS = [PING_ANCHOR, GRAPHS_ANCHOR, NETWORK_ANCHOR, ticket_fetcher.TICKETS_ANCHOR]
+
+# 'auto': graphs in numeric_analysis.NUMERIC_CATEGORIES are assessed from their data and only the
+# rest go to the vision model; 'vision': every graph goes to the vision model
+ANALYSIS_MODES = ('auto', 'vision')
+DEFAULT_ANALYSIS_MODE = 'auto'
 
 def insert_image_with_adjusted_width(run, image_path, original_width_in_inches=6.5, min_width_in_inches=2):
-    img = Image.open(image_path)
-    height = img.height
+    # The height comes from the image header; the pixels are never decoded
+    _, height = report_builder.image_size(image_path)
     if height > 1800:
         extra_height = height - 1800
         increments = extra_height // 200
@@ -39,10 +43,49 @@ def insert_image_with_adjusted_width(run, image_path, original_width_in_inches=6
         new_width_in_inches = max(new_width_in_inches, min_width_in_inches)
     else:
         new_width_in_inches = original_width_in_inches
-    run.add_picture(image_path, width=Inches(new_width_in_inches))
+    report_builder.add_picture(run, image_path, Inches(new_width_in_inches))
+
+
+def group_logical_graphs(file_paths):
+    # Shards saved as "<graph> - part i.png" in the same directory form one logical graph
+    groups = {}
+    for file_path in file_paths:
+        graph_name = os.path.basename(file_path).replace('.png', '')
+        logical_name, shard_index = grafana_graph_export.get_logical_graph_name(graph_name)
+        key = (os.path.dirname(file_path), logical_name)
+        groups.setdefault(key, []).append((shard_index or 0, file_path))
+    return [
+        (logical_name, [file_path for _, file_path in sorted(shards)])
+        for (_, logical_name), shards in groups.items()
+    ]
+
+
+def analyze_graph(dashboard_uid, month, year, graph_name, category, image_paths, analysis_mode):
+    # Runs in the report's analysis pool
+    if analysis_mode == 'auto' and category in numeric_analysis.NUMERIC_CATEGORIES:
+        progress.emit('analysis', f"Computing {graph_name} assessment from its data", file=graph_name, numeric=True)
+        analysis_output = numeric_analysis.analyze_graph(dashboard_uid, graph_name, category, month, year)
+        if analysis_output:
+            return analysis_output
+        print(f"No data found for {graph_name}, falling back to Llama analysis.")
+    return llama_analysis.analyze_graph(image_paths, llama_analysis.get_system_prompt(category))
 
 
-def generate_grafana_report(month, year, customer_id, llama_selected=False):
+def insert_analysis(point, analysis_file, analysis_output):
+    with open(analysis_file, 'w') as f:
+        f.write(analysis_output)
+
+    # Insert "Overall assessment" in bold
+    paragraph = point.paragraph()
+    run = paragraph.add_run("Overall assessment")
+    run.font.bold = True
+
+    # Insert the analysis output
+    paragraph = point.paragraph()
+    paragraph.text = analysis_output
+
+
+def generate_grafana_report(month, year, customer_id, llama_selected=False, analysis_mode=DEFAULT_ANALYSIS_MODE):
     base_dir = f"/home/almalinux/{customer_id}"
     month_dir = os.path.join(base_dir, f"{year}-{str(month).zfill(2)}")
 
@@ -69,8 +112,6 @@ def generate_grafana_report(month, year, customer_id, llama_selected=False):
             use_network_template = True
 
     template_path = "template.docx" if use_network_template else "template_xnetwork.docx"
-    print(f"Loading template from: {template_path}")
-    doc = Document(template_path)
 
     # Define replacements
     replacements = {
@@ -81,90 +122,29 @@ def generate_grafana_report(month, year, customer_id, llama_selected=False):
         "<Today Date>": datetime.now().strftime("%Y-%m-%d"),
     }
 
-    # Apply replacements in the template with custom styles
-    for paragraph in doc.paragraphs:
-        for key, value in replacements.items():
-            if key in paragraph.text:
-                print(f"Replacing '{key}' with '{value}'")
-                for run in paragraph.runs:
-                    if key in run.text:
-                        # Replace the placeholder with the actual value
-                        run.text = run.text.replace(key, value)
-                        # Apply custom styles
-                        run.font.size = Pt(16)  # Set font size (adjust as needed)
-                        run.font.bold = True    # Set text to bold
-
-
-    # Find the paragraph containing the specified line
-    specified_line = "reinforcing IP ServerOne's commitment to operational reliability and service availability."
-    insert_index = None
-    for i, paragraph in enumerate(doc.paragraphs):
-        if specified_line in paragraph.text:
-            print(f"Found specified line at paragraph index: {i}")
-            insert_index = i + 1  # Insert after this paragraph
-            break
+    # Fill the placeholders and locate the insertion points of the cached template
+    print(f"Loading template from: {template_path}")
+    template = report_builder.load_template(template_path, list(replacements), ANCHORS)
+    doc, points = template.instantiate(replacements)
+
+    ping_point = points[PING_ANCHOR]
+    graphs_point = points[GRAPHS_ANCHOR]
+    network_point = points[NETWORK_ANCHOR] if use_network_template else None
 
-    if insert_index is not None:
-        # Find the Ping Result graph
-        ping_result_path = None
+    # Find the Ping Result graph (all of its shards, if it was split)
+    ping_result_paths = []
+    if ping_point is not None:
         for root, dirs, files in os.walk(month_dir):
-            for f in files:
-                if f == 'Ping Result.png':
-                    ping_result_path = os.path.join(root, f)
-                    break
-            if ping_result_path:
+            ping_files = [
+                os.path.join(root, f) for f in files
+                if f.endswith('.png') and grafana_graph_export.get_logical_graph_name(f.replace('.png', ''))[0] == 'Ping Result'
+            ]
+            if ping_files:
+                ping_result_paths = group_logical_graphs(ping_files)[0][1]
                 break
 
-        if ping_result_path and os.path.isfile(ping_result_path):
-            print(f"Inserting Ping Result panel from: {ping_result_path}")
-            # Insert picture name (without '.png'), make it bold and bigger
-            paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-            run = paragraph.add_run("Ping Result")
-            run.font.bold = True
-            run.font.size = Pt(13)  # Adjust size as needed
-            insert_index += 1
-
-            # Insert the picture
-            new_paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-            run = new_paragraph.add_run()
-            insert_image_with_adjusted_width(run, ping_result_path)
-            insert_index += 1
-        else:
-            print(f"Ping Result graph not found.")
-
-        if llama_selected:
-            prompt = llama_analysis.get_system_prompt('Ping_Result')
-            print("Performing Llama analysis for Ping Result...")
-            analysis_output = llama_analysis.perform_llama_analysis(ping_result_path, prompt)
-            if analysis_output:
-                # Save the analysis output to a text file in the same directory as the PNG
-                analysis_file = os.path.join(os.path.dirname(ping_result_path), "Ping_Result_analysis.txt")
-                with open(analysis_file, 'w') as f:
-                    f.write(analysis_output)
-
-                # Insert "Overall assessment" in bold
-                paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-                run = paragraph.add_run("Overall assessment")
-                run.font.bold = True
-                insert_index += 1
-
-                # Insert the analysis output
-                paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-                paragraph.text = analysis_output
-                insert_index += 1
-            else:
-                print("Llama analysis failed for Ping Result.")
-
-    else:
-        print(f"Specified line not found in the document. Cannot insert Ping Result panel.")
-
-    # Find the section where to insert the graphs
-    section_title = "The purpose of this section is to illustrate the performance and capacity trends for each system, supporting effective resource planning and ensuring alignment with operational requirements."
-    section_index = find_section_paragraph(doc, section_title)
-
-    if section_index is not None:
-        insert_index = section_index + 1
-
+    sorted_graphs = []
+    if graphs_point is not None:
         # Collect graphs from month_dir and its subdirectories, excluding 'Ping Result.png' and 'network' directory
         graph_files = []
         for root, dirs, files in os.walk(month_dir):
@@ -172,7 +152,7 @@ def generate_grafana_report(month, year, customer_id, llama_selected=False):
             if os.path.basename(root).lower() in ['network', 'network_traffic']:
                 continue
             for f in files:
-                if f.endswith('.png') and f != "Ping Result.png":
+                if f.endswith('.png') and grafana_graph_export.get_logical_graph_name(f.replace('.png', ''))[0] != "Ping Result":
                     file_path = os.path.join(root, f)
                     graph_files.append(file_path)
 
@@ -186,127 +166,149 @@ def generate_grafana_report(month, year, customer_id, llama_selected=False):
             "Network Usage": 6
         }
 
-        def get_sort_order(file_path):
-            filename = os.path.basename(file_path)
-            graph_name = filename.replace('.png', '')
+        def get_sort_order(logical_graph):
+            graph_name = logical_graph[0]
             return keyword_order.get(graph_name, float('inf'))
 
-        sorted_graphs = sorted(graph_files, key=get_sort_order)
-
-
-        for idx, file_path in enumerate(sorted_graphs):
-            filename = os.path.basename(file_path)
-            graph_name = filename.replace('.png', '')
-            category = os.path.basename(os.path.dirname(file_path))
-            
-            # Insert picture name (without '.png'), make it bold and bigger
-            paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-            run = paragraph.add_run(graph_name)
-            run.font.bold = True
-            run.font.size = Pt(13)  # Adjust size as needed
-            insert_index += 1
-
-            # Insert the picture
-            new_paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-            run = new_paragraph.add_run()
-            insert_image_with_adjusted_width(run, file_path)
-            insert_index += 1
-
-            if llama_selected:
-                # Perform Llama analysis
-                prompt = llama_analysis.get_system_prompt(category)
-                print(f"Performing Llama analysis for {graph_name}...")
-                analysis_output = llama_analysis.perform_llama_analysis(file_path, prompt)
+        # Shards of the same graph are inserted together under one title
+        sorted_graphs = sorted(group_logical_graphs(graph_files), key=get_sort_order)
+
+    network_graph = None
+    if network_point is not None:
+        # Assume network graphs are in network_dir
+        network_graph_files = [
+            os.path.join(network_category_dir, f) for f in os.listdir(network_category_dir)
+            if f.endswith('.png') and os.path.isfile(os.path.join(network_category_dir, f))
+        ]
+        if network_graph_files:
+            # We assume there is only one network graph, possibly split into shards
+            network_graph = group_logical_graphs(network_graph_files)[0]
+
+    # Submit every analysis before building the document; results are picked up in graph order below
+    analyses = None
+    ping_analysis = network_analysis = None
+    graph_analyses = []
+    if llama_selected:
+        analyses = llama_analysis.GraphAnalyses()
+        dashboard_uid = customer_details.get("Dashboard UID")
+        if ping_result_paths:
+            print("Performing analysis for Ping Result...")
+            ping_analysis = analyses.submit_call(
+                analyze_graph, dashboard_uid, month, year, 'Ping Result', 'Ping_Result', ping_result_paths, analysis_mode
+            )
+        for graph_name, file_paths in sorted_graphs:
+            category = os.path.basename(os.path.dirname(file_paths[0]))
+            print(f"Performing analysis for {graph_name}...")
+            graph_analyses.append(analyses.submit_call(
+                analyze_graph, dashboard_uid, month, year, graph_name, category, file_paths, analysis_mode
+            ))
+        if network_graph is not None:
+            category = 'Network_Traffic'  # Or adjust based on your directory naming
+            print("Performing analysis for Network Traffic graph...")
+            network_analysis = analyses.submit_call(
+                analyze_graph, dashboard_uid, month, year, network_graph[0], category, network_graph[1], analysis_mode
+            )
+
+    try:
+        if ping_point is not None:
+            if ping_result_paths:
+                print(f"Inserting Ping Result panel from: {', '.join(ping_result_paths)}")
+                # Insert picture name (without '.png'), make it bold and bigger
+                paragraph = ping_point.paragraph()
+                run = paragraph.add_run("Ping Result")
+                run.font.bold = True
+                run.font.size = Pt(13)  # Adjust size as needed
+
+                # Insert the picture(s)
+                for ping_result_path in ping_result_paths:
+                    new_paragraph = ping_point.paragraph()
+                    run = new_paragraph.add_run()
+                    insert_image_with_adjusted_width(run, ping_result_path)
+            else:
+                print(f"Ping Result graph not found.")
+
+            if ping_analysis is not None:
+                analysis_output = analyses.result(ping_analysis)
                 if analysis_output:
                     # Save the analysis output to a text file in the same directory as the PNG
-                    analysis_file = os.path.join(os.path.dirname(file_path), f"{graph_name}_analysis.txt")
-                    with open(analysis_file, 'w') as f:
-                        f.write(analysis_output)
-
-                    # Insert "Overall assessment" in bold
-                    paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-                    run = paragraph.add_run("Overall assessment")
-                    run.font.bold = True
-                    insert_index += 1
-
-                    # Insert the analysis output
-                    paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-                    paragraph.text = analysis_output
-                    insert_index += 1
+                    analysis_file = os.path.join(os.path.dirname(ping_result_paths[0]), "Ping_Result_analysis.txt")
+                    insert_analysis(ping_point, analysis_file, analysis_output)
                 else:
-                    print(f"Llama analysis failed for {graph_name}.")
+                    print("Llama analysis failed for Ping Result.")
 
-            # Insert page break after each graph, including the last one
-            paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-            run = paragraph.add_run()
-            run.add_break(WD_BREAK.PAGE)
-            insert_index += 1
+        else:
+            print(f"Specified line not found in the document. Cannot insert Ping Result panel.")
+
+        # Insert the graphs
+        if graphs_point is not None:
+            for idx, (graph_name, file_paths) in enumerate(sorted_graphs):
+                # Insert picture name (without '.png'), make it bold and bigger
+                paragraph = graphs_point.paragraph()
+                run = paragraph.add_run(graph_name)
+                run.font.bold = True
+                run.font.size = Pt(13)  # Adjust size as needed
+
+                # Insert the picture(s)
+                for file_path in file_paths:
+                    new_paragraph = graphs_point.paragraph()
+                    run = new_paragraph.add_run()
+                    insert_image_with_adjusted_width(run, file_path)
 
-    else:
-        print("Section for inserting graphs not found.")
-
-    # Insert network graph if any
-    if use_network_template:
-        network_section_sentence = "This analysis helps identify network performance patterns, ensuring optimal resource allocation and supporting proactive capacity planning."
-        network_section_index = find_section_paragraph(doc, network_section_sentence)
-        if network_section_index is not None:
-            insert_index = network_section_index + 1
-            # Assume network graphs are in network_dir
-            network_graph_files = [f for f in os.listdir(network_category_dir) if f.endswith('.png') and os.path.isfile(os.path.join(network_category_dir, f))]
-            if network_graph_files:
-                # We assume there is only one network graph
-                filename = network_graph_files[0]
-                # Do not insert graph name for network graph
-                # Insert picture
-                new_paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-                run = new_paragraph.add_run()
-                image_path = os.path.join(network_category_dir, filename)
-                insert_image_with_adjusted_width(run, image_path)
-                insert_index += 1
-                
                 if llama_selected:
-                    # Perform Llama analysis for the network graph
-                    category = 'Network_Traffic'  # Or adjust based on your directory naming
-                    prompt = llama_analysis.get_system_prompt(category)
-                    print("Performing Llama analysis for Network Traffic graph...")
-                    analysis_output = llama_analysis.perform_llama_analysis(image_path, prompt)
+                    analysis_output = analyses.result(graph_analyses[idx])
                     if analysis_output:
                         # Save the analysis output to a text file in the same directory as the PNG
-                        analysis_file = os.path.join(network_category_dir, f"{filename.replace('.png', '')}_analysis.txt")
-                        with open(analysis_file, 'w') as f:
-                            f.write(analysis_output)
-
-                        # Insert "Overall assessment" in bold
-                        paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-                        run = paragraph.add_run("Overall assessment")
-                        run.font.bold = True
-                        insert_index += 1
-
-                        # Insert the analysis output
-                        paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-                        paragraph.text = analysis_output
-                        insert_index += 1
+                        analysis_file = os.path.join(os.path.dirname(file_paths[0]), f"{graph_name}_analysis.txt")
+                        insert_analysis(graphs_point, analysis_file, analysis_output)
                     else:
-                        print("Llama analysis failed for Network Traffic graph.")
+                        print(f"Llama analysis failed for {graph_name}.")
 
-                # Insert page break after the network graph
-                paragraph = doc.paragraphs[insert_index].insert_paragraph_before()
-                run = paragraph.add_run()
-                run.add_break(WD_BREAK.PAGE)
-                insert_index += 1
+                # Insert page break after each graph, including the last one
+                graphs_point.page_break()
+
+        else:
+            print("Section for inserting graphs not found.")
+
+        # Insert network graph if any
+        if use_network_template:
+            if network_point is not None:
+                if network_graph is not None:
+                    graph_name, image_paths = network_graph
+                    # Do not insert graph name for network graph
+                    # Insert picture(s)
+                    for image_path in image_paths:
+                        new_paragraph = network_point.paragraph()
+                        run = new_paragraph.add_run()
+                        insert_image_with_adjusted_width(run, image_path)
+
+                    if network_analysis is not None:
+                        analysis_output = analyses.result(network_analysis)
+                        if analysis_output:
+                            # Save the analysis output to a text file in the same directory as the PNG
+                            analysis_file = os.path.join(network_category_dir, f"{graph_name}_analysis.txt")
+                            insert_analysis(network_point, analysis_file, analysis_output)
+                        else:
+                            print("Llama analysis failed for Network Traffic graph.")
+
+                    # Insert page break after the network graph
+                    network_point.page_break()
+                else:
+                    print("No network graphs found.")
             else:
-                print("No network graphs found.")
+                print("Network section not found in the template.")
         else:
-            print("Network section not found in the template.")
-    else:
-        print("Skipping network graphs insertion as no network hosts are found.")
+            print("Skipping network graphs insertion as no network hosts are found.")
+    finally:
+        if analyses is not None:
+            analyses.close()
 
     # Insert tickets into the document
-    ticket_fetcher.fetch_and_insert_tickets(doc, base_dir, month, year)
+    ticket_fetcher.fetch_and_insert_tickets(doc, base_dir, month, year, points[ticket_fetcher.TICKETS_ANCHOR])
 
     print(f"Saving output to: {output_path}")
     doc.save(output_path)
     print("Grafana report generated successfully.")
+    progress.emit('docx', f"Saved {output_filename}", path=output_path)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate Grafana Managed Service Report")
@@ -314,6 +316,9 @@ if __name__ == "__main__":
     parser.add_argument("--year", type=int, required=True, help="Report year (e.g., 2024)")
     parser.add_argument("--customer", type=str, required=True, help="Customer Project ID")
     parser.add_argument("--llama", action='store_true', help="Perform Llama analysis on graphs")
+    parser.add_argument("--analysis-mode", choices=ANALYSIS_MODES, default=DEFAULT_ANALYSIS_MODE,
+                        help="auto: assess ping, CPU, memory and disk graphs from their data and send only the rest "
+                             "to Llama; vision: send every graph to Llama")
 
     args = parser.parse_args()
-    generate_grafana_report(args.month, args.year, args.customer, args.llama)
+    generate_grafana_report(args.month, args.year, args.customer, args.llama, args.analysis_mode)
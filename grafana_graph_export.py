@@ -6,6 +6,9 @@ from datetime import datetime, timezone
 import calendar
 import urllib3
 import shutil
+import re
+import progress
+import backend_scheduler
 
 # Disable SSL warnings if you are using self-signed certificates
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -22,8 +25,54 @@ BASE_DIRECTORY = "/home/almalinux"
 # Minimum content length to consider that the graph has data
 MIN_CONTENT_LENGTH = 10000  # Adjust this value as needed (in bytes)
 
+# Sharded panels created by grafana_create.py are titled "<title> (i/n)"
+SHARD_TITLE_PATTERN = re.compile(r'^(.*) \((\d+)/(\d+)\)$')
+# Shards are saved as "<title> - part i.png" next to each other
+SHARD_FILE_PATTERN = re.compile(r'^(.*) - part (\d+)$')
+
 # ------------------------------------------------------
 
+def split_shard_title(panel_title):
+    match = SHARD_TITLE_PATTERN.match(panel_title)
+    if match:
+        return match.group(1), int(match.group(2))
+    return panel_title, None
+
+
+def get_logical_graph_name(graph_name):
+    # Map a saved graph name (file name without '.png') to its logical graph and shard number
+    match = SHARD_FILE_PATTERN.match(graph_name)
+    if match:
+        return match.group(1), int(match.group(2))
+    return graph_name, None
+
+
+def get_panel_graph_name(panel_title):
+    # Returns (title, file-safe title, shard number) of the logical graph a panel is saved as
+    # Remove host group name from panel title if it exists
+    if ' for ' in panel_title:
+        panel_title = panel_title.split(' for ')[0].strip()
+
+    # Shards of one criterion are saved as parts of the same logical graph
+    panel_title, shard_index = split_shard_title(panel_title)
+
+    panel_title_safe = ''.join(c for c in panel_title if c.isalnum() or c in (' ', '_', '-')).rstrip()
+    return panel_title, panel_title_safe, shard_index
+
+
+def get_month_range(specified_month, specified_year):
+    # Start and end of the specified month as Unix timestamps in milliseconds
+    first_day = datetime(specified_year, specified_month, 1, tzinfo=timezone.utc)
+    last_day = datetime(
+        specified_year,
+        specified_month,
+        calendar.monthrange(specified_year, specified_month)[1],
+        23, 59, 59,
+        tzinfo=timezone.utc
+    )
+    return int(first_day.timestamp() * 1000), int(last_day.timestamp() * 1000)
+
+
 def get_category_from_title(panel_title):
     title_lower = panel_title.lower()
     if 'cpu' in title_lower:
@@ -44,27 +93,13 @@ def get_category_from_title(panel_title):
         return 'Others'
 
 
-def main():
-    # Parse command-line arguments
-    parser = argparse.ArgumentParser(description="Export Grafana graphs for a specified month and customer.")
-    parser.add_argument("--month", type=int, required=True, help="Month for which to export data (1-12)")
-    parser.add_argument("--year", type=int, required=True, help="Year for which to export data (e.g., 2024)")
-    parser.add_argument("--customer", type=str, required=True, help="Customer ID or directory name")
-    args = parser.parse_args()
-
-    specified_month = args.month
-    specified_year = args.year
-    project_id = args.customer
-
-    base_directory = BASE_DIRECTORY
-    customer_dir = os.path.join(base_directory, project_id)
-    if not os.path.isdir(customer_dir) or not os.path.isfile(os.path.join(customer_dir, "customer_details.txt")):
-        print(f"Customer directory '{customer_dir}' not found or missing 'customer_details.txt'.", file=sys.stderr)
-        sys.exit(1)
+def export_grafana_graphs(customer_dir, specified_month, specified_year, details=None):
+    project_id = os.path.basename(os.path.normpath(customer_dir))
 
-    # Load customer details
-    with open(os.path.join(customer_dir, "customer_details.txt"), "r") as f:
-        details = dict(line.strip().split(": ", 1) for line in f if ": " in line)
+    # Load customer details unless the caller already did
+    if details is None:
+        with open(os.path.join(customer_dir, "customer_details.txt"), "r") as f:
+            details = dict(line.strip().split(": ", 1) for line in f if ": " in line)
 
     dashboard_uid = details.get("Dashboard UID")
     hostgroup_name = details.get("Host Group Name")
@@ -76,17 +111,7 @@ def main():
         print("Host Group Name not found in customer_details.txt", file=sys.stderr)
         sys.exit(1)
 
-    # Calculate start and end of the specified month as Unix timestamps in milliseconds
-    first_day = datetime(specified_year, specified_month, 1, tzinfo=timezone.utc)
-    last_day = datetime(
-        specified_year,
-        specified_month,
-        calendar.monthrange(specified_year, specified_month)[1],
-        23, 59, 59,
-        tzinfo=timezone.utc
-    )
-    FROM_TS = int(first_day.timestamp() * 1000)
-    TO_TS = int(last_day.timestamp() * 1000)
+    FROM_TS, TO_TS = get_month_range(specified_month, specified_year)
 
     # Create output directory for the specified month and year
     output_dir = os.path.join(customer_dir, f"{specified_year}-{specified_month:02d}")
@@ -104,7 +129,8 @@ def main():
 
     # Fetch the dashboard JSON
     dashboard_url = f'{BASE_URL}/api/dashboards/uid/{dashboard_uid}'
-    response = requests.get(dashboard_url, headers=headers, verify=False)
+    with backend_scheduler.slot('grafana_api'):
+        response = requests.get(dashboard_url, headers=headers, verify=False)
 
     if response.status_code != 200:
         print(f'Failed to get dashboard: {response.status_code}, {response.text}')
@@ -127,14 +153,15 @@ def main():
     # panels_with_categories = get_panels(dashboard_json['dashboard']['panels'])
 
     # Iterate over each panel and download the graph image
-    for panel in dashboard_json['dashboard']['panels']:
+    panels = dashboard_json['dashboard']['panels']
+    progress.emit('panels', f"Found {len(panels)} panels on dashboard {dashboard_uid}", count=len(panels))
+    for panel_index, panel in enumerate(panels, start=1):
         panel_id = panel['id']
         panel_title = panel.get('title', f'panel_{panel_id}')
-        # Remove host group name from panel title if it exists
-        if ' for ' in panel_title:
-            panel_title = panel_title.split(' for ')[0].strip()
-            
-        panel_title_safe = ''.join(c for c in panel_title if c.isalnum() or c in (' ', '_', '-')).rstrip()
+        progress.emit('graphs', f"Rendering panel {panel_index}/{len(panels)}: {panel_title}", done=panel_index - 1, total=len(panels))
+        panel_title, panel_title_safe, shard_index = get_panel_graph_name(panel_title)
+        if shard_index is not None:
+            panel_title_safe = f"{panel_title_safe} - part {shard_index}"
 
         # Get category based on panel title
         category = get_category_from_title(panel_title)
@@ -184,7 +211,8 @@ def main():
             'tz': 'UTC',
         }
 
-        render_response = requests.get(render_url, headers=headers, params=params, verify=False)
+        with backend_scheduler.slot('grafana_renderer'):
+            render_response = requests.get(render_url, headers=headers, params=params, verify=False)
 
         if render_response.status_code == 200:
             # Check if the graph has data
@@ -207,5 +235,21 @@ def main():
 
     print(f"Graphs saved to '{output_dir}' for customer '{project_id}'.")
 
+
+def main():
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="Export Grafana graphs for a specified month and customer.")
+    parser.add_argument("--month", type=int, required=True, help="Month for which to export data (1-12)")
+    parser.add_argument("--year", type=int, required=True, help="Year for which to export data (e.g., 2024)")
+    parser.add_argument("--customer", type=str, required=True, help="Customer ID or directory name")
+    args = parser.parse_args()
+
+    customer_dir = os.path.join(BASE_DIRECTORY, args.customer)
+    if not os.path.isdir(customer_dir) or not os.path.isfile(os.path.join(customer_dir, "customer_details.txt")):
+        print(f"Customer directory '{customer_dir}' not found or missing 'customer_details.txt'.", file=sys.stderr)
+        sys.exit(1)
+
+    export_grafana_graphs(customer_dir, args.month, args.year)
+
 if __name__ == "__main__":
     main()
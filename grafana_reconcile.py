@@ -0,0 +1,254 @@
+import os
+import sys
+import argparse
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import grafana_create
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Disable warnings for insecure HTTPS requests
+requests.packages.urllib3.disable_warnings()
+
+# Grafana API details
+GRAFANA_BASE_URL = "<GRAFANA_URL>"
+GRAFANA_API_KEY = "<GRAFANA_API>"  # Replace with your Grafana API key
+
+# Base directory where customer directories are located
+BASE_DIRECTORY = "/home/almalinux"
+
+# Number of customers reconciled at the same time
+MAX_WORKERS = 8
+
+
+def load_customer_details(customer_dir):
+    details = {}
+    with open(os.path.join(customer_dir, "customer_details.txt"), "r") as f:
+        for line in f:
+            if ": " in line:
+                key, value = line.strip().split(": ", 1)
+                details[key.strip()] = value.strip()
+    return details
+
+
+def find_grafana_customers(base_directory, customer_ids=None):
+    # Collect every customer with Grafana selected and a dashboard already created
+    customers = []
+    for name in sorted(os.listdir(base_directory)):
+        if customer_ids and name not in customer_ids:
+            continue
+        customer_dir = os.path.join(base_directory, name)
+        if not os.path.isfile(os.path.join(customer_dir, "customer_details.txt")):
+            continue
+        try:
+            details = load_customer_details(customer_dir)
+        except Exception as e:
+            logger.error(f"Error reading customer details for '{name}': {e}")
+            continue
+        if details.get("Grafana Selected") != "Yes" or not details.get("Dashboard UID"):
+            continue
+        if not details.get("Host Group Name"):
+            logger.warning(f"Customer '{name}' has no Host Group Name, skipping.")
+            continue
+        customers.append((name, details))
+    return customers
+
+
+def get_server_tags_and_racks(details):
+    server_tags = []
+    racks = []
+    i = 1
+    while True:
+        server_tag = details.get(f"Server Tag {i}")
+        rack = details.get(f"Rack {i}")
+        if not server_tag or not rack:
+            break
+        server_tags.append(server_tag)
+        racks.append(rack)
+        i += 1
+    return server_tags, racks
+
+
+def get_group_membership(auth_token, group_names):
+    # Resolve all host groups with one hostgroup.get call
+    payload = {
+        "jsonrpc": "2.0",
+        "method": "hostgroup.get",
+        "params": {
+            "output": ["groupid", "name"],
+            "filter": {"name": list(group_names)}
+        },
+        "auth": auth_token,
+        "id": 2
+    }
+    response = requests.post(grafana_create.zabbix_url, json=payload, verify=False)
+    response.raise_for_status()
+    groups = response.json().get('result', [])
+    membership = {group['name']: [] for group in groups}
+    if not groups:
+        return membership
+
+    # Fetch the hosts of every group with one host.get call
+    payload = {
+        "jsonrpc": "2.0",
+        "method": "host.get",
+        "params": {
+            "output": ["hostid", "host"],
+            "groupids": [group['groupid'] for group in groups],
+            "selectGroups": ["name"]
+        },
+        "auth": auth_token,
+        "id": 3
+    }
+    response = requests.post(grafana_create.zabbix_url, json=payload, verify=False)
+    response.raise_for_status()
+    for host in response.json().get('result', []):
+        for group in host.get('groups', []):
+            if group['name'] in membership:
+                membership[group['name']].append({'hostid': host['hostid'], 'host': host['host']})
+    return membership
+
+
+def get_dashboard(session, dashboard_uid):
+    response = session.get(f"{GRAFANA_BASE_URL}/api/dashboards/uid/{dashboard_uid}")
+    if response.status_code != 200:
+        logger.error(f"Failed to get dashboard {dashboard_uid}: {response.status_code}, {response.text}")
+        return None
+    return response.json()
+
+
+def get_dashboard_targets(dashboard_json):
+    # (panel title, host, item) of every query on the dashboard, so hosts gaining or
+    # losing items or moving between panels count as drift, not just host membership
+    targets = set()
+    for panel in dashboard_json.get('dashboard', {}).get('panels', []):
+        for target in panel.get('targets', []):
+            targets.add((
+                panel.get('title'),
+                target.get('host', {}).get('filter'),
+                target.get('item', {}).get('filter')
+            ))
+    return targets
+
+
+def detect_drift(expected_dashboard, dashboard_json):
+    expected = get_dashboard_targets(expected_dashboard)
+    current = get_dashboard_targets(dashboard_json)
+    added = expected - current
+    removed = current - expected
+    if added or removed:
+        return True, f"{len(added)} target(s) to add, {len(removed)} to remove"
+
+    expected_panels = [panel['title'] for panel in expected_dashboard['dashboard']['panels']]
+    current_panels = [panel.get('title') for panel in dashboard_json.get('dashboard', {}).get('panels', [])]
+    if sorted(expected_panels) != sorted(current_panels):
+        return True, "panels changed"
+    return False, "up to date"
+
+
+def reconcile_customer(auth_token, session, customer_id, details, group_hosts, dry_run=False, network=None):
+    dashboard_uid = details["Dashboard UID"]
+    host_group_name = details["Host Group Name"]
+
+    if not group_hosts:
+        return customer_id, "skipped", f"host group '{host_group_name}' not found or empty"
+
+    dashboard_json = get_dashboard(session, dashboard_uid)
+    if dashboard_json is None:
+        return customer_id, "failed", f"dashboard {dashboard_uid} could not be fetched"
+
+    # Build the dashboard the customer should have; the same items are pushed on drift
+    host_items_map = grafana_create.collect_host_items(auth_token, group_hosts)
+    server_tags, racks = get_server_tags_and_racks(details)
+    expected_dashboard = grafana_create.prepare_dashboard(
+        host_group_name, group_hosts, host_items_map, server_tags, racks,
+        network=network, dashboard_uid=dashboard_uid
+    )
+    if expected_dashboard is None:
+        return customer_id, "failed", "network hosts could not be collected"
+
+    drifted, reason = detect_drift(expected_dashboard, dashboard_json)
+    if not drifted:
+        return customer_id, "unchanged", reason
+    if dry_run:
+        return customer_id, "drifted", reason
+
+    new_uid, _ = grafana_create.push_dashboard(expected_dashboard)
+    if not new_uid:
+        return customer_id, "failed", f"{reason}, dashboard update failed"
+    return customer_id, "updated", reason
+
+
+def reconcile_dashboards(base_directory, customer_ids=None, max_workers=MAX_WORKERS, dry_run=False):
+    customers = find_grafana_customers(base_directory, customer_ids)
+    if not customers:
+        logger.info("No Grafana-enabled customers found.")
+        return []
+    logger.info(f"Reconciling {len(customers)} Grafana dashboards with {max_workers} workers.")
+
+    auth_token = grafana_create.zabbix_login_api(
+        grafana_create.zabbix_url, grafana_create.zabbix_user, grafana_create.zabbix_password
+    )
+    if not auth_token:
+        return None
+
+    membership = get_group_membership(auth_token, {details["Host Group Name"] for _, details in customers})
+
+    # Log in to the network Zabbix once for every customer with racks
+    network = None
+    if any(all(get_server_tags_and_racks(details)) for _, details in customers):
+        network = grafana_create.network_login()
+        if not network:
+            return None
+
+    session = requests.Session()
+    session.verify = False
+    session.headers.update({
+        'Authorization': f'Bearer {GRAFANA_API_KEY}',
+        'Content-Type': 'application/json',
+    })
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                reconcile_customer, auth_token, session, customer_id, details,
+                membership.get(details["Host Group Name"]), dry_run, network
+            ): customer_id
+            for customer_id, details in customers
+        }
+        for future in as_completed(futures):
+            customer_id = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = (customer_id, "failed", str(e))
+            logger.info(f"{result[0]}: {result[1]} ({result[2]})")
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update Grafana dashboards whose targets drifted from their Zabbix host groups.")
+    parser.add_argument("--customer", action="append", help="Only reconcile this customer (can be repeated)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Number of customers reconciled concurrently")
+    parser.add_argument("--dry-run", action="store_true", help="Report drifted dashboards without updating them")
+    args = parser.parse_args()
+
+    results = reconcile_dashboards(BASE_DIRECTORY, args.customer, max_workers=args.workers, dry_run=args.dry_run)
+    if results is None:
+        sys.exit(1)
+
+    counts = {}
+    for _, status, _ in results:
+        counts[status] = counts.get(status, 0) + 1
+    print(", ".join(f"{status}: {count}" for status, count in sorted(counts.items())) or "Nothing to reconcile.")
+    if counts.get("failed"):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
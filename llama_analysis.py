@@ -1,6 +1,16 @@
+import os
+import time
+import json
 import base64
 import requests
+from io import BytesIO
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
 from requests.exceptions import RequestException, Timeout, ConnectionError
+import backend_scheduler
+import analysis_cache
+import progress
 
 # Define system prompts for different graph types
 SYSTEM_PROMPT_CPU = """
@@ -32,6 +42,49 @@ Give professional IT observation and comment for this monthly provided graph of
 """
 
 LLAMA_API_URL = "<LLAMA_url>"  # The Llama API endpoint
+LLAMA_MODEL = "llama3.2-vision:11b"
+
+# Graphs of one report analyzed at once; the 'llama' pool in backend_scheduler caps requests across reports
+LLAMA_CONCURRENCY = 2
+
+# Seconds to connect and to wait for the next piece of the streamed answer (the first one
+# comes after the images are processed); failed requests are retried with doubling delays
+LLAMA_CONNECT_TIMEOUT = 10
+LLAMA_READ_TIMEOUT = 300
+LLAMA_RETRIES = 2
+LLAMA_BACKOFF_SECONDS = 5
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Budget of one answer: generation stops after LLAMA_MAX_TOKENS tokens or LLAMA_MAX_GENERATION_SECONDS,
+# and the text is cut back to its last full sentence. Partial text is reported every LLAMA_PROGRESS_SECONDS.
+LLAMA_MAX_TOKENS = 1024
+LLAMA_MAX_GENERATION_SECONDS = 240
+LLAMA_PROGRESS_SECONDS = 5
+
+# Shards of one graph sent in a single request. llama3.2-vision takes one image per request,
+# raise this for backends that accept multi-image prompts.
+LLAMA_MAX_IMAGES_PER_REQUEST = 1
+
+# Graphs are downscaled to fit the model's native input (llama3.2-vision works on 1120x1120)
+# before they are sent, since the model would shrink them anyway
+LLAMA_IMAGE_SIZE = 1120
+
+# Tall Grafana panels are mostly legend. With legend tiles on, the plot (the top
+# LLAMA_PLOT_HEIGHT_RATIO x width pixels) and each legend tile are sent as separate images so
+# the legend text stays legible; this needs a backend that accepts several images per request.
+LLAMA_LEGEND_TILES = False
+LLAMA_PLOT_HEIGHT_RATIO = 0.3
+
+# Raw bytes base64-encoded per chunk of the streamed request body (a multiple of 3)
+PAYLOAD_CHUNK_BYTES = 3 * 64 * 1024
+
+# Analyses of unchanged graphs are reused from here (None disables the cache)
+ANALYSIS_CACHE_PATH = "/home/almalinux/.llama/analysis_cache.db"
+ANALYSIS_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+_cache = None
+_cache_unavailable = False
+_cache_lock = threading.Lock()
 
 def get_system_prompt(graph_type):
     if graph_type == 'CPU_Utilization':
@@ -49,58 +102,258 @@ def get_system_prompt(graph_type):
     else:
         return SYSTEM_PROMPT_OTHER
 
-def encode_image_to_base64(image_path):
-    """Convert an image file to a base64 encoded string."""
+def fit_to_model(image):
+    # Only ever downscales; the aspect ratio is kept
+    image = image.copy()
+    image.thumbnail((LLAMA_IMAGE_SIZE, LLAMA_IMAGE_SIZE), Image.Resampling.LANCZOS)
+    return image
+
+def prepare_image(image_path):
+    """Return the PNG bytes to send for one graph: the downscaled graph, or its plot and legend tiles."""
     try:
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        with Image.open(image_path) as image:
+            image = image.convert('RGB')
     except Exception as e:
-        print(f"Error encoding image to base64: {e}")
+        print(f"Error reading image {image_path}: {e}")
         return None
 
-def perform_llama_analysis(image_path, system_prompt):
-    """Perform analysis on the given image using Llama 3.2-Vision."""
-    base64_image = encode_image_to_base64(image_path)
-    if not base64_image:
-        print("Failed to encode image. Skipping Llama analysis.")
-        return None
+    width, height = image.size
+    plot_height = int(width * LLAMA_PLOT_HEIGHT_RATIO)
+    if LLAMA_LEGEND_TILES and height > plot_height + width // 4:
+        # The legend is cut into square tiles below the plot
+        tiles = [image.crop((0, 0, width, plot_height))]
+        for top in range(plot_height, height, width):
+            tiles.append(image.crop((0, top, width, min(top + width, height))))
+    else:
+        tiles = [image]
+
+    encoded = []
+    for tile in tiles:
+        buffer = BytesIO()
+        fit_to_model(tile).save(buffer, 'PNG')
+        encoded.append(buffer.getvalue())
+    return encoded
+
+def iter_payload(payload, images):
+    """Yield the JSON request body with the images base64-encoded chunk by chunk, never as one big string."""
+    yield json.dumps(payload)[:-1].encode('utf-8') + b', "images": ['
+    for index, image in enumerate(images):
+        yield b', "' if index else b'"'
+        for start in range(0, len(image), PAYLOAD_CHUNK_BYTES):
+            yield base64.b64encode(image[start:start + PAYLOAD_CHUNK_BYTES])
+        yield b'"'
+    yield b']}'
+
+def trim_to_sentence(text):
+    # A cut-off answer ends at its last complete sentence, if it has one
+    end = max(text.rfind(mark) for mark in ('.', '!', '?', '\n'))
+    return text[:end + 1].rstrip() if end > 0 else text.rstrip()
+
+def read_stream(response, label):
+    """Collect an Ollama NDJSON stream within the token and time budget.
+
+    Returns (text, complete). complete is False when the answer was cut off by the time budget or
+    the stream ended early, since another attempt could give a different answer.
+    """
+    pieces = []
+    tokens = reported = 0
+    started = last_report = time.monotonic()
+    for line in response.iter_lines():
+        if not line:
+            continue
+        chunk = json.loads(line)
+        if chunk.get("error"):
+            raise ValueError(chunk["error"])
+        pieces.append(chunk.get("response", ""))
+        tokens += 1
+        if chunk.get("done"):
+            if chunk.get("done_reason") == "length":
+                print(f"Llama analysis of {label} reached the {LLAMA_MAX_TOKENS} token limit.")
+                return trim_to_sentence("".join(pieces)), True
+            return "".join(pieces), True
+
+        now = time.monotonic()
+        if tokens >= LLAMA_MAX_TOKENS or now - started >= LLAMA_MAX_GENERATION_SECONDS:
+            print(f"Llama analysis of {label} cut off after {tokens} tokens and {now - started:.0f}s.")
+            # Hitting the token limit gives the same answer every time; the time budget may not
+            return trim_to_sentence("".join(pieces)), tokens >= LLAMA_MAX_TOKENS
+        if now - last_report >= LLAMA_PROGRESS_SECONDS:
+            # Only the text generated since the previous report is sent
+            progress.emit('analysis_partial', f"Generating analysis of {label}: {tokens} tokens",
+                          file=label, tokens=tokens, text="".join(pieces[reported:]))
+            reported = len(pieces)
+            last_report = now
+
+    print(f"Llama analysis of {label} ended before the answer was complete.")
+    return trim_to_sentence("".join(pieces)), False
+
+def generate_analysis(image_paths, system_prompt):
+    """Send one or more images with a prompt to Llama, retrying timeouts, connection errors and server errors.
+
+    Returns (text, complete) as read_stream does, or (None, False) when the analysis failed.
+    """
+    label = ', '.join(os.path.basename(image_path) for image_path in image_paths)
+    images = []
+    for image_path in image_paths:
+        prepared = prepare_image(image_path)
+        if not prepared:
+            print("Failed to encode image. Skipping Llama analysis.")
+            return None, False
+        images.extend(prepared)
 
     headers = {
         'Content-Type': 'application/json'
     }
 
     payload = {
-        "model": "llama3.2-vision:11b",
+        "model": LLAMA_MODEL,
         "role": "user",
         "system": "",
         "template": "",
         "prompt": system_prompt,
-        "images": [base64_image],
-        "stream": False
+        "stream": True,
+        "options": {"num_predict": LLAMA_MAX_TOKENS}
     }
 
+    for attempt in range(LLAMA_RETRIES + 1):
+        if attempt:
+            delay = LLAMA_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            print(f"Retrying Llama analysis in {delay}s (attempt {attempt + 1} of {LLAMA_RETRIES + 1})...")
+            time.sleep(delay)
+        response = None
+        error_body = None
+        try:
+            print("Performing Llama analysis...")
+            with backend_scheduler.slot('llama'):
+                with requests.post(
+                    LLAMA_API_URL,
+                    data=iter_payload(payload, images),
+                    headers=headers,
+                    timeout=(LLAMA_CONNECT_TIMEOUT, LLAMA_READ_TIMEOUT),
+                    stream=True,
+                ) as response:
+                    if response.status_code in RETRY_STATUS_CODES:
+                        print(f"Error: Llama API returned HTTP {response.status_code}.")
+                        continue
+                    if not response.ok:
+                        # Read the server's error body before the with block closes the stream
+                        error_body = response.text
+                    response.raise_for_status()  # Raise an exception for HTTP errors
+                    # The analysis arrives in the 'response' key of each streamed line
+                    return read_stream(response, label)
+        except Timeout:
+            print("Error: Request to Llama API timed out.")
+        except ConnectionError as e:
+            print(f"Error: Failed to connect to Llama API. Details: {e}")
+        except RequestException as e:
+            print(f"Error during Llama API request: {e}")
+            if response is None:
+                print("Response content: No response")
+            elif error_body is not None:
+                print(f"Response content: {error_body}")
+            return None, False
+        except ValueError as e:
+            print(f"Error parsing JSON response from Llama API: {e}")
+            return None, False
+    print(f"Llama analysis gave up after {LLAMA_RETRIES + 1} attempts.")
+    return None, False
+
+def request_llama_analysis(image_paths, system_prompt):
+    """Send one or more images with a prompt to Llama and return the analysis text, or None."""
+    return generate_analysis(image_paths, system_prompt)[0]
+
+def get_cache():
+    # The shared analysis cache, or None when it is disabled or cannot be opened
+    global _cache, _cache_unavailable
+    with _cache_lock:
+        if _cache is None and ANALYSIS_CACHE_PATH and not _cache_unavailable:
+            try:
+                _cache = analysis_cache.AnalysisCache(ANALYSIS_CACHE_PATH, ANALYSIS_CACHE_MAX_BYTES)
+            except Exception as e:
+                print(f"Llama analysis cache unavailable, analyzing every graph: {e}")
+                _cache_unavailable = True
+        return _cache
+
+def preprocessing_signature():
+    # Part of the cache key: the same file prepared differently is a different input
+    if LLAMA_LEGEND_TILES:
+        return f"fit{LLAMA_IMAGE_SIZE}/legend{LLAMA_PLOT_HEIGHT_RATIO}"
+    return f"fit{LLAMA_IMAGE_SIZE}"
+
+def cached_llama_analysis(image_paths, system_prompt):
+    """Like request_llama_analysis, but unchanged images are answered from the analysis cache."""
+    names = ', '.join(os.path.basename(image_path) for image_path in image_paths)
+    cache = get_cache()
+    key = None
+    if cache is not None:
+        try:
+            key = analysis_cache.cache_key(image_paths, system_prompt, LLAMA_MODEL, preprocessing_signature())
+            analysis_output = cache.get(key)
+        except Exception as e:
+            print(f"Error reading the Llama analysis cache: {e}")
+            analysis_output = None
+        if analysis_output is not None:
+            print(f"Reusing cached Llama analysis for {names}")
+            progress.emit('analysis', f"Reused cached analysis of {names}", file=names, cached=True)
+            return analysis_output
+
+    progress.emit('analysis', f"Analyzing {names}", file=names)
+    analysis_output, complete = generate_analysis(image_paths, system_prompt)
+    # Answers cut off by the time budget are used once but not kept
+    if analysis_output and complete and key is not None:
+        try:
+            cache.put(key, LLAMA_MODEL, analysis_output)
+        except Exception as e:
+            print(f"Error writing the Llama analysis cache: {e}")
+    return analysis_output
+
+def perform_llama_analysis(image_path, system_prompt):
+    """Perform analysis on the given image using Llama 3.2-Vision."""
+    return request_llama_analysis([image_path], system_prompt)
+
+def analyze_graph(image_paths, system_prompt):
+    """Analyze every shard of a logical graph and combine the results."""
+    # Shards go into one request when the model accepts several images, otherwise one request each
+    batch_size = max(1, LLAMA_MAX_IMAGES_PER_REQUEST)
+    analyses = []
+    for start in range(0, len(image_paths), batch_size):
+        analysis_output = cached_llama_analysis(image_paths[start:start + batch_size], system_prompt)
+        if analysis_output:
+            analyses.append(analysis_output)
+    return "\n\n".join(analyses) if analyses else None
+
+class GraphAnalyses:
+    """The Llama analyses of one report. Every graph is submitted up front and results are read back in graph order."""
+
+    def __init__(self, max_workers=LLAMA_CONCURRENCY):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llama')
+        self._futures = []
+
+    def submit(self, image_paths, system_prompt):
+        # Returns the index to pass to result()
+        return self.submit_call(analyze_graph, image_paths, system_prompt)
+
+    def submit_call(self, func, *args):
+        # Any other function producing the analysis text of a graph
+        self._futures.append(self._executor.submit(progress.wrap(func), *args))
+        return len(self._futures) - 1
+
+    def result(self, index):
+        # The combined analysis text, or None if it failed
+        try:
+            return self._futures[index].result()
+        except Exception as e:
+            print(f"Error during Llama analysis: {e}")
+            return None
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def analyze_graphs(jobs, max_workers=LLAMA_CONCURRENCY):
+    """Analyze (image_paths, system_prompt) jobs concurrently; results come back in the order of jobs."""
+    analyses = GraphAnalyses(max_workers)
     try:
-        print("Performing Llama analysis...")
-        response = requests.post(
-            LLAMA_API_URL,
-            json=payload,
-            headers=headers,
-        )
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        response_json = response.json()
-        # Extract the analysis from the 'response' key
-        return response_json.get("response", "")
-    except Timeout:
-        print("Error: Request to Llama API timed out.")
-        return None
-    except ConnectionError as e:
-        print(f"Error: Failed to connect to Llama API. Details: {e}")
-        return None
-    except RequestException as e:
-        print(f"Error during Llama API request: {e}")
-        print(f"Response content: {response.content.decode() if response else 'No response'}")
-        return None
-    except ValueError as e:
-        print(f"Error parsing JSON response from Llama API: {e}")
-        print(f"Response content: {response.content.decode() if response else 'No response'}")
-        return None
+        indexes = [analyses.submit(image_paths, system_prompt) for image_paths, system_prompt in jobs]
+        return [analyses.result(index) for index in indexes]
+    finally:
+        analyses.close()
@@ -0,0 +1,134 @@
+import io
+import os
+import sys
+import time
+import argparse
+import threading
+from contextlib import redirect_stdout
+import backend_scheduler
+import llama_analysis
+import llama_stub_server
+import generate_report_grafana
+
+# Runs the Grafana report's analysis path (every graph of a report submitted up front,
+# results collected in graph order) against a Llama endpoint at several concurrency levels,
+# to tune LLAMA_CONCURRENCY, the 'llama' scheduler pool and the timeouts before month-end.
+
+BASE_DIRECTORY = "/home/almalinux"
+
+
+def collect_graphs(directory):
+    # The report's logical graphs: (graph name, category, shard paths)
+    image_paths = []
+    for root, dirs, files in os.walk(directory):
+        image_paths.extend(os.path.join(root, f) for f in sorted(files) if f.endswith('.png'))
+    return [
+        (graph_name, os.path.basename(os.path.dirname(file_paths[0])), file_paths)
+        for graph_name, file_paths in generate_report_grafana.group_logical_graphs(image_paths)
+    ]
+
+
+def run_level(graphs, concurrency, repeat):
+    # One report's worth of analyses (times repeat) at the given concurrency
+    llama_pool = backend_scheduler.get_pool('llama')
+    llama_pool.concurrency = concurrency
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def timed_analysis(graph_name, category, file_paths):
+        started = time.monotonic()
+        analysis_output = generate_report_grafana.analyze_graph(
+            None, None, None, graph_name, category, file_paths, 'vision'
+        )
+        with latencies_lock:
+            latencies.append(time.monotonic() - started)
+        return analysis_output
+
+    jobs = graphs * repeat
+    analyses = llama_analysis.GraphAnalyses(max_workers=concurrency)
+    started = time.monotonic()
+    try:
+        indexes = [analyses.submit_call(timed_analysis, *graph) for graph in jobs]
+        results = [analyses.result(index) for index in indexes]
+    finally:
+        analyses.close()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'graphs': len(jobs),
+        'failed': sum(1 for result in results if not result),
+        'elapsed': elapsed,
+        'per_graph': elapsed / len(jobs),
+        'p50': latencies[len(latencies) // 2],
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        'max': latencies[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Grafana report analysis against a Llama endpoint at several concurrency levels.")
+    parser.add_argument("--directory", type=str, help="Directory of graph PNGs (default: the customer's month directory)")
+    parser.add_argument("--customer", type=str, help="Customer Project ID whose exported graphs are analyzed")
+    parser.add_argument("--month", type=int, help="Report month (1-12)")
+    parser.add_argument("--year", type=int, help="Report year (e.g., 2024)")
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[1, 2, 4], help="Concurrency levels to compare")
+    parser.add_argument("--repeat", type=int, default=1, help="Analyze every graph this many times per level")
+    parser.add_argument("--url", type=str, help="Llama endpoint to benchmark (default: start the bundled stub)")
+    parser.add_argument("--connect-timeout", type=float, default=llama_analysis.LLAMA_CONNECT_TIMEOUT)
+    parser.add_argument("--read-timeout", type=float, default=llama_analysis.LLAMA_READ_TIMEOUT)
+    parser.add_argument("--retries", type=int, default=llama_analysis.LLAMA_RETRIES)
+    parser.add_argument("--backoff", type=float, default=llama_analysis.LLAMA_BACKOFF_SECONDS)
+    parser.add_argument("--verbose", action='store_true', help="Show the analysis output while benchmarking")
+    stub_options = parser.add_argument_group("bundled stub (ignored with --url)")
+    llama_stub_server.add_config_arguments(stub_options)
+    args = parser.parse_args()
+
+    if args.directory:
+        directory = args.directory
+    elif args.customer and args.month and args.year:
+        directory = os.path.join(BASE_DIRECTORY, args.customer, f"{args.year}-{str(args.month).zfill(2)}")
+    else:
+        parser.error("either --directory or --customer, --month and --year are required")
+    graphs = collect_graphs(directory)
+    if not graphs:
+        print(f"No graphs found in {directory}.")
+        sys.exit(1)
+
+    server = None
+    if args.url:
+        llama_analysis.LLAMA_API_URL = args.url
+    else:
+        stub_config = llama_stub_server.config_from_args(args)
+        server = llama_stub_server.start_server(stub_config, port=0)
+        llama_analysis.LLAMA_API_URL = f"http://127.0.0.1:{server.server_address[1]}/api/generate"
+        print(f"Started Llama stub at {llama_analysis.LLAMA_API_URL}")
+
+    # Every request has to reach the endpoint
+    llama_analysis.ANALYSIS_CACHE_PATH = None
+    llama_analysis.LLAMA_CONNECT_TIMEOUT = args.connect_timeout
+    llama_analysis.LLAMA_READ_TIMEOUT = args.read_timeout
+    llama_analysis.LLAMA_RETRIES = args.retries
+    llama_analysis.LLAMA_BACKOFF_SECONDS = args.backoff
+
+    shards = sum(len(file_paths) for _, _, file_paths in graphs)
+    print(f"Benchmarking {len(graphs)} graphs ({shards} images) from {directory}, repeated {args.repeat}x")
+    print(f"{'concurrency':>11} {'graphs':>6} {'failed':>6} {'total s':>8} {'s/graph':>8} {'p50 s':>7} {'p95 s':>7} {'max s':>7}")
+    try:
+        for concurrency in args.concurrency:
+            if args.verbose:
+                result = run_level(graphs, concurrency, args.repeat)
+            else:
+                with redirect_stdout(io.StringIO()):
+                    result = run_level(graphs, concurrency, args.repeat)
+            print(f"{result['concurrency']:>11} {result['graphs']:>6} {result['failed']:>6} {result['elapsed']:>8.2f} "
+                  f"{result['per_graph']:>8.2f} {result['p50']:>7.2f} {result['p95']:>7.2f} {result['max']:>7.2f}")
+    finally:
+        if server is not None:
+            print(f"Stub served: {stub_config.stats()}")
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stand-in for the Ollama /api/generate endpoint used by llama_analysis.py, so report
+# generation can be timed and tuned without the real model. Latency, errors, hangs and
+# streaming are configurable; answers are canned text.
+
+DEFAULT_PORT = 11434
+
+CANNED_WORDS = (
+    "The graph shows stable utilization across all hosts for most of the month. "
+    "A short peak is visible mid-month on one host, returning to normal within the hour. "
+    "No sustained anomalies or capacity concerns are visible for the reported period. "
+).split(" ")
+
+
+class StubConfig:
+    def __init__(self, first_token_seconds=2.0, token_seconds=0.02, tokens=200, jitter=0.2,
+                 error_rate=0.0, hang_rate=0.0, max_parallel=1):
+        self.first_token_seconds = first_token_seconds
+        self.token_seconds = token_seconds
+        self.tokens = tokens
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        # Requests generated at once, like OLLAMA_NUM_PARALLEL; the rest queue
+        self.generating = threading.BoundedSemaphore(max_parallel)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.hangs = 0
+        self.images = 0
+        self.image_bytes = 0
+
+    def vary(self, seconds):
+        return max(0.0, seconds * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'errors': self.errors, 'hangs': self.hangs,
+                    'images': self.images, 'image_bytes': self.image_bytes}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        # llama_analysis streams its request body, so chunked transfer encoding is expected
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data):
+        line = json.dumps(data).encode('utf-8') + b'\n'
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self.send_json(200, {'models': [{'name': 'llama3.2-vision:11b'}]})
+        elif self.path == '/stats':
+            self.send_json(200, self.config.stats())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/api/generate':
+            self.send_json(404, {'error': 'not found'})
+            return
+        config = self.config
+        try:
+            payload = json.loads(self.read_body())
+            images = [base64.b64decode(image, validate=True) for image in payload.get('images', [])]
+        except ValueError as e:
+            self.send_json(400, {'error': f'invalid request: {e}'})
+            return
+
+        roll = random.random()
+        with config.lock:
+            config.requests += 1
+            config.images += len(images)
+            config.image_bytes += sum(len(image) for image in images)
+            if roll < config.error_rate:
+                config.errors += 1
+            elif roll < config.error_rate + config.hang_rate:
+                config.hangs += 1
+
+        if roll < config.error_rate:
+            self.send_json(random.choice((500, 503)), {'error': 'stub: injected failure'})
+            return
+        if roll < config.error_rate + config.hang_rate:
+            # Accept the request and never answer; the client's read timeout has to end it
+            time.sleep(3600)
+            return
+
+        tokens = min(config.tokens, (payload.get('options') or {}).get('num_predict') or config.tokens)
+        stream = payload.get('stream', True)
+        with config.generating:
+            time.sleep(config.vary(config.first_token_seconds))
+            if not stream:
+                time.sleep(config.vary(config.token_seconds * tokens))
+                text = ' '.join(CANNED_WORDS[i % len(CANNED_WORDS)] for i in range(tokens))
+                self.send_json(200, {'model': payload.get('model'), 'response': text, 'done': True})
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            try:
+                for i in range(tokens):
+                    self.write_chunk({'model': payload.get('model'), 'response': CANNED_WORDS[i % len(CANNED_WORDS)] + ' ',
+                                      'done': False})
+                    time.sleep(config.vary(config.token_seconds))
+                done_reason = 'length' if tokens < config.tokens else 'stop'
+                self.write_chunk({'model': payload.get('model'), 'response': '', 'done': True,
+                                  'done_reason': done_reason, 'eval_count': tokens})
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # the client stopped reading at its budget
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping kept-alive or cut-off connections are expected, not errors
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_server(config, host='127.0.0.1', port=DEFAULT_PORT):
+    # Serves in a daemon thread; returns the server (server.shutdown() stops it)
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'config': config})
+    server = StubServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--first-token-seconds", type=float, default=2.0, help="Delay before the first token (image processing)")
+    parser.add_argument("--token-seconds", type=float, default=0.02, help="Delay between streamed tokens")
+    parser.add_argument("--tokens", type=int, default=200, help="Tokens in each answer")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Random +/- fraction applied to every delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500/503")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Fraction of requests that never get an answer")
+    parser.add_argument("--max-parallel", type=int, default=1, help="Requests generated at once (OLLAMA_NUM_PARALLEL)")
+
+
+def config_from_args(args):
+    return StubConfig(args.first_token_seconds, args.token_seconds, args.tokens, args.jitter,
+                      args.error_rate, args.hang_rate, args.max_parallel)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server for testing and benchmarking Llama analysis.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(config_from_args(args), args.host, args.port)
+    print(f"Llama stub listening on http://{args.host}:{args.port}/api/generate (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
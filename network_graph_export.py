@@ -4,6 +4,10 @@ import sys
 import argparse
 from datetime import datetime, timezone
 import calendar
+from concurrent.futures import ThreadPoolExecutor
+import network_topology
+import progress
+import backend_scheduler
 
 # Network Zabbix server details
 ZABBIX_URL = "<NETWORK_ZABBIX_URL>"
@@ -11,6 +15,9 @@ ZABBIX_API_URL = f"{ZABBIX_URL}/api_jsonrpc.php"
 USERNAME = "<NETWORK_ZABBIX_USER>"
 PASSWORD = "<NETWORK_ZABBIX_PASSWORD>"
 
+# Number of graphs downloaded from the network Zabbix at the same time
+MAX_DOWNLOAD_WORKERS = 4
+
 def zabbix_login_api(session):
     payload = {
         "jsonrpc": "2.0",
@@ -19,7 +26,8 @@ def zabbix_login_api(session):
         "id": 1,
         "auth": None
     }
-    response = session.post(ZABBIX_API_URL, json=payload)
+    with backend_scheduler.slot('network_zabbix_api'):
+        response = session.post(ZABBIX_API_URL, json=payload)
     result = response.json()
     if 'result' in result:
         return result['result']
@@ -30,56 +38,14 @@ def zabbix_login_api(session):
 def zabbix_web_login(session):
     login_url = f"{ZABBIX_URL}/index.php"
     data = {"name": USERNAME, "password": PASSWORD, "autologin": 1, "enter": "Sign in"}
-    response = session.post(login_url, data=data)
+    with backend_scheduler.slot('network_zabbix_renderer'):
+        response = session.post(login_url, data=data)
     if "zbx_session" in session.cookies or "zbx_sessionid" in session.cookies:
         print("Successfully logged in to the Zabbix web interface.")
     else:
         print("Failed to log in to the Zabbix web interface.", file=sys.stderr)
         sys.exit(1)
 
-def get_hosts(auth_token, session, rack):
-    payload = {
-        "jsonrpc": "2.0",
-        "method": "host.get",
-        "params": {
-            "output": ["hostid", "host", "name"],
-            "search": {
-                "host": rack,
-                "name": rack
-            },
-            "searchCaseInsensitive": True
-        },
-        "auth": auth_token,
-        "id": 2
-    }
-    print(f"Payload: {payload}")  # Debugging line
-    response = session.post(ZABBIX_API_URL, json=payload)
-    result = response.json()
-    print(f"Response: {result}")  # Debugging line
-    hosts = result.get('result', [])
-    print(f"Retrieved hosts containing rack '{rack}':")
-    for host in hosts:
-        print(f"ID: {host['hostid']}, Host: {host['host']}, Name: {host['name']}")
-    return hosts
-
-def get_graphs(auth_token, session, host_id, server_tag):
-    payload = {
-        "jsonrpc": "2.0",
-        "method": "graph.get",
-        "params": {
-            "output": ["graphid", "name"],
-            "hostids": host_id,
-            "search": {
-                "name": server_tag
-            },
-            "searchCaseInsensitive": True
-        },
-        "auth": auth_token,
-        "id": 3
-    }
-    response = session.post(ZABBIX_API_URL, json=payload)
-    return response.json().get('result', [])
-
 def download_graph(session, graph_id, stime, etime, output_path):
     graph_url = f"{ZABBIX_URL}/chart2.php"
 
@@ -97,30 +63,33 @@ def download_graph(session, graph_id, stime, etime, output_path):
 
     print(f"Downloading graph with parameters: {params}")
 
-    response = session.get(graph_url, params=params, stream=True)
+    with backend_scheduler.slot('network_zabbix_renderer'):
+        response = session.get(graph_url, params=params, stream=True)
 
     if response.headers.get('Content-Type', '').startswith('image/'):
         with open(output_path, 'wb') as img_file:
             img_file.write(response.content)
         print(f"Graph {graph_id} saved to {output_path}")
     else:
+        network_topology.check_chart_session(response)
         print(f"Failed to download graph {graph_id}. Received non-image content.")
         print(f"Response status code: {response.status_code}")
         print("Response content (for debugging):", response.text)
         print(f"Request URL: {response.url}")
 
-def export_network_graphs(customer_dir, specified_month, specified_year):
-    # Load customer details
-    details_path = os.path.join(customer_dir, "customer_details.txt")
-    if not os.path.isfile(details_path):
-        print(f"Customer details file not found at {details_path}")
-        sys.exit(1)
-    with open(details_path, "r") as f:
-        details = {}
-        for line in f:
-            if ": " in line:
-                key, value = line.strip().split(": ", 1)
-                details[key.strip()] = value.strip()
+def export_network_graphs(customer_dir, specified_month, specified_year, session=None, auth_token=None, details=None):
+    # Load customer details unless the caller already did
+    if details is None:
+        details_path = os.path.join(customer_dir, "customer_details.txt")
+        if not os.path.isfile(details_path):
+            print(f"Customer details file not found at {details_path}")
+            sys.exit(1)
+        with open(details_path, "r") as f:
+            details = {}
+            for line in f:
+                if ": " in line:
+                    key, value = line.strip().split(": ", 1)
+                    details[key.strip()] = value.strip()
 
     # Set up output directory under 'network' subdirectory
     output_dir = os.path.join(customer_dir, f"{specified_year}-{specified_month:02d}", "network")
@@ -167,42 +136,30 @@ def export_network_graphs(customer_dir, specified_month, specified_year):
     print(f"Start time (stime): {stime} ({first_day})")
     print(f"End time (etime): {etime} ({last_day})")
 
-    # Create session and authenticate
-    session = requests.Session()
-    auth_token = zabbix_login_api(session)
-    zabbix_web_login(session)
+    # Create session and authenticate, unless an already logged-in session is shared
+    if session is None:
+        session = requests.Session()
+        auth_token = zabbix_login_api(session)
+        zabbix_web_login(session)
 
-    # For each server tag and rack, get hosts and graphs
+    # Resolve every server tag and rack up front from the cached network topology.
+    # Keyed by output file: a host or graph matched by several (server tag, rack) pairs is
+    # downloaded once, so no two workers write the same file
+    downloads = {}
     for idx, (server_tag, rack) in enumerate(zip(server_tags, racks), start=1):
         print(f"Processing Rack {idx}: '{rack}' and Server Tag {idx}: '{server_tag}'")
-        # Initialize hosts as empty list
-        hosts = []
-
-        # Check if the rack starts with 'MAH-'
-        if rack.startswith('MAH-'):
-            # Try searching for hosts with 'MAH-<Anything>'
-            hosts = get_hosts(auth_token, session, rack)
-            if not hosts:
-                # If no hosts found, try 'AIMS-<Anything>'
-                aims_rack = 'AIMS-' + rack[len('MAH-'):]
-                print(f"No hosts found for '{rack}', trying '{aims_rack}'")
-                hosts = get_hosts(auth_token, session, aims_rack)
-        else:
-            # For other racks, search as usual
-            hosts = get_hosts(auth_token, session, rack)
+        tagged_hosts = network_topology.find_tagged_graphs(session, ZABBIX_API_URL, auth_token, rack, server_tag)
 
-        if not hosts:
+        if not tagged_hosts:
             print(f"No hosts found containing rack '{rack}'.")
             continue  # Proceed to next server tag and rack
 
-        # For each host, get graphs whose names contain the server tag
-        for host in hosts:
-            host_id = host['hostid']
+        # For each host, queue the graphs whose names contain the server tag
+        for host, graphs in tagged_hosts:
             host_name = host['name']
             host_dir = os.path.join(output_dir, f"{host_name}")
             os.makedirs(host_dir, exist_ok=True)
 
-            graphs = get_graphs(auth_token, session, host_id, server_tag)
             if not graphs:
                 print(f"No graphs found for host '{host_name}' containing server tag '{server_tag}'.")
                 continue
@@ -212,7 +169,19 @@ def export_network_graphs(customer_dir, specified_month, specified_year):
                 graph_name = graph['name'].replace('/', '^').replace('\\', '_')
 
                 output_file = os.path.join(host_dir, f"{graph_name}_{stime}.png")
-                download_graph(session, graph_id, stime, etime, output_file)
+                downloads.setdefault(output_file, graph_id)
+
+    # Download all matched graphs through a bounded pool sharing the web session
+    print(f"Downloading {len(downloads)} network graphs with {MAX_DOWNLOAD_WORKERS} workers")
+    progress.emit('network_graphs', f"Found {len(downloads)} network graphs", total=len(downloads))
+    with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as executor:
+        futures = [
+            executor.submit(progress.wrap(download_graph), session, graph_id, stime, etime, output_file)
+            for output_file, graph_id in downloads.items()
+        ]
+        for done, future in enumerate(futures, start=1):
+            future.result()
+            progress.emit('network_graphs', f"Rendered {done}/{len(downloads)} network graphs", done=done, total=len(downloads))
 
     print(f"Network graphs saved to '{output_dir}' for customer '{project_id}'.")
 
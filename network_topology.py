@@ -0,0 +1,186 @@
+import time
+import threading
+import backend_scheduler
+
+# How long the network host list and the per-host graphs/items stay cached
+CACHE_TTL_SECONDS = 900
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cache_get(key):
+    with _cache_lock:
+        entry = _cache.get(key)
+    if entry and time.time() - entry[0] < CACHE_TTL_SECONDS:
+        return entry[1]
+    return None
+
+
+def _cache_set(key, value):
+    with _cache_lock:
+        _cache[key] = (time.time(), value)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+# Zabbix API error texts meaning the auth token is no longer accepted
+SESSION_ERRORS = ("Session terminated", "Not authorised", "Not authorized")
+
+
+class SessionRejected(Exception):
+    """Zabbix no longer accepts the session's API token or web login; log in again."""
+
+
+def check_api_session(data, method):
+    # Raises SessionRejected when an API answer says the auth token expired
+    error = data.get('error') if isinstance(data, dict) else None
+    if error and any(text in f"{error.get('message', '')} {error.get('data', '')}" for text in SESSION_ERRORS):
+        raise SessionRejected(f"{method}: {error.get('data') or error.get('message')}")
+
+
+def check_chart_session(response):
+    # Raises SessionRejected when a chart request was answered with the web login form
+    if 'text/html' in response.headers.get('Content-Type', '') and 'name="password"' in response.text:
+        raise SessionRejected(f"{response.url} returned the login page")
+
+
+def _api_result(response, method):
+    # The call's result, or None when Zabbix answered with another error, which must not be
+    # cached as an empty answer. Raises SessionRejected when the session expired.
+    data = response.json()
+    check_api_session(data, method)
+    if 'result' not in data:
+        print(f"Zabbix {method} failed: {data.get('error')}")
+        return None
+    return data['result']
+
+
+def matches_all_terms(name, terms):
+    # Same semantics as a case-insensitive Zabbix "search" where all terms must match
+    name_lower = name.lower()
+    return all(term.lower() in name_lower for term in terms)
+
+
+def get_network_hosts(session, api_url, auth_token):
+    # Load the whole network host list once instead of a wildcard host.get per rack
+    key = (api_url, 'hosts')
+    hosts = _cache_get(key)
+    if hosts is not None:
+        return hosts
+
+    payload = {
+        "jsonrpc": "2.0",
+        "method": "host.get",
+        "params": {
+            "output": ["hostid", "host", "name"],
+            "selectGroups": ["name"]
+        },
+        "auth": auth_token,
+        "id": 2
+    }
+    with backend_scheduler.slot('network_zabbix_api'):
+        response = session.post(api_url, json=payload)
+    hosts = _api_result(response, "host.get")
+    if hosts is None:
+        return []
+    print(f"Loaded {len(hosts)} network hosts from {api_url}")
+    _cache_set(key, hosts)
+    return hosts
+
+
+def _match_rack(hosts, rack):
+    return [host for host in hosts if matches_all_terms(host['host'], [rack]) and matches_all_terms(host['name'], [rack])]
+
+
+def find_rack_hosts(session, api_url, auth_token, rack):
+    key = (api_url, 'rack', rack.lower())
+    rack_hosts = _cache_get(key)
+    if rack_hosts is not None:
+        return rack_hosts
+
+    hosts = get_network_hosts(session, api_url, auth_token)
+    if not hosts:
+        return []
+    rack_hosts = _match_rack(hosts, rack)
+
+    # Racks registered as 'MAH-<Anything>' may be named 'AIMS-<Anything>' in Zabbix
+    if not rack_hosts and rack.startswith('MAH-'):
+        aims_rack = 'AIMS-' + rack[len('MAH-'):]
+        print(f"No hosts found for '{rack}', trying '{aims_rack}'")
+        rack_hosts = _match_rack(hosts, aims_rack)
+
+    _cache_set(key, rack_hosts)
+    return rack_hosts
+
+
+def _get_per_host(session, api_url, auth_token, method, kind, output, host_ids):
+    # Fetch graphs or items for all uncached hosts with a single API call
+    result = {}
+    missing = []
+    for host_id in host_ids:
+        cached = _cache_get((api_url, kind, host_id))
+        if cached is None:
+            missing.append(host_id)
+        else:
+            result[host_id] = cached
+
+    if missing:
+        payload = {
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": {
+                "output": output,
+                "hostids": missing,
+                "selectHosts": ["hostid"]
+            },
+            "auth": auth_token,
+            "id": 3
+        }
+        with backend_scheduler.slot('network_zabbix_api'):
+            response = session.post(api_url, json=payload)
+        entries = _api_result(response, method)
+        if entries is None:
+            result.update((host_id, []) for host_id in missing)
+            return result
+        fetched = {host_id: [] for host_id in missing}
+        for entry in entries:
+            for host in entry.pop('hosts', []):
+                if host['hostid'] in fetched:
+                    fetched[host['hostid']].append(entry)
+        for host_id, entries in fetched.items():
+            _cache_set((api_url, kind, host_id), entries)
+        result.update(fetched)
+    return result
+
+
+def get_host_graphs(session, api_url, auth_token, host_ids):
+    return _get_per_host(session, api_url, auth_token, "graph.get", 'graphs', ["graphid", "name"], host_ids)
+
+
+def get_host_items(session, api_url, auth_token, host_ids):
+    return _get_per_host(session, api_url, auth_token, "item.get", 'items', ["itemid", "name", "key_"], host_ids)
+
+
+def find_tagged_graphs(session, api_url, auth_token, rack, server_tag):
+    # Returns [(host, graphs whose name contains server_tag)] for every host in the rack
+    rack_hosts = find_rack_hosts(session, api_url, auth_token, rack)
+    host_graphs = get_host_graphs(session, api_url, auth_token, [host['hostid'] for host in rack_hosts])
+    return [
+        (host, [graph for graph in host_graphs.get(host['hostid'], []) if matches_all_terms(graph['name'], [server_tag])])
+        for host in rack_hosts
+    ]
+
+
+def find_tagged_items(session, api_url, auth_token, rack, server_tag, extra_terms=()):
+    # Returns [(host, items whose name contains server_tag and extra_terms)] for every host in the rack
+    rack_hosts = find_rack_hosts(session, api_url, auth_token, rack)
+    host_items = get_host_items(session, api_url, auth_token, [host['hostid'] for host in rack_hosts])
+    terms = [server_tag] + list(extra_terms)
+    return [
+        (host, [item for item in host_items.get(host['hostid'], []) if matches_all_terms(item['name'], terms)])
+        for host in rack_hosts
+    ]
@@ -0,0 +1,331 @@
+import os
+import sys
+import math
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+import requests
+import backend_scheduler
+import grafana_graph_export
+
+# Graph categories assessed from the panel's time series instead of the vision model
+NUMERIC_CATEGORIES = ('Ping_Result', 'CPU_Utilization', 'Memory_Utilization', 'Disk_Usage')
+
+# Utilization (%) above which a sample counts as a threshold breach
+THRESHOLDS = {
+    'CPU_Utilization': 80,
+    'Memory_Utilization': 85,
+    'Disk_Usage': 85,
+}
+
+# Points per series asked from Grafana for the month (Zabbix serves trends over such ranges)
+MAX_DATA_POINTS = 2000
+
+# A gap longer than this many sample intervals is reported as missing data
+GAP_INTERVALS = 3
+
+# Rise (percentage points) between the first and last sample reported as growth
+GROWTH_POINTS = 5
+
+# Downtime windows listed per host before the rest are summarized
+MAX_LISTED_WINDOWS = 5
+
+# How long dashboards and datasource lookups stay cached
+CACHE_TTL_SECONDS = 900
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cache_get(key):
+    with _cache_lock:
+        entry = _cache.get(key)
+    if entry and time.time() - entry[0] < CACHE_TTL_SECONDS:
+        return entry[1]
+    return None
+
+
+def _cache_set(key, value):
+    with _cache_lock:
+        _cache[key] = (time.time(), value)
+
+
+def grafana_headers():
+    return {
+        'Authorization': f'Bearer {grafana_graph_export.API_KEY}',
+        'Content-Type': 'application/json',
+    }
+
+
+def get_dashboard_panels(dashboard_uid):
+    key = ('dashboard', dashboard_uid)
+    panels = _cache_get(key)
+    if panels is not None:
+        return panels
+
+    dashboard_url = f'{grafana_graph_export.BASE_URL}/api/dashboards/uid/{dashboard_uid}'
+    with backend_scheduler.slot('grafana_api'):
+        response = requests.get(dashboard_url, headers=grafana_headers(), verify=False)
+    response.raise_for_status()
+    panels = response.json()['dashboard'].get('panels', [])
+    _cache_set(key, panels)
+    return panels
+
+
+def get_datasource_ref(datasource):
+    # Dashboards built by grafana_create.py name their datasource; queries need its uid
+    if isinstance(datasource, dict):
+        return {'uid': datasource.get('uid')}
+    key = ('datasource', datasource)
+    uid = _cache_get(key)
+    if uid is None:
+        with backend_scheduler.slot('grafana_api'):
+            response = requests.get(
+                f'{grafana_graph_export.BASE_URL}/api/datasources/name/{datasource}', headers=grafana_headers(), verify=False
+            )
+        response.raise_for_status()
+        uid = response.json()['uid']
+        _cache_set(key, uid)
+    return {'uid': uid}
+
+
+def find_graph_panels(panels, graph_name):
+    # Every panel (shard) saved under the logical graph name, in shard order
+    matches = []
+    for panel in panels:
+        _, panel_title_safe, shard_index = grafana_graph_export.get_panel_graph_name(panel.get('title', ''))
+        if panel_title_safe == graph_name and panel.get('targets'):
+            matches.append((shard_index or 0, panel))
+    return [panel for _, panel in sorted(matches, key=lambda match: match[0])]
+
+
+def query_panel_series(panel, from_ms, to_ms):
+    # Runs the panel's own queries through Grafana; returns {series name: [(time_ms, value)]}
+    queries = []
+    for target in panel['targets']:
+        if target.get('hide'):
+            continue
+        query = dict(target)
+        query['datasource'] = get_datasource_ref(target.get('datasource') or panel.get('datasource'))
+        query['intervalMs'] = max(1000, (to_ms - from_ms) // MAX_DATA_POINTS)
+        query['maxDataPoints'] = MAX_DATA_POINTS
+        queries.append(query)
+    if not queries:
+        return {}
+
+    payload = {'from': str(from_ms), 'to': str(to_ms), 'queries': queries}
+    with backend_scheduler.slot('grafana_api'):
+        response = requests.post(
+            f'{grafana_graph_export.BASE_URL}/api/ds/query', headers=grafana_headers(), json=payload, verify=False
+        )
+    # 207: some queries failed, the others still have data
+    if response.status_code not in (200, 207):
+        response.raise_for_status()
+
+    series = {}
+    for ref_id, result in response.json().get('results', {}).items():
+        if result.get('error'):
+            print(f"Query {ref_id} of panel '{panel.get('title')}' failed: {result['error']}")
+        for frame in result.get('frames', []):
+            fields = frame.get('schema', {}).get('fields', [])
+            values = frame.get('data', {}).get('values', [])
+            if len(fields) < 2 or len(values) < 2:
+                continue
+            for field, field_values in zip(fields[1:], values[1:]):
+                config = field.get('config') or {}
+                name = (config.get('displayNameFromDS') or config.get('displayName')
+                        or frame.get('schema', {}).get('name') or field.get('name') or ref_id)
+                points = [(t, v) for t, v in zip(values[0], field_values) if t is not None and v is not None]
+                series.setdefault(name, []).extend(points)
+    return series
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list: the value at rank ceil(fraction * n).
+    # The rank is rounded first so float noise such as 0.95 * 100 = 95.00000000000001 stays at 95.
+    rank = math.ceil(round(fraction * len(sorted_values), 9))
+    index = max(0, min(len(sorted_values) - 1, rank - 1))
+    return sorted_values[index]
+
+
+def series_stats(points, threshold=None, down_below=None):
+    """Mean, p95 and max of a series, time spent above threshold, and windows below down_below or without data."""
+    points = sorted(points)
+    times = [t for t, _ in points]
+    values = [float(v) for _, v in points]
+    deltas = sorted(b - a for a, b in zip(times, times[1:]) if b > a)
+    interval = deltas[len(deltas) // 2] if deltas else 0
+    ordered = sorted(values)
+
+    stats = {
+        'samples': len(values),
+        'interval_ms': interval,
+        'mean': sum(values) / len(values),
+        'p95': percentile(ordered, 0.95),
+        'max': ordered[-1],
+        'min': ordered[0],
+        'first': values[0],
+        'last': values[-1],
+        'breach_samples': 0,
+        'breach_ms': 0,
+        'down_ms': 0,
+        'down_windows': [],
+        'gaps': [],
+    }
+
+    if threshold is not None:
+        breaches = [v for v in values if v >= threshold]
+        stats['breach_samples'] = len(breaches)
+        stats['breach_ms'] = len(breaches) * interval
+
+    window = None
+    for index, (t, value) in enumerate(zip(times, values)):
+        if index and interval and t - times[index - 1] > GAP_INTERVALS * interval:
+            stats['gaps'].append((times[index - 1], t))
+        if down_below is not None and value < down_below:
+            # Averaged samples (trends) that are partly down count for their share of the interval
+            stats['down_ms'] += (down_below - value) / down_below * interval
+            if window is None:
+                window = [t, t + interval]
+            else:
+                window[1] = t + interval
+        elif window is not None:
+            stats['down_windows'].append(tuple(window))
+            window = None
+    if window is not None:
+        stats['down_windows'].append(tuple(window))
+    return stats
+
+
+def format_time(time_ms):
+    return datetime.fromtimestamp(time_ms / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M')
+
+
+def format_duration(milliseconds):
+    minutes = milliseconds / 60000
+    if minutes < 120:
+        return f"{minutes:.0f} minutes"
+    return f"{minutes / 60:.1f} hours"
+
+
+def format_windows(windows, label):
+    listed = [f"{format_time(start)} to {format_time(end)} UTC" for start, end in windows[:MAX_LISTED_WINDOWS]]
+    text = f"{label} " + ", ".join(listed)
+    if len(windows) > MAX_LISTED_WINDOWS:
+        text += f" and {len(windows) - MAX_LISTED_WINDOWS} more"
+    return text
+
+
+def ping_assessment(stats_by_host):
+    lines = []
+    down = {name: stats for name, stats in stats_by_host.items() if stats['down_windows']}
+    incomplete = {name: stats for name, stats in stats_by_host.items() if stats['gaps']}
+    average = sum(stats['mean'] for stats in stats_by_host.values()) / len(stats_by_host) * 100
+
+    if not down:
+        lines.append(f"All {len(stats_by_host)} hosts responded to ping throughout the reporting period "
+                     f"(average availability {average:.2f}%).")
+    else:
+        lines.append(f"{len(down)} of {len(stats_by_host)} hosts had ping failures during the reporting period "
+                     f"(average availability {average:.2f}%):")
+        for name, stats in sorted(down.items(), key=lambda item: item[1]['mean']):
+            lines.append(f"- {name}: {stats['mean'] * 100:.2f}% available, about {format_duration(stats['down_ms'])} down; "
+                         + format_windows(stats['down_windows'], "down"))
+        lines.append("The remaining hosts were reachable for the whole period.")
+
+    if incomplete:
+        lines.append("Monitoring data is missing for some periods, which should be checked against the monitoring system:")
+        for name, stats in sorted(incomplete.items()):
+            lines.append(f"- {name}: " + format_windows(stats['gaps'], "no data from"))
+    return "\n".join(lines)
+
+
+def utilization_assessment(graph_name, threshold, stats_by_series):
+    lines = []
+    average = sum(stats['mean'] for stats in stats_by_series.values()) / len(stats_by_series)
+    busiest = sorted(stats_by_series.items(), key=lambda item: item[1]['mean'], reverse=True)
+    name, stats = busiest[0]
+    lines.append(f"{graph_name} across {len(stats_by_series)} series averaged {average:.1f}% over the reporting period. "
+                 f"The highest was {name} (mean {stats['mean']:.1f}%, 95th percentile {stats['p95']:.1f}%, "
+                 f"peak {stats['max']:.1f}%).")
+    if len(busiest) > 1:
+        others = ", ".join(f"{name} {stats['mean']:.1f}%" for name, stats in busiest[1:4])
+        lines.append(f"Next highest averages: {others}.")
+
+    growing = [(name, stats) for name, stats in stats_by_series.items() if stats['last'] - stats['first'] >= GROWTH_POINTS]
+    if growing:
+        growth = ", ".join(f"{name} from {stats['first']:.1f}% to {stats['last']:.1f}%"
+                           for name, stats in sorted(growing, key=lambda item: item[1]['first'] - item[1]['last']))
+        lines.append(f"Utilization grew over the month on {growth}.")
+
+    breached = [(name, stats) for name, stats in busiest if stats['breach_samples']]
+    if breached:
+        lines.append(f"{len(breached)} series exceeded the {threshold}% threshold:")
+        for name, stats in sorted(breached, key=lambda item: item[1]['breach_ms'], reverse=True):
+            share = stats['breach_samples'] / stats['samples'] * 100
+            lines.append(f"- {name}: above {threshold}% for about {format_duration(stats['breach_ms'])} "
+                         f"({share:.1f}% of the period), 95th percentile {stats['p95']:.1f}%, peak {stats['max']:.1f}%")
+        sustained = [name for name, stats in breached if stats['p95'] >= threshold]
+        if sustained:
+            lines.append(f"Utilization stayed high for a sustained part of the month on {', '.join(sustained)}; "
+                         f"capacity should be reviewed.")
+        else:
+            lines.append("The breaches were short peaks rather than sustained load.")
+    else:
+        lines.append(f"No series exceeded the {threshold}% threshold; utilization stayed within normal limits.")
+    return "\n".join(lines)
+
+
+def analyze_graph(dashboard_uid, graph_name, category, month, year):
+    """Assessment text for a logical graph computed from its panels' data, or None when there is no data."""
+    if category not in NUMERIC_CATEGORIES or not dashboard_uid:
+        return None
+    from_ms, to_ms = grafana_graph_export.get_month_range(month, year)
+    try:
+        panels = find_graph_panels(get_dashboard_panels(dashboard_uid), graph_name)
+        series = {}
+        for panel in panels:
+            for name, points in query_panel_series(panel, from_ms, to_ms).items():
+                series.setdefault(name, []).extend(points)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"Error querying data for {graph_name}: {e}")
+        return None
+    series = {name: points for name, points in series.items() if points}
+    if not series:
+        return None
+
+    print(f"Computing numeric analysis for {graph_name} from {len(series)} series")
+    if category == 'Ping_Result':
+        return ping_assessment({name: series_stats(points, down_below=1) for name, points in series.items()})
+    threshold = THRESHOLDS[category]
+    return utilization_assessment(
+        graph_name, threshold, {name: series_stats(points, threshold=threshold) for name, points in series.items()}
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the numeric assessments of a Grafana customer's graphs for a month.")
+    parser.add_argument("--month", type=int, required=True, help="Report month (1-12)")
+    parser.add_argument("--year", type=int, required=True, help="Report year (e.g., 2024)")
+    parser.add_argument("--customer", type=str, required=True, help="Customer Project ID")
+    args = parser.parse_args()
+
+    details_path = os.path.join(grafana_graph_export.BASE_DIRECTORY, args.customer, "customer_details.txt")
+    if not os.path.isfile(details_path):
+        print(f"Customer details '{details_path}' not found.", file=sys.stderr)
+        sys.exit(1)
+    with open(details_path, "r") as f:
+        details = dict(line.strip().split(": ", 1) for line in f if ": " in line)
+
+    graphs = {}
+    for panel in get_dashboard_panels(details.get("Dashboard UID")):
+        panel_title, panel_title_safe, _ = grafana_graph_export.get_panel_graph_name(panel.get('title', ''))
+        graphs.setdefault(panel_title_safe, grafana_graph_export.get_category_from_title(panel_title))
+    for graph_name, category in graphs.items():
+        if category in NUMERIC_CATEGORIES:
+            print(f"\n{graph_name}\n{analyze_graph(details.get('Dashboard UID'), graph_name, category, args.month, args.year)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import os
+import struct
+import argparse
+from PIL import Image, PngImagePlugin
+import backend_scheduler
+import progress
+
+BASE_DIRECTORY = "/home/almalinux"
+
+# Written into optimized files so later runs skip them
+OPTIMIZED_MARKER = b'netmon-png-optimized'
+
+
+def is_optimized(path):
+    # Looks for the marker text chunk ahead of the image data without decoding anything
+    with open(path, 'rb') as f:
+        if f.read(8) != b'\x89PNG\r\n\x1a\n':
+            return False
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return False
+            length, chunk_type = struct.unpack('>I4s', chunk_header)
+            if chunk_type == b'tEXt':
+                if f.read(length).split(b'\x00', 1)[0] == OPTIMIZED_MARKER:
+                    return True
+                f.seek(4, os.SEEK_CUR)
+            elif chunk_type in (b'IDAT', b'IEND'):
+                return False
+            else:
+                f.seek(length + 4, os.SEEK_CUR)
+
+
+def to_exact_palette(image):
+    # Palette image with exactly the same pixels, or None if the image has more than 256 colours
+    if image.mode == 'RGBA':
+        if image.getextrema()[3][0] < 255:
+            return None  # real transparency is kept as it is
+        image = image.convert('RGB')
+    elif image.mode != 'RGB':
+        return None
+    colors = image.getcolors(256)
+    if colors is None:
+        return None
+    # Each pixel gets the index of its own colour; quantize() may pick a nearby palette entry instead
+    palette = [color for _, color in colors]
+    indexes = {bytes(color): i for i, color in enumerate(palette)}
+    data = image.tobytes()
+    optimized = Image.frombytes('P', image.size, bytes(indexes[data[i:i + 3]] for i in range(0, len(data), 3)))
+    optimized.putpalette([channel for color in palette for channel in color])
+    return optimized
+
+
+def optimize_png(path, palette=False, keep_original=False):
+    # Runs in a pool process. Returns (bytes_before, bytes_after); the file is only replaced when smaller.
+    before = os.path.getsize(path)
+    if is_optimized(path):
+        return before, before
+
+    with Image.open(path) as image:
+        image.load()
+        dpi = image.info.get('dpi')
+        optimized = to_exact_palette(image)
+        if optimized is None:
+            if palette:
+                # Lossy: graphs rarely need more than 256 colours
+                optimized = image.convert('RGBA').quantize(256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+            else:
+                optimized = image.copy()
+
+    info = PngImagePlugin.PngInfo()
+    info.add_text(OPTIMIZED_MARKER.decode(), 'lossy' if palette else 'lossless')
+    save_options = {'optimize': True, 'pnginfo': info}
+    if dpi:
+        save_options['dpi'] = dpi
+    temporary_path = path + '.tmp'
+    optimized.save(temporary_path, 'PNG', **save_options)
+
+    after = os.path.getsize(temporary_path)
+    if after >= before:
+        os.remove(temporary_path)
+        return before, before
+    if keep_original:
+        os.replace(path, path + '.orig')
+    os.replace(temporary_path, path)
+    return before, after
+
+
+def optimize_directory(directory, palette=False, keep_originals=False):
+    # Optimizes every PNG under directory in backend_scheduler's process pool. Returns (files, bytes_before, bytes_after).
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.endswith('.png'))
+    if not paths:
+        print(f"No PNG files to optimize in {directory}")
+        return 0, 0, 0
+
+    executor = backend_scheduler.get_process_pool()
+    futures = [(path, executor.submit(optimize_png, path, palette, keep_originals)) for path in paths]
+    total_before = total_after = 0
+    for path, future in futures:
+        try:
+            before, after = future.result()
+        except Exception as e:
+            print(f"Failed to optimize {path}: {e}")
+            before = after = os.path.getsize(path)
+        total_before += before
+        total_after += after
+
+    saved = total_before - total_after
+    message = (f"Optimized {len(paths)} PNG files in {directory}: "
+               f"{total_before / 1048576:.1f} MB -> {total_after / 1048576:.1f} MB (saved {saved / 1048576:.1f} MB)")
+    print(message)
+    progress.emit('png_optimize', message, files=len(paths), bytes_before=total_before, bytes_after=total_after, bytes_saved=saved)
+    return len(paths), total_before, total_after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompress a customer's exported graph PNGs before report generation.")
+    parser.add_argument("--month", type=int, required=True, help="Report month (1-12)")
+    parser.add_argument("--year", type=int, required=True, help="Report year (e.g., 2024)")
+    parser.add_argument("--customer", type=str, required=True, help="Customer Project ID")
+    parser.add_argument("--palette", action='store_true', help="Also reduce graphs with more than 256 colours to a palette (lossy)")
+    parser.add_argument("--keep-originals", action='store_true', help="Keep each replaced file as <name>.png.orig")
+    args = parser.parse_args()
+
+    month_dir = os.path.join(BASE_DIRECTORY, args.customer, f"{args.year}-{str(args.month).zfill(2)}")
+    if not os.path.isdir(month_dir):
+        print(f"Directory '{month_dir}' not found.")
+        return
+    optimize_directory(month_dir, args.palette, args.keep_originals)
+
+
+if __name__ == "__main__":
+    main()
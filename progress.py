@@ -0,0 +1,66 @@
+import threading
+
+# Progress events raised by the export and report code. A reporter is installed
+# per thread by whoever runs the job (the web app's task runner); when none is
+# installed, e.g. when a script is run from the command line, emit() does nothing.
+# The runner also installs a per-thread output sink that captures the job's prints,
+# and the job's priority lane, which the backend scheduler uses to order waiters.
+
+_local = threading.local()
+
+
+def set_reporter(reporter):
+    # reporter(stage, message, data) or None
+    _local.reporter = reporter
+
+
+def get_reporter():
+    return getattr(_local, 'reporter', None)
+
+
+def set_output(output):
+    # output has write(text), or None to print normally
+    _local.output = output
+
+
+def get_output():
+    return getattr(_local, 'output', None)
+
+
+def set_priority(priority):
+    # 'interactive' or 'batch'; threads without one count as interactive
+    _local.priority = priority
+
+
+def get_priority():
+    return getattr(_local, 'priority', None) or 'interactive'
+
+
+def emit(stage, message, **data):
+    reporter = get_reporter()
+    if reporter is not None:
+        try:
+            reporter(stage, message, data)
+        except Exception as e:
+            print(f"Failed to report progress '{stage}': {e}")
+
+
+def wrap(func):
+    # Carry the calling thread's reporter, output sink and priority into a pool worker thread
+    reporter = get_reporter()
+    output = get_output()
+    priority = get_priority()
+
+    def wrapper(*args, **kwargs):
+        previous = (get_reporter(), get_output(), get_priority())
+        set_reporter(reporter)
+        set_output(output)
+        set_priority(priority)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            set_reporter(previous[0])
+            set_output(previous[1])
+            set_priority(previous[2])
+
+    return wrapper
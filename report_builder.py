@@ -0,0 +1,401 @@
+import os
+import struct
+import hashlib
+import threading
+import weakref
+from io import BytesIO
+from docx import Document
+from docx.enum.text import WD_BREAK
+from docx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import qn
+from docx.oxml.shape import CT_Inline
+from docx.parts.image import ImagePart
+from docx.shape import InlineShape
+from docx.shared import Emu, Inches, Pt
+from docx.text.paragraph import Paragraph
+from lxml import etree
+
+# Building a report by calling doc.paragraphs[insert_index].insert_paragraph_before()
+# rebuilds the list of every paragraph in the body on each call, so a report with
+# thousands of graphs spends most of its time re-scanning itself. The template is
+# scanned once for all anchors instead, and each insertion point keeps a reference
+# to the paragraph that followed its anchor, so every insert is a single element
+# operation and generation time grows linearly with the report.
+#
+# Templates are compiled once per process: the placeholder runs and anchor
+# paragraphs are located when a template is first used, and each report only
+# re-reads the cached template bytes and fills the known positions.
+#
+# Pictures are added with add_picture() below rather than run.add_picture(): a PNG's
+# size and dpi are read from its header chunks, identical files are stored once
+# (streamed SHA1), and the bytes stay on disk until doc.save() writes them into the
+# zip one at a time, so memory no longer grows with the number of graphs.
+#
+# Sections can also be built away from the document, e.g. in a process pool, as
+# fragments: serialized paragraphs whose pictures point at placeholder
+# relationship ids. insert_fragment() registers the images with the document,
+# rewrites the ids and inserts the paragraphs at an insertion point.
+
+# Style applied to a run once its placeholder has been replaced
+PLACEHOLDER_FONT_SIZE = Pt(16)
+PLACEHOLDER_BOLD = True
+
+
+class InsertionPoint:
+    """Inserts content, in order, right after an anchor paragraph of the template."""
+
+    def __init__(self, doc, anchor, following):
+        self.doc = doc
+        self.anchor = anchor
+        # Paragraph that followed the anchor in the template; None if the anchor was the last one
+        self._following = following
+        # Last element inserted here, which the next one goes after when there is no following paragraph
+        self._last = None
+        self.count = 0
+
+    def _insert(self, element):
+        if self._following is not None:
+            self._following._p.addprevious(element)
+        else:
+            (self._last if self._last is not None else self.anchor._p).addnext(element)
+        self._last = element
+        self.count += 1
+
+    def paragraph(self, text=None, style=None):
+        paragraph = Paragraph(OxmlElement('w:p'), self.anchor._parent)
+        self._insert(paragraph._p)
+        if text:
+            paragraph.add_run(text)
+        if style is not None:
+            paragraph.style = style
+        return paragraph
+
+    def picture(self, image_path, width=Inches(5)):
+        run = self.paragraph().add_run()
+        add_picture(run, image_path, width)
+        return run
+
+    def page_break(self):
+        self.paragraph().add_run().add_break(WD_BREAK.PAGE)
+
+    def element(self, element):
+        # Moves an element here, whether built with the document API, e.g. doc.add_table(...)._tbl,
+        # or not yet part of the document, e.g. parsed from a fragment
+        self._insert(element)
+
+
+def find_insertion_points(doc, anchors):
+    # One pass over the template; returns {anchor text: InsertionPoint or None}
+    paragraphs = doc.paragraphs
+    points = dict.fromkeys(anchors)
+    for i, paragraph in enumerate(paragraphs):
+        text = paragraph.text
+        for anchor in anchors:
+            if points[anchor] is None and anchor in text:
+                print(f"Found '{anchor}' at paragraph index: {i}")
+                following = paragraphs[i + 1] if i + 1 < len(paragraphs) else None
+                points[anchor] = InsertionPoint(doc, paragraph, following)
+    return points
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def read_png_header(image_path):
+    # (px_width, px_height, horz_dpi, vert_dpi) from the chunks before the image data, or None if not a PNG
+    px_width = px_height = None
+    horz_dpi = vert_dpi = 72  # same default as python-docx
+    with open(image_path, 'rb') as f:
+        if f.read(8) != PNG_SIGNATURE:
+            return None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                break
+            length, chunk_type = struct.unpack('>I4s', chunk_header)
+            if chunk_type == b'IHDR':
+                px_width, px_height = struct.unpack('>II', f.read(8))
+                f.seek(length - 8 + 4, os.SEEK_CUR)
+            elif chunk_type == b'pHYs':
+                horz_px_per_unit, vert_px_per_unit, units = struct.unpack('>IIB', f.read(9))
+                f.seek(length - 9 + 4, os.SEEK_CUR)
+                if units == 1:  # pixels per metre
+                    horz_dpi = int(round(horz_px_per_unit * 0.0254)) if horz_px_per_unit else 72
+                    vert_dpi = int(round(vert_px_per_unit * 0.0254)) if vert_px_per_unit else 72
+            elif chunk_type in (b'IDAT', b'IEND'):
+                break
+            else:
+                f.seek(length + 4, os.SEEK_CUR)
+    if px_width is None:
+        return None
+    return px_width, px_height, horz_dpi, vert_dpi
+
+
+def image_size(image_path):
+    # (px_width, px_height) without decoding the image
+    header = read_png_header(image_path)
+    if header is not None:
+        return header[0], header[1]
+    from docx.image.image import Image
+    image = Image.from_file(image_path)
+    return image.px_width, image.px_height
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileImagePart(ImagePart):
+    """PNG image part whose bytes are read from disk only when the document is saved.
+
+    The file must not change between add_picture() and doc.save().
+    """
+
+    def __init__(self, partname, path, sha1):
+        super().__init__(partname, CT.PNG, None)
+        self.path = path
+        self._sha1 = sha1
+
+    @property
+    def blob(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    @property
+    def sha1(self):
+        return self._sha1
+
+
+class _PackageImages:
+    # Per-document bookkeeping so adding a picture does not rescan every existing image part or id
+
+    def __init__(self, package):
+        self.package = package
+        self.by_sha1 = {}
+        self.used_numbers = set()
+        self.known_parts = -1
+        self.next_ids = {}  # story part -> next free drawing id
+        self.rIds = {}  # (story part, image part) -> rId
+        self.next_rIds = {}  # story part -> next rId number to try
+
+    def get_or_add(self, image_path, sha1=None):
+        sha1 = sha1 or file_sha1(image_path)
+        image_part = self.by_sha1.get(sha1)
+        if image_part is not None:
+            return image_part
+
+        image_parts = self.package.image_parts
+        if len(image_parts) != self.known_parts:
+            # Parts were added outside this path (template images, run.add_picture)
+            self.used_numbers = {part.partname.idx for part in image_parts}
+        number = 1
+        while number in self.used_numbers:
+            number += 1
+        image_part = FileImagePart(PackURI(f"/word/media/image{number}.png"), image_path, sha1)
+        image_parts.append(image_part)
+        self.used_numbers.add(number)
+        self.known_parts = len(image_parts)
+        self.by_sha1[sha1] = image_part
+        return image_part
+
+    def relate(self, story_part, image_part):
+        # story_part.relate_to() compares against every existing relationship, which is
+        # quadratic over a report; images added here are tracked and get the next free rId
+        rId = self.rIds.get((story_part, image_part))
+        if rId is None:
+            rels = story_part.rels
+            number = self.next_rIds.get(story_part, len(rels) + 1)
+            while f"rId{number}" in rels:
+                number += 1
+            rId = f"rId{number}"
+            rels.add_relationship(RT.IMAGE, image_part, rId)
+            self.next_rIds[story_part] = number + 1
+            self.rIds[(story_part, image_part)] = rId
+        return rId
+
+    def next_id(self, story_part):
+        shape_id = self.next_ids.get(story_part)
+        if shape_id is None:
+            shape_id = story_part.next_id
+        self.next_ids[story_part] = shape_id + 1
+        return shape_id
+
+
+_package_images = weakref.WeakKeyDictionary()
+
+
+def package_images(story_part):
+    images = _package_images.get(story_part.package)
+    if images is None:
+        images = _package_images[story_part.package] = _PackageImages(story_part.package)
+    return images
+
+
+def new_picture_inline(image_path, header, width, shape_id, rId):
+    # Scale to width keeping the aspect ratio, as python-docx does
+    px_width, px_height, horz_dpi, vert_dpi = header
+    native_width = Inches(px_width / horz_dpi)
+    native_height = Inches(px_height / vert_dpi)
+    height = int(round(native_height * (float(width) / float(native_width))))
+    return CT_Inline.new_pic_inline(shape_id, rId, os.path.basename(image_path), Emu(width), Emu(height))
+
+
+def add_picture(run, image_path, width, sha1=None):
+    # Same result as run.add_picture(image_path, width=width) for PNGs, without loading the image
+    story_part = run.part
+    images = package_images(story_part)
+
+    header = read_png_header(image_path)
+    if header is None:
+        # Other formats go through python-docx, which picks its own drawing id
+        images.next_ids.pop(story_part, None)
+        return run.add_picture(image_path, width=width)
+
+    image_part = images.get_or_add(image_path, sha1)
+    rId = images.relate(story_part, image_part)
+    inline = new_picture_inline(image_path, header, width, images.next_id(story_part), rId)
+    run._r.add_drawing(inline)
+    return InlineShape(inline)
+
+
+class Fragment:
+    """Paragraphs built away from the document, e.g. in a pool process, for insert_fragment().
+
+    Holds only serialized XML and plain tuples so it can be pickled. Pictures
+    point at placeholder relationship ids until the fragment is inserted.
+    """
+
+    def __init__(self):
+        self.paragraphs = []  # serialized w:p elements
+        self.images = []  # (paragraph index, image path, sha1 or None for non-PNG, width)
+
+    def __len__(self):
+        return len(self.paragraphs)
+
+    def paragraph(self, text=None, style_id=None):
+        # style_id is the template's id for the style, e.g. doc.styles['Heading 2'].style_id
+        paragraph = Paragraph(OxmlElement('w:p'), None)
+        if text:
+            paragraph.add_run(text)
+        if style_id is not None:
+            paragraph._p.style = style_id
+        self.paragraphs.append(etree.tostring(paragraph._p))
+
+    def picture(self, image_path, width=Inches(5)):
+        paragraph = OxmlElement('w:p')
+        header = read_png_header(image_path)
+        if header is None:
+            sha1 = None  # left empty; python-docx adds the picture at insert time
+        else:
+            sha1 = file_sha1(image_path)
+            placeholder_id = len(self.images) + 1
+            paragraph.add_r().add_drawing(
+                new_picture_inline(image_path, header, width, placeholder_id, f"rIdFragment{placeholder_id}")
+            )
+        self.images.append((len(self.paragraphs), image_path, sha1, width))
+        self.paragraphs.append(etree.tostring(paragraph))
+
+
+def insert_fragment(point, fragment):
+    # Inserts the fragment's paragraphs at point, relating its images to the document. Returns the count.
+    story_part = point.anchor.part
+    images = package_images(story_part)
+    elements = [parse_xml(xml) for xml in fragment.paragraphs]
+
+    # Placeholders are replaced before the paragraphs join the document, where their ids would count as used
+    for index, image_path, sha1, width in fragment.images:
+        if sha1 is None:
+            continue
+        element = elements[index]
+        image_part = images.get_or_add(image_path, sha1)
+        element.find('.//' + qn('a:blip')).set(qn('r:embed'), images.relate(story_part, image_part))
+        shape_id = images.next_id(story_part)
+        doc_pr = element.find('.//' + qn('wp:docPr'))
+        doc_pr.set('id', str(shape_id))
+        doc_pr.set('name', f"Picture {shape_id}")
+
+    for element in elements:
+        point.element(element)
+
+    for index, image_path, sha1, width in fragment.images:
+        if sha1 is None:
+            add_picture(Paragraph(elements[index], point.anchor._parent).add_run(), image_path, width)
+    return len(elements)
+
+
+class CompiledTemplate:
+    """A template file with its placeholder runs and anchor paragraphs located once."""
+
+    def __init__(self, path, placeholders, anchors):
+        self.path = path
+        stat = os.stat(path)
+        self.signature = (stat.st_mtime, stat.st_size)
+        with open(path, 'rb') as f:
+            self.blob = f.read()
+
+        paragraphs = Document(BytesIO(self.blob)).paragraphs
+        self.paragraph_count = len(paragraphs)
+        # [(paragraph index, placeholder, [run indexes])], in document then placeholder order
+        self.placeholder_runs = []
+        self.anchor_indexes = dict.fromkeys(anchors)
+        for i, paragraph in enumerate(paragraphs):
+            text = paragraph.text
+            for key in placeholders:
+                if key in text:
+                    runs = [r for r, run in enumerate(paragraph.runs) if key in run.text]
+                    self.placeholder_runs.append((i, key, runs))
+            for anchor in anchors:
+                if self.anchor_indexes[anchor] is None and anchor in text:
+                    self.anchor_indexes[anchor] = i
+
+    def is_current(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_mtime, stat.st_size) == self.signature
+
+    def instantiate(self, replacements):
+        # Returns (doc, {anchor: InsertionPoint or None}) with the placeholders filled in
+        doc = Document(BytesIO(self.blob))
+        paragraphs = doc.paragraphs
+        for i, key, runs in self.placeholder_runs:
+            value = replacements[key]
+            print(f"Replacing '{key}' with '{value}'")
+            paragraph_runs = paragraphs[i].runs
+            for r in runs:
+                run = paragraph_runs[r]
+                run.text = run.text.replace(key, value)
+                run.font.size = PLACEHOLDER_FONT_SIZE
+                run.font.bold = PLACEHOLDER_BOLD
+
+        points = {}
+        for anchor, i in self.anchor_indexes.items():
+            if i is None:
+                points[anchor] = None
+            else:
+                following = paragraphs[i + 1] if i + 1 < self.paragraph_count else None
+                points[anchor] = InsertionPoint(doc, paragraphs[i], following)
+        return doc, points
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def load_template(path, placeholders, anchors):
+    # Compiled template from the per-process cache, recompiled when the file changes on disk
+    key = (os.path.abspath(path), tuple(placeholders), tuple(anchors))
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is None or not template.is_current():
+            print(f"Compiling template: {path}")
+            template = CompiledTemplate(path, placeholders, anchors)
+            _templates[key] = template
+    return template
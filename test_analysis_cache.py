@@ -0,0 +1,51 @@
+import analysis_cache
+import llama_analysis
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_cache_key_follows_content_model_and_preprocessing(tmp_path, monkeypatch):
+    graph = write(tmp_path / "graph.png", b"PNG 1")
+    renamed = write(tmp_path / "renamed.png", b"PNG 1")
+    changed = write(tmp_path / "changed.png", b"PNG 2")
+    key = analysis_cache.cache_key([graph], "Describe.", "llama3.2-vision:11b", "fit1120")
+
+    assert analysis_cache.cache_key([renamed], "Describe.", "llama3.2-vision:11b", "fit1120") == key
+    assert analysis_cache.cache_key([changed], "Describe.", "llama3.2-vision:11b", "fit1120") != key
+    assert analysis_cache.cache_key([graph], "Summarize.", "llama3.2-vision:11b", "fit1120") != key
+    assert analysis_cache.cache_key([graph], "Describe.", "llama3.2-vision:90b", "fit1120") != key
+    assert analysis_cache.cache_key([graph], "Describe.", "llama3.2-vision:11b", "fit560") != key
+    assert analysis_cache.cache_key([graph, changed], "Describe.", "llama3.2-vision:11b", "fit1120") != key
+
+    # Every preprocessing setting is part of the signature
+    signature = llama_analysis.preprocessing_signature()
+    monkeypatch.setattr(llama_analysis, 'LLAMA_IMAGE_SIZE', llama_analysis.LLAMA_IMAGE_SIZE // 2)
+    assert llama_analysis.preprocessing_signature() != signature
+    monkeypatch.setattr(llama_analysis, 'LLAMA_LEGEND_TILES', True)
+    tiled = llama_analysis.preprocessing_signature()
+    monkeypatch.setattr(llama_analysis, 'LLAMA_PLOT_HEIGHT_RATIO', 0.5)
+    assert llama_analysis.preprocessing_signature() != tiled
+
+
+def test_get_put_and_evict_least_recently_used(tmp_path, monkeypatch):
+    cache = analysis_cache.AnalysisCache(str(tmp_path / "cache" / "analyses.db"), max_bytes=25)
+    now = [1000.0]
+    monkeypatch.setattr(analysis_cache.time, 'time', lambda: now[0])
+
+    assert cache.get("a") is None
+    cache.put("a", "model", "a" * 10)
+    now[0] += 1
+    cache.put("b", "model", "b" * 10)
+    now[0] += 1
+    assert cache.get("a") == "a" * 10
+    now[0] += 1
+    # 30 bytes do not fit; "b" was used least recently
+    cache.put("c", "model", "c" * 10)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "a" * 10
+    assert cache.get("c") == "c" * 10
+    assert cache.stats() == {'entries': 2, 'bytes': 20, 'max_bytes': 25}
@@ -0,0 +1,73 @@
+import time
+import threading
+import pytest
+import backend_scheduler
+import progress
+
+
+def test_concurrency_is_capped():
+    pool = backend_scheduler.ResourcePool('test', concurrency=2)
+    peak = [0]
+    lock = threading.Lock()
+
+    def work():
+        acquired_at = pool.acquire()
+        with lock:
+            peak[0] = max(peak[0], pool.active)
+        time.sleep(0.02)
+        pool.release(acquired_at)
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+    assert pool.stats()['completed'] == 6
+
+
+def test_interactive_waiters_go_before_batch():
+    pool = backend_scheduler.ResourcePool('test', concurrency=1)
+    held = pool.acquire()
+    order = []
+
+    def work(priority):
+        pool.release(pool.acquire(priority))
+        order.append(priority)
+
+    batch = threading.Thread(target=work, args=('batch',))
+    batch.start()
+    while pool.stats()['waiting'] < 1:
+        time.sleep(0.001)
+    interactive = threading.Thread(target=work, args=('interactive',))
+    interactive.start()
+    while pool.stats()['waiting'] < 2:
+        time.sleep(0.001)
+
+    pool.release(held)
+    batch.join()
+    interactive.join()
+    assert order == ['interactive', 'batch']
+
+
+def test_rate_limit_after_burst():
+    pool = backend_scheduler.ResourcePool('test', concurrency=10, rate=20, burst=2)
+    started = time.monotonic()
+    for _ in range(4):
+        pool.release(pool.acquire())
+    # Two requests from the burst, then one every 50 ms
+    assert time.monotonic() - started >= 0.09
+
+
+def test_slot_uses_the_thread_priority_and_counts_failures():
+    pool = backend_scheduler.get_pool('llama')
+    failed = pool.stats()['failed']
+    progress.set_priority('batch')
+    try:
+        with pytest.raises(ValueError):
+            with backend_scheduler.slot('llama'):
+                raise ValueError("backend error")
+    finally:
+        progress.set_priority(None)
+    assert pool.stats()['failed'] == failed + 1
+    assert pool.stats()['active'] == 0
@@ -0,0 +1,142 @@
+import time
+import types
+import threading
+import pytest
+import export_orchestrator
+import network_topology
+import zabbix_graph_export
+
+
+class FakeResponse:
+    def __init__(self, content_type, text='', url='http://zabbix/chart2.php'):
+        self.headers = {'Content-Type': content_type}
+        self.text = text
+        self.content = text.encode()
+        self.status_code = 200
+        self.url = url
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, params=None, stream=False):
+        return self.response
+
+
+def fake_backend(name):
+    backend = types.ModuleType(name)
+    backend.logins = 0
+
+    def zabbix_login_api(session):
+        backend.logins += 1
+        return f"token-{backend.logins}"
+
+    backend.zabbix_login_api = zabbix_login_api
+    backend.zabbix_web_login = lambda session: None
+    return backend
+
+
+def test_rejected_session_logs_in_again_and_retries_once():
+    export_orchestrator.clear_sessions()
+    backend = fake_backend('fake_exporter')
+    tokens = []
+
+    def export(session, auth_token):
+        tokens.append(auth_token)
+        if len(tokens) == 1:
+            raise network_topology.SessionRejected("Session terminated, re-login, please.")
+        return "exported"
+
+    assert export_orchestrator.with_session(backend, export) == "exported"
+    assert tokens == ["token-1", "token-2"]
+    # The new session is cached for the next customer
+    assert export_orchestrator.get_session(backend)[1] == "token-2"
+    assert backend.logins == 2
+
+
+def test_second_rejection_fails_the_stage():
+    export_orchestrator.clear_sessions()
+    backend = fake_backend('fake_exporter')
+
+    def export(session, auth_token):
+        raise network_topology.SessionRejected("Not authorised.")
+
+    with pytest.raises(network_topology.SessionRejected):
+        export_orchestrator.with_session(backend, export)
+    assert backend.logins == 2
+
+
+def test_api_session_errors_are_detected():
+    expired = {'error': {'code': -32602, 'message': 'Invalid params.', 'data': 'Session terminated, re-login, please.'}}
+    with pytest.raises(network_topology.SessionRejected):
+        network_topology.check_api_session(expired, 'host.get')
+    # Other errors and results are left to the caller
+    network_topology.check_api_session({'error': {'message': 'Invalid params.', 'data': 'No such host.'}}, 'host.get')
+    network_topology.check_api_session({'result': []}, 'host.get')
+
+
+def test_chart_login_page_is_not_saved(tmp_path):
+    output = tmp_path / "graph.png"
+    login_page = FakeResponse('text/html; charset=UTF-8', '<form><input name="password" type="password"></form>')
+    with pytest.raises(network_topology.SessionRejected):
+        zabbix_graph_export.download_graph(FakeSession(login_page), '1', 0, 60, str(output))
+    assert not output.exists()
+
+    # A different HTML error (e.g. a deleted graph) is only reported
+    zabbix_graph_export.download_graph(FakeSession(FakeResponse('text/html', 'No permissions')), '1', 0, 60, str(output))
+    assert not output.exists()
+
+    zabbix_graph_export.download_graph(FakeSession(FakeResponse('image/png', 'PNG')), '1', 0, 60, str(output))
+    assert output.read_bytes() == b'PNG'
+
+
+def make_customers(base_directory, grafana_count, zabbix_count):
+    for index in range(grafana_count + zabbix_count):
+        customer_dir = base_directory / f"C{index:02d}"
+        customer_dir.mkdir()
+        selected = "Yes" if index < grafana_count else "No"
+        (customer_dir / "customer_details.txt").write_text(f"Project ID: C{index:02d}\nGrafana Selected: {selected}\n")
+    (base_directory / "not-a-customer").mkdir()
+
+
+def test_batch_respects_backend_limits(tmp_path, monkeypatch):
+    make_customers(tmp_path, 4, 5)
+    running = {'grafana': 0, 'zabbix': 0}
+    peak = dict(running)
+    lock = threading.Lock()
+
+    def fake_report(backend, customer_id):
+        with lock:
+            running[backend] += 1
+            peak[backend] = max(peak[backend], running[backend])
+        time.sleep(0.02)
+        with lock:
+            running[backend] -= 1
+        if customer_id == "C05":
+            raise RuntimeError("renderer down")
+        return True, "done"
+
+    monkeypatch.setattr(export_orchestrator, 'export_and_generate_grafana_report',
+                        lambda month, year, customer_id, *args: fake_report('grafana', customer_id))
+    monkeypatch.setattr(export_orchestrator, 'export_and_generate_report',
+                        lambda month, year, customer_id, *args: fake_report('zabbix', customer_id))
+
+    # Only the Grafana limit is given; Zabbix customers keep the default limit
+    ok, summary = export_orchestrator.run_batch(3, 2024, base_directory=str(tmp_path), backend_limits={'grafana': 1})
+    assert not ok
+    assert summary.startswith("Batch finished: 8 of 9 customers succeeded.")
+    assert "- C05: Unexpected error: renderer down" in summary
+    assert peak['grafana'] == 1
+    assert 1 < peak['zabbix'] <= export_orchestrator.BATCH_BACKEND_LIMITS['zabbix']
+
+
+def test_select_customers(tmp_path, capsys):
+    make_customers(tmp_path, 2, 2)
+    assert [customer_id for customer_id, _ in export_orchestrator.select_customers('all', base_directory=str(tmp_path))] == \
+        ["C00", "C01", "C02", "C03"]
+    assert [customer_id for customer_id, _ in export_orchestrator.select_customers('grafana', base_directory=str(tmp_path))] == \
+        ["C00", "C01"]
+    selected = export_orchestrator.select_customers('list', ["C03", "C99", "C03"], base_directory=str(tmp_path))
+    assert [customer_id for customer_id, _ in selected] == ["C03"]
+    assert "C99" in capsys.readouterr().out
@@ -0,0 +1,52 @@
+import grafana_create
+
+
+def targets(host_name, count):
+    return (host_name, [f"{host_name}/{i}" for i in range(count)])
+
+
+def test_get_shard_key():
+    assert grafana_create.get_shard_key("AA123 - 10.1.2.33") == "10.1.2"
+    assert grafana_create.get_shard_key("AA123 - WEB01") == "web"
+    assert grafana_create.get_shard_key("AA123 - 01-db") == "01-db"
+
+
+def test_hosts_fit_in_one_panel():
+    host_targets = [targets("AA123 - web01", 20), targets("AA123 - db01", 20)]
+    shards = grafana_create.shard_host_targets(host_targets)
+    assert len(shards) == 1
+    assert len(shards[0]) == grafana_create.MAX_TARGETS_PER_PANEL
+
+
+def test_split_at_max_targets_keeps_groups_together():
+    max_targets = grafana_create.MAX_TARGETS_PER_PANEL
+    host_targets = [
+        targets("AA123 - web01", max_targets // 2),
+        targets("AA123 - 10.0.0.5", max_targets // 2),
+        targets("AA123 - web02", max_targets // 2),
+        targets("AA123 - 10.0.0.6", 1),
+    ]
+    shards = grafana_create.shard_host_targets(host_targets)
+
+    assert all(len(shard) <= max_targets for shard in shards)
+    assert sum(len(shard) for shard in shards) == 3 * (max_targets // 2) + 1
+    # Groups in key order: the 10.0.0 subnet, then both web hosts together
+    assert {spec.split('/')[0] for spec in shards[0]} == {"AA123 - 10.0.0.5", "AA123 - 10.0.0.6"}
+    assert {spec.split('/')[0] for spec in shards[1]} == {"AA123 - web01", "AA123 - web02"}
+
+
+def test_oversized_group_splits_at_host_boundaries():
+    host_targets = [targets(f"AA123 - web{i:02d}", 15) for i in range(5)]
+    shards = grafana_create.shard_host_targets(host_targets, max_targets=40)
+
+    assert [len(shard) for shard in shards] == [30, 30, 15]
+    for shard in shards:
+        # No host is split across shards
+        for host_name in {spec.split('/')[0] for spec in shard}:
+            assert sum(1 for spec in shard if spec.startswith(host_name + '/')) == 15
+
+
+def test_host_larger_than_a_panel_gets_its_own_shard():
+    host_targets = [targets("AA123 - web01", 5), targets("AA123 - web02", 50), targets("AA123 - web03", 5)]
+    shards = grafana_create.shard_host_targets(host_targets, max_targets=40)
+    assert [len(shard) for shard in shards] == [5, 50, 5]
@@ -0,0 +1,66 @@
+import grafana_create
+import grafana_reconcile
+
+HOSTS = [{'hostid': '1', 'host': "AA123 - web01"}, {'hostid': '2', 'host': "AA123 - db01"}]
+ITEMS = {
+    "AA123 - web01": {"CPU utilization": ["CPU utilization"], "Disk Space Usage": ["/: Space utilization"]},
+    "AA123 - db01": {"CPU utilization": ["CPU utilization"]},
+}
+
+
+class FakeSession:
+    def __init__(self, dashboard_json):
+        self.dashboard_json = dashboard_json
+
+    def get(self, url):
+        response = type('Response', (), {})()
+        response.status_code = 200
+        response.json = lambda: self.dashboard_json
+        return response
+
+
+def reconcile(monkeypatch, current_items, new_items, dry_run=False):
+    current = grafana_create.build_dashboard("AA123", HOSTS, current_items, dashboard_uid="uid-1")
+    collected = []
+    pushed = []
+    monkeypatch.setattr(grafana_create, 'collect_host_items', lambda auth_token, hosts: collected.append(hosts) or new_items)
+    monkeypatch.setattr(grafana_create, 'push_dashboard', lambda dashboard: pushed.append(dashboard) or ("uid-1", "/d/uid-1"))
+    details = {"Dashboard UID": "uid-1", "Host Group Name": "AA123"}
+    result = grafana_reconcile.reconcile_customer("token", FakeSession(current), "AA123", details, HOSTS, dry_run)
+    return result, collected, pushed
+
+
+def test_unchanged_dashboard_is_not_pushed(monkeypatch):
+    result, collected, pushed = reconcile(monkeypatch, ITEMS, ITEMS)
+    assert result == ("AA123", "unchanged", "up to date")
+    assert collected == [HOSTS]
+    assert pushed == []
+
+
+def test_host_gaining_an_item_is_drift(monkeypatch):
+    new_items = dict(ITEMS, **{"AA123 - db01": {"CPU utilization": ["CPU utilization"],
+                                                "Disk Space Usage": ["/data: Space utilization"]}})
+    result, collected, pushed = reconcile(monkeypatch, ITEMS, new_items)
+    assert result == ("AA123", "updated", "1 target(s) to add, 0 to remove")
+    # The items collected for the comparison are the ones pushed, without fetching them again
+    assert len(collected) == 1
+    assert len(pushed) == 1
+    assert ("Disk Space Usage for AA123", "AA123 - db01", "/data: Space utilization") in \
+        grafana_reconcile.get_dashboard_targets(pushed[0])
+    assert pushed[0]['dashboard']['uid'] == "uid-1"
+
+
+def test_item_moving_between_criteria_is_drift(monkeypatch):
+    moved = {
+        "AA123 - web01": {"CPU utilization": ["CPU utilization"], "Memory utilization": ["/: Space utilization"]},
+        "AA123 - db01": {"CPU utilization": ["CPU utilization"]},
+    }
+    result, _, pushed = reconcile(monkeypatch, ITEMS, moved, dry_run=True)
+    assert result == ("AA123", "drifted", "1 target(s) to add, 1 to remove")
+    assert pushed == []
+
+
+def test_host_losing_all_items_is_drift(monkeypatch):
+    lost = dict(ITEMS, **{"AA123 - db01": {}})
+    result, _, _ = reconcile(monkeypatch, ITEMS, lost, dry_run=True)
+    assert result == ("AA123", "drifted", "0 target(s) to add, 1 to remove")
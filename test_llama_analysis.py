@@ -0,0 +1,115 @@
+import io
+import json
+import base64
+import requests
+from PIL import Image
+import llama_analysis
+
+
+def make_response(status_code, body):
+    # A streamed response whose body can only be read until it is closed
+    response = requests.models.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(body.encode())
+    response.url = llama_analysis.LLAMA_API_URL
+    return response
+
+
+def fake_post(responses):
+    def post(url, data=None, **kwargs):
+        return responses.pop(0)
+    return post
+
+
+def test_error_body_is_reported(monkeypatch, capsys):
+    monkeypatch.setattr(llama_analysis, 'prepare_image', lambda image_path: [b'PNG'])
+    monkeypatch.setattr(requests, 'post', fake_post([make_response(400, '{"error": "model not found"}')]))
+
+    assert llama_analysis.generate_analysis(["graph.png"], "Describe the graph.") == (None, False)
+    out = capsys.readouterr().out
+    assert "400 Client Error" in out
+    assert 'Response content: {"error": "model not found"}' in out
+
+
+def test_streamed_analysis_is_read(monkeypatch):
+    monkeypatch.setattr(llama_analysis, 'prepare_image', lambda image_path: [b'PNG'])
+    lines = [{"response": "CPU is "}, {"response": "steady.", "done": True}]
+    body = "\n".join(json.dumps(line) for line in lines)
+    monkeypatch.setattr(requests, 'post', fake_post([make_response(200, body)]))
+
+    assert llama_analysis.generate_analysis(["graph.png"], "Describe the graph.") == ("CPU is steady.", True)
+
+
+def test_prepare_image_downscales_keeping_aspect_ratio(tmp_path, monkeypatch):
+    path = str(tmp_path / "graph.png")
+    Image.new('RGB', (2000, 1000), (255, 255, 255)).save(path)
+    monkeypatch.setattr(llama_analysis, 'LLAMA_LEGEND_TILES', False)
+
+    (prepared,) = llama_analysis.prepare_image(path)
+    with Image.open(io.BytesIO(prepared)) as image:
+        assert image.size == (llama_analysis.LLAMA_IMAGE_SIZE, llama_analysis.LLAMA_IMAGE_SIZE // 2)
+
+    # Small graphs are never upscaled
+    Image.new('RGB', (400, 300)).save(path)
+    with Image.open(io.BytesIO(llama_analysis.prepare_image(path)[0])) as image:
+        assert image.size == (400, 300)
+    assert llama_analysis.prepare_image(str(tmp_path / "missing.png")) is None
+
+
+def test_prepare_image_cuts_long_legend_into_tiles(tmp_path, monkeypatch):
+    path = str(tmp_path / "graph.png")
+    Image.new('RGB', (1000, 2600)).save(path)
+    monkeypatch.setattr(llama_analysis, 'LLAMA_LEGEND_TILES', True)
+    monkeypatch.setattr(llama_analysis, 'LLAMA_PLOT_HEIGHT_RATIO', 0.3)
+
+    sizes = []
+    for prepared in llama_analysis.prepare_image(path):
+        with Image.open(io.BytesIO(prepared)) as image:
+            sizes.append(image.size)
+    # The plot, then the 2300 px legend in square tiles
+    assert sizes == [(1000, 300), (1000, 1000), (1000, 1000), (1000, 300)]
+
+
+def test_iter_payload_is_the_json_body(monkeypatch):
+    monkeypatch.setattr(llama_analysis, 'PAYLOAD_CHUNK_BYTES', 3 * 4)
+    images = [bytes(range(50)), b'PNG']
+    body = json.loads(b''.join(llama_analysis.iter_payload({"model": "m", "stream": True}, images)))
+    assert body == {"model": "m", "stream": True,
+                    "images": [base64.b64encode(image).decode() for image in images]}
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def iter_lines(self):
+        for chunk in self.chunks:
+            yield json.dumps(chunk).encode()
+
+
+def test_read_stream_budgets(monkeypatch):
+    words = [{"response": word} for word in ("CPU ", "is ", "steady. ", "Memory ", "is")]
+    # The stream ended before 'done': cut at the last sentence and worth another attempt
+    assert llama_analysis.read_stream(FakeStream(words), "graph.png") == ("CPU is steady.", False)
+
+    # The model stopped at its token limit: the same answer every time, cut at the last sentence
+    done = words + [{"response": "", "done": True, "done_reason": "length"}]
+    assert llama_analysis.read_stream(FakeStream(done), "graph.png") == ("CPU is steady.", True)
+
+    monkeypatch.setattr(llama_analysis, 'LLAMA_MAX_TOKENS', 4)
+    assert llama_analysis.read_stream(FakeStream(words), "graph.png") == ("CPU is steady.", True)
+
+    # Cut off by the time budget: used, but another attempt may answer differently
+    monkeypatch.setattr(llama_analysis, 'LLAMA_MAX_TOKENS', 100)
+    monkeypatch.setattr(llama_analysis, 'LLAMA_MAX_GENERATION_SECONDS', 0)
+    assert llama_analysis.read_stream(FakeStream(words), "graph.png") == ("CPU", False)
+
+
+def test_read_stream_reports_partial_text(monkeypatch):
+    events = []
+    monkeypatch.setattr(llama_analysis.progress, 'emit', lambda stage, message, **data: events.append(data['text']))
+    monkeypatch.setattr(llama_analysis, 'LLAMA_PROGRESS_SECONDS', 0)
+    chunks = [{"response": "CPU "}, {"response": "is "}, {"response": "steady.", "done": True}]
+    assert llama_analysis.read_stream(FakeStream(chunks), "graph.png") == ("CPU is steady.", True)
+    # Each report carries only the text generated since the previous one
+    assert events == ["CPU ", "is "]
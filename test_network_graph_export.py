@@ -0,0 +1,48 @@
+import os
+import threading
+import network_graph_export
+import network_topology
+
+
+class FakeResponse:
+    headers = {'Content-Type': 'image/png'}
+
+    def __init__(self, graph_id):
+        self.content = f"PNG {graph_id}".encode()
+
+
+class FakeSession:
+    def __init__(self):
+        self.graph_ids = []
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, stream=False):
+        with self._lock:
+            self.graph_ids.append(params['graphid'])
+        return FakeResponse(params['graphid'])
+
+
+def test_each_graph_is_downloaded_once(tmp_path, monkeypatch):
+    switch = {'hostid': '1', 'host': "R01-sw1", 'name': "R01-sw1"}
+    router = {'hostid': '2', 'host': "R01-rt1", 'name': "R01-rt1"}
+    uplink = {'graphid': '10', 'name': "Uplink AA123 & AA124 bits"}
+    racks = {
+        ("R01", "AA123"): [(switch, [uplink, {'graphid': '11', 'name': "Port 1/1 AA123 bits"}]), (router, [])],
+        # The uplink carries both server tags
+        ("R01", "AA124"): [(switch, [uplink])],
+    }
+    monkeypatch.setattr(network_topology, 'find_tagged_graphs',
+                        lambda session, api_url, auth_token, rack, server_tag: racks[(rack, server_tag)])
+    details = {"Project ID": "AA123", "Server Tag 1": "AA123", "Rack 1": "R01",
+               "Server Tag 2": "AA124", "Rack 2": "R01"}
+    session = FakeSession()
+
+    network_graph_export.export_network_graphs(str(tmp_path), 3, 2024, session=session, auth_token="token", details=details)
+
+    assert sorted(session.graph_ids) == ['10', '11']
+    output_dir = tmp_path / "2024-03" / "network"
+    files = sorted(os.listdir(output_dir / "R01-sw1"))
+    assert files == ["Port 1^1 AA123 bits_1709251200.png", "Uplink AA123 & AA124 bits_1709251200.png"]
+    assert (output_dir / "R01-sw1" / files[0]).read_bytes() == b"PNG 11"
+    # Hosts without matching graphs still get their directory
+    assert os.listdir(output_dir / "R01-rt1") == []
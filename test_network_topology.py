@@ -0,0 +1,67 @@
+import pytest
+import network_topology
+
+API_URL = "http://network-zabbix/api_jsonrpc.php"
+HOSTS = [
+    {'hostid': '1', 'host': "AIMS-R01-sw1", 'name': "AIMS-R01-sw1", 'groups': []},
+    {'hostid': '2', 'host': "R02-sw1", 'name': "R02-sw1", 'groups': []},
+]
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    # Answers each API call with the next queued JSON body
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = []
+
+    def post(self, url, json=None):
+        self.calls.append(json['method'])
+        return FakeResponse(self.answers.pop(0))
+
+
+def setup_function():
+    network_topology.clear_cache()
+
+
+def test_error_answers_are_not_cached():
+    session = FakeSession(
+        {'error': {'code': -32500, 'message': 'Application error.', 'data': 'Database error.'}},
+        {'result': HOSTS},
+    )
+    assert network_topology.get_network_hosts(session, API_URL, "token") == []
+    assert network_topology.get_network_hosts(session, API_URL, "token") == HOSTS
+    # The successful answer is cached
+    assert network_topology.get_network_hosts(session, API_URL, "token") == HOSTS
+    assert session.calls == ["host.get", "host.get"]
+
+
+def test_item_errors_are_not_cached():
+    item = {'itemid': '10', 'name': "Bits received AA123", 'key_': "net.if.in", 'hosts': [{'hostid': '1'}]}
+    session = FakeSession({'error': {'message': 'Application error.', 'data': 'Timeout.'}}, {'result': [item]})
+    assert network_topology.get_host_items(session, API_URL, "token", ['1', '2']) == {'1': [], '2': []}
+    items = network_topology.get_host_items(session, API_URL, "token", ['1', '2'])
+    assert items == {'1': [{'itemid': '10', 'name': "Bits received AA123", 'key_': "net.if.in"}], '2': []}
+    assert network_topology.get_host_items(session, API_URL, "token", ['2', '1']) == items
+    assert session.calls == ["item.get", "item.get"]
+
+
+def test_session_errors_raise():
+    session = FakeSession({'error': {'code': -32602, 'message': 'Invalid params.',
+                                     'data': 'Session terminated, re-login, please.'}})
+    with pytest.raises(network_topology.SessionRejected):
+        network_topology.get_network_hosts(session, API_URL, "token")
+
+
+def test_mah_rack_falls_back_to_aims():
+    session = FakeSession({'result': HOSTS})
+    assert network_topology.find_rack_hosts(session, API_URL, "token", "MAH-R01") == [HOSTS[0]]
+    assert network_topology.find_rack_hosts(session, API_URL, "token", "R02") == [HOSTS[1]]
+    assert session.calls == ["host.get"]
@@ -0,0 +1,24 @@
+import numeric_analysis
+
+
+def test_percentile_whole_number_ranks():
+    values = list(range(1, 21))
+    assert numeric_analysis.percentile(values, 0.95) == 19
+    assert numeric_analysis.percentile(values, 0.5) == 10
+    assert numeric_analysis.percentile(list(range(1, 101)), 0.95) == 95
+    assert numeric_analysis.percentile(list(range(1, 101)), 0.99) == 99
+
+
+def test_percentile_fractional_ranks_and_bounds():
+    assert numeric_analysis.percentile(list(range(1, 11)), 0.95) == 10
+    assert numeric_analysis.percentile(list(range(1, 11)), 0.25) == 3
+    assert numeric_analysis.percentile([7], 0.95) == 7
+    assert numeric_analysis.percentile([1, 2, 3], 0) == 1
+    assert numeric_analysis.percentile([1, 2, 3], 1) == 3
+
+
+def test_series_stats_p95():
+    points = [(i * 60000, float(v)) for i, v in enumerate(range(1, 21))]
+    stats = numeric_analysis.series_stats(points)
+    assert stats['p95'] == 19
+    assert stats['max'] == 20
@@ -0,0 +1,49 @@
+import random
+from PIL import Image
+import png_optimizer
+
+
+def graph_image(colour_count, size=(200, 100)):
+    # A noisy image with exactly colour_count colours, like a graph with many series
+    rng = random.Random(colour_count)
+    colours = [(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(colour_count)]
+    colours = list(dict.fromkeys(colours))
+    image = Image.new('RGB', size)
+    image.putdata([colours[rng.randrange(len(colours))] for _ in range(size[0] * size[1])])
+    return image
+
+
+def test_to_exact_palette_keeps_every_pixel():
+    for colour_count in (100, 200, 256):
+        image = graph_image(colour_count)
+        optimized = png_optimizer.to_exact_palette(image)
+        assert optimized.mode == 'P'
+        assert optimized.convert('RGB').tobytes() == image.tobytes()
+
+
+def test_to_exact_palette_refuses_other_images():
+    assert png_optimizer.to_exact_palette(graph_image(400, size=(100, 100))) is None
+    transparent = Image.new('RGBA', (10, 10), (255, 0, 0, 128))
+    assert png_optimizer.to_exact_palette(transparent) is None
+    opaque = Image.new('RGBA', (10, 10), (255, 0, 0, 255))
+    assert png_optimizer.to_exact_palette(opaque).convert('RGB').tobytes() == opaque.convert('RGB').tobytes()
+
+
+def test_optimize_png_is_lossless_and_runs_once(tmp_path):
+    path = str(tmp_path / "graph.png")
+    image = graph_image(200)
+    image.save(path, dpi=(96, 96))
+    assert not png_optimizer.is_optimized(path)
+
+    before, after = png_optimizer.optimize_png(path, keep_original=True)
+    assert after < before
+    assert png_optimizer.is_optimized(path)
+    with Image.open(path) as optimized:
+        assert optimized.info[png_optimizer.OPTIMIZED_MARKER.decode()] == 'lossless'
+        assert round(optimized.info['dpi'][0]) == 96
+        assert optimized.convert('RGB').tobytes() == image.tobytes()
+    with Image.open(path + '.orig') as original:
+        assert original.convert('RGB').tobytes() == image.tobytes()
+
+    # Already optimized files are left alone
+    assert png_optimizer.optimize_png(path) == (after, after)
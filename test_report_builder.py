@@ -0,0 +1,110 @@
+import shutil
+from docx import Document
+from docx.image.image import Image as DocxImage
+from docx.oxml.ns import qn
+from docx.shared import Inches
+from PIL import Image
+import report_builder
+
+
+def body_texts(doc):
+    # Text of every paragraph and table in the body, in document order
+    texts = []
+    for child in doc.element.body.iterchildren():
+        if child.tag == qn('w:p'):
+            texts.append(''.join(t.text or '' for t in child.iter(qn('w:t'))))
+        elif child.tag == qn('w:tbl'):
+            texts.append('<table>')
+    return texts
+
+
+def make_points(*paragraphs):
+    doc = Document()
+    for text in paragraphs:
+        doc.add_paragraph(text)
+    anchors = ['ANCHOR']
+    return doc, report_builder.find_insertion_points(doc, anchors)['ANCHOR']
+
+
+def insert_mixed(doc, point):
+    fragment = report_builder.Fragment()
+    fragment.paragraph("fragment 1")
+    fragment.paragraph("fragment 2")
+    point.paragraph("first")
+    report_builder.insert_fragment(point, fragment)
+    point.element(doc.add_table(rows=1, cols=1)._tbl)
+    point.paragraph("last")
+
+
+def test_insert_in_order_before_following_paragraph():
+    doc, point = make_points("before", "ANCHOR", "after")
+    insert_mixed(doc, point)
+    assert body_texts(doc) == ["before", "ANCHOR", "first", "fragment 1", "fragment 2", "<table>", "last", "after"]
+    assert point.count == 5
+
+
+def test_insert_in_order_when_anchor_is_last_paragraph():
+    doc, point = make_points("before", "ANCHOR")
+    insert_mixed(doc, point)
+    assert body_texts(doc) == ["before", "ANCHOR", "first", "fragment 1", "fragment 2", "<table>", "last"]
+    # The section properties stay the last element of the body
+    assert doc.element.body[-1].tag == qn('w:sectPr')
+
+
+def write_png(path, size, color, dpi=None):
+    image = Image.new('RGB', size, color)
+    if dpi:
+        image.save(path, dpi=dpi)
+    else:
+        image.save(path)
+    return str(path)
+
+
+def test_read_png_header_matches_python_docx(tmp_path):
+    for name, size, dpi in (("plain.png", (640, 480), None), ("dpi.png", (300, 150), (150, 150))):
+        path = write_png(tmp_path / name, size, (10, 20, 30), dpi)
+        image = DocxImage.from_file(path)
+        assert report_builder.read_png_header(path) == (image.px_width, image.px_height, image.horz_dpi, image.vert_dpi)
+    assert report_builder.image_size(str(tmp_path / "dpi.png")) == (300, 150)
+
+
+def test_read_png_header_rejects_other_files(tmp_path):
+    jpeg = tmp_path / "graph.jpg"
+    Image.new('RGB', (10, 10)).save(jpeg)
+    assert report_builder.read_png_header(str(jpeg)) is None
+    assert report_builder.image_size(str(jpeg)) == (10, 10)
+
+
+def test_identical_pictures_are_stored_once_and_saved(tmp_path):
+    first = write_png(tmp_path / "first.png", (400, 200), (200, 0, 0))
+    copy = str(tmp_path / "copy.png")
+    shutil.copy(first, copy)
+    other = write_png(tmp_path / "other.png", (100, 100), (0, 0, 200))
+
+    doc, point = make_points("ANCHOR", "after")
+    for path in (first, copy, other):
+        point.picture(path, width=Inches(4))
+    fragment = report_builder.Fragment()
+    fragment.picture(copy, width=Inches(2))
+    report_builder.insert_fragment(point, fragment)
+
+    assert len(doc.part.package.image_parts) == 2
+    saved = str(tmp_path / "report.docx")
+    doc.save(saved)
+
+    reopened = Document(saved)
+    shapes = reopened.inline_shapes
+    assert len(shapes) == 4
+    assert [shape.width for shape in shapes] == [Inches(4), Inches(4), Inches(4), Inches(2)]
+    # Aspect ratio kept: 400x200 at width 4in is 2in high
+    assert shapes[0].height == Inches(2)
+    blobs = [reopened.part.related_parts[shape._inline.graphic.graphicData.pic.blipFill.blip.embed].blob
+             for shape in shapes]
+    with open(first, 'rb') as f:
+        assert blobs[0] == blobs[1] == blobs[3] == f.read()
+    with open(other, 'rb') as f:
+        assert blobs[2] == f.read()
+    assert len({part.partname for part in reopened.part.package.image_parts}) == 2
+    # Every drawing has its own id
+    ids = [shape._inline.docPr.id for shape in shapes]
+    assert len(set(ids)) == 4
@@ -0,0 +1,38 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web_app'))
+
+import task_output
+from task_output import TaskOutput
+
+
+def messages(output):
+    # Lines without the timestamp ('YYYY-MM-DD HH:MM:SS,mmm ')
+    return [line.split(' ', 2)[2] for line in output.tail(100)]
+
+
+def make_output(tmp_path):
+    return TaskOutput(str(tmp_path / "task.log"), 100, 100000, 1)
+
+
+def test_lines_end_at_newline_and_carriage_return(tmp_path):
+    output = make_output(tmp_path)
+    output.write("first\nsec")
+    output.write("ond\r\n 10%\r 50%\r")
+    # The trailing '\r' waits in case '\n' follows
+    output.write("\n100%")
+    assert messages(output) == ["first", "second", " 10%", " 50%"]
+    output.close()
+    assert messages(output) == ["first", "second", " 10%", " 50%", "100%"]
+    with open(tmp_path / "task.log") as f:
+        assert [line.split(' ', 2)[2] for line in f.read().splitlines()] == messages(output)
+
+
+def test_output_without_line_end_is_flushed_in_pieces(tmp_path):
+    output = make_output(tmp_path)
+    for _ in range(5):
+        output.write("x" * (task_output.MAX_LINE_CHARS // 2))
+    assert messages(output) == ["x" * task_output.MAX_LINE_CHARS] * 2
+    assert len(output._partial) == task_output.MAX_LINE_CHARS // 2
+    output.close()
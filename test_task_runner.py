@@ -0,0 +1,153 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web_app'))
+
+from task_runner import TaskRunner, INTERACTIVE, BATCH
+
+
+class Recorder:
+    # set_status callback that records every status and lets tests wait for one
+
+    def __init__(self):
+        self.statuses = {}
+        self.condition = threading.Condition()
+
+    def set_status(self, task_id, status, message, lane=None):
+        with self.condition:
+            self.statuses.setdefault(task_id, []).append((status, message))
+            self.condition.notify_all()
+
+    def wait_for(self, task_id, status, timeout=5):
+        with self.condition:
+            assert self.condition.wait_for(
+                lambda: any(s == status for s, _ in self.statuses.get(task_id, [])), timeout
+            ), f"{task_id} never reached {status}: {self.statuses.get(task_id)}"
+
+
+def blocking_job(started, release, name, order):
+    def job():
+        order.append(name)
+        started.set()
+        release.wait(5)
+        return True, f"{name} done"
+    return job
+
+
+def recording_job(name, order):
+    def job():
+        order.append(name)
+        return True, f"{name} done"
+    return job
+
+
+def test_duplicate_key_returns_existing_task():
+    recorder = Recorder()
+    runner = TaskRunner(2, recorder.set_status)
+    started, release = threading.Event(), threading.Event()
+    order = []
+
+    first, created = runner.submit('report:1', blocking_job(started, release, 'first', order))
+    assert created
+    started.wait(5)
+    # Running: the same key is not queued again
+    assert runner.submit('report:1', lambda: (True, "")) == (first, False)
+    release.set()
+    recorder.wait_for(first, 'completed')
+
+    # Finished: the key can be submitted again
+    second, created = runner.submit('report:1', lambda: (True, "again"))
+    assert created and second != first
+    recorder.wait_for(second, 'completed')
+
+
+def test_interactive_jobs_go_before_queued_batch_jobs():
+    recorder = Recorder()
+    runner = TaskRunner(1, recorder.set_status, reserved_interactive=1)
+    started, release = threading.Event(), threading.Event()
+    order = []
+
+    runner.submit('blocker', blocking_job(started, release, 'blocker', order))
+    started.wait(5)
+    batch_ids = [runner.submit(f'batch:{i}', recording_job(f'batch{i}', order), priority=BATCH)[0]
+                 for i in range(2)]
+    interactive_id, _ = runner.submit('interactive', recording_job('interactive', order),
+                                      priority=INTERACTIVE)
+    assert runner.stats()['queued_batch'] == 2
+    release.set()
+    for task_id in batch_ids + [interactive_id]:
+        recorder.wait_for(task_id, 'completed')
+
+    assert order == ['blocker', 'interactive', 'batch0', 'batch1']
+
+
+def test_reserved_worker_never_takes_batch_jobs():
+    recorder = Recorder()
+    runner = TaskRunner(2, recorder.set_status, reserved_interactive=1)
+    batch_started, batch_release = threading.Event(), threading.Event()
+    order = []
+
+    runner.submit('batch:0', blocking_job(batch_started, batch_release, 'batch0', order), priority=BATCH)
+    batch_started.wait(5)
+    waiting_id, _ = runner.submit('batch:1', recording_job('batch1', order), priority=BATCH)
+    # The only free worker is reserved, so the second batch job waits...
+    assert runner.stats()['queued_batch'] == 1
+    # ...while an interactive job still starts right away
+    interactive_id, _ = runner.submit('interactive', recording_job('interactive', order))
+    recorder.wait_for(interactive_id, 'completed')
+    assert runner.stats()['queued_batch'] == 1
+
+    batch_release.set()
+    recorder.wait_for(waiting_id, 'completed')
+    assert order == ['batch0', 'interactive', 'batch1']
+
+
+def test_failures_and_exceptions_mark_the_task_failed():
+    recorder = Recorder()
+    runner = TaskRunner(1, recorder.set_status)
+
+    def broken():
+        raise RuntimeError("boom")
+
+    failed_id, _ = runner.submit('failed', lambda: (False, "Export failed."))
+    broken_id, _ = runner.submit('broken', broken)
+    recorder.wait_for(failed_id, 'failed')
+    recorder.wait_for(broken_id, 'failed')
+    assert recorder.statuses[failed_id][-1] == ('failed', "Export failed.")
+    assert recorder.statuses[broken_id][-1] == ('failed', "Unexpected error: boom")
+
+
+def test_worker_survives_failing_status_and_output():
+    recorder = Recorder()
+    failures = {'in progress': 1, 'completed': 1, 'output': 0}
+
+    def set_status(task_id, status, message, lane=None):
+        if failures.get(status):
+            failures[status] -= 1
+            raise RuntimeError("database is locked")
+        recorder.set_status(task_id, status, message, lane)
+
+    def open_output(task_id):
+        if failures['output']:
+            failures['output'] -= 1
+            raise PermissionError("log file")
+        return None
+
+    runner = TaskRunner(1, set_status, open_output=open_output)
+    not_started, _ = runner.submit('a', lambda: (True, "done"))
+    recorder.wait_for(not_started, 'failed')
+    assert recorder.statuses[not_started][-1] == ('failed', "Unexpected error: database is locked")
+
+    not_recorded, _ = runner.submit('b', lambda: (True, "done"))
+    recorder.wait_for(not_recorded, 'failed')
+    assert recorder.statuses[not_recorded][-1] == ('failed', "Could not record the task's result: database is locked")
+
+    failures['output'] = 1
+    no_output, _ = runner.submit('c', lambda: (True, "done"))
+    recorder.wait_for(no_output, 'failed')
+    assert recorder.statuses[no_output][-1] == ('failed', "Unexpected error: log file")
+
+    # The single worker is still alive and runs later jobs
+    ok, _ = runner.submit('d', lambda: (True, "done"))
+    recorder.wait_for(ok, 'completed')
@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web_app'))
+
+from task_store import TaskStore
+
+
+def test_set_and_get(tmp_path):
+    store = TaskStore(str(tmp_path / "tasks.db"))
+    assert store.get("missing") is None
+
+    store.set("a", 'in progress', "Task is running.")
+    assert store.get("a") == {'status': 'in progress', 'message': "Task is running."}
+    store.set("a", 'completed', "Done.")
+    assert store.get("a") == {'status': 'completed', 'message': "Done."}
+    assert [(event, data['status']) for _, event, data in store.get_events("a")] == [
+        ('status', 'in progress'), ('status', 'completed')
+    ]
+
+
+def test_queued_position_puts_interactive_before_batch(tmp_path):
+    store = TaskStore(str(tmp_path / "tasks.db"))
+    store.set("batch-1", 'queued', "", lane='batch')
+    store.set("interactive-1", 'queued', "", lane='interactive')
+    store.set("batch-2", 'queued', "", lane='batch')
+    store.set("interactive-2", 'queued', "", lane='interactive')
+
+    positions = {task_id: store.get(task_id)['position']
+                 for task_id in ("interactive-1", "interactive-2", "batch-1", "batch-2")}
+    assert positions == {"interactive-1": 1, "interactive-2": 2, "batch-1": 3, "batch-2": 4}
+
+    store.set("interactive-1", 'in progress', "Task is running.")
+    assert store.get("batch-1")['position'] == 2
+    assert store.get("batch-1")['message'] == "Queued at position 2."
+
+    # Another process's queue does not count
+    other = TaskStore(str(tmp_path / "tasks.db"))
+    other.set("other-1", 'queued', "", lane='interactive')
+    assert store.get("batch-1")['position'] == 2
+    assert other.get("other-1")['position'] == 1
+
+
+def test_evict_expired(tmp_path):
+    store = TaskStore(str(tmp_path / "tasks.db"), ttl_seconds=100, stale_seconds=1000)
+    for task_id, status in (("old-done", 'completed'), ("old-running", 'in progress'),
+                            ("stale", 'queued'), ("new-done", 'failed')):
+        store.set(task_id, status, "")
+        store.add_event(task_id, 'progress', {'stage': 'test'})
+    conn = store._connect()
+    now = time.time()
+    for task_id, age in (("old-done", 200), ("old-running", 200), ("stale", 2000), ("new-done", 10)):
+        conn.execute("UPDATE tasks SET updated_at = ? WHERE task_id = ?", (now - age, task_id))
+
+    store.evict_expired()
+
+    assert store.get("old-done") is None
+    assert store.get_events("old-done") == []
+    assert store.get("stale") is None
+    assert store.get("old-running")['status'] == 'in progress'
+    assert store.get("new-done")['status'] == 'failed'
+
+
+def test_fail_interrupted_only_fails_tasks_of_stopped_processes(tmp_path):
+    path = str(tmp_path / "tasks.db")
+    stopped = TaskStore(path)
+    stopped.set("queued", 'queued', "")
+    stopped.set("running", 'in progress', "Task is running.")
+    stopped.set("done", 'completed', "Done.")
+    alive = TaskStore(path)
+    alive.set("alive-running", 'in progress', "Task is running.")
+
+    store = TaskStore(path, owner_timeout_seconds=60)
+    store.set("own", 'queued', "")
+    # Every process beat just now
+    assert store.fail_interrupted() == 0
+
+    conn = store._connect()
+    conn.execute("UPDATE owners SET heartbeat = ? WHERE owner = ?", (time.time() - 120, stopped.owner))
+    # A process that never recorded a heartbeat counts from its tasks' last update
+    conn.execute("INSERT INTO tasks (task_id, owner, lane, status, message, created_at, updated_at)"
+                 " VALUES ('orphan', 'old-process', 'interactive', 'in progress', '', 0, 0)")
+    assert store.fail_interrupted() == 3
+
+    message = "Interrupted: the app process running it stopped."
+    assert store.get("queued") == {'status': 'failed', 'message': message}
+    assert store.get("running") == {'status': 'failed', 'message': message}
+    assert store.get("orphan")['status'] == 'failed'
+    assert store.get("done")['status'] == 'completed'
+    assert store.get("alive-running")['status'] == 'in progress'
+    assert store.get("own")['status'] == 'queued'
+    assert store.get_events("running")[-1][2] == {'status': 'failed', 'message': message}
+
+
+def test_wait_for_change_wakes_on_writes(tmp_path):
+    store = TaskStore(str(tmp_path / "tasks.db"))
+    version = store.change_version()
+    assert not store.wait_for_change(version, 0.05)
+
+    writer = threading.Timer(0.05, store.add_event, ("a", 'progress', {'stage': 'test'}))
+    writer.start()
+    started = time.monotonic()
+    assert store.wait_for_change(version, 5)
+    assert time.monotonic() - started < 1
+    writer.join()
+
+    version = store.change_version()
+    store.set("a", 'completed', "Done.")
+    assert store.wait_for_change(version, 0)
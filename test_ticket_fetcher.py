@@ -0,0 +1,82 @@
+from datetime import datetime
+import ticket_fetcher
+from ticket_fetcher import UTC_PLUS_8
+
+
+def timestamp(year, month, day, hour=0):
+    return int(datetime(year, month, day, hour, tzinfo=UTC_PLUS_8).timestamp())
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.url = f"{ticket_fetcher.SUPPORTPAL_API_URL}/ticket/ticket"
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeSupportPal:
+    # Tickets per service ID served newest first, 'limit' at a time from the 1-based 'start'
+    def __init__(self, tickets):
+        self.tickets = tickets
+        self.requests = []
+
+    def get(self, url, params=None, auth=None):
+        service_id = params[f'customfield[{ticket_fetcher.SERVICE_ID_CUSTOM_FIELD}]']
+        self.requests.append((service_id, params['start']))
+        tickets = sorted(self.tickets.get(service_id, []), key=lambda ticket: ticket['created_at'], reverse=True)
+        start = params['start'] - 1
+        return FakeResponse({'status': 'success', 'data': [dict(ticket) for ticket in tickets[start:start + params['limit']]]})
+
+
+def make_tickets(first_id, dates):
+    return [{'id': first_id + i, 'created_at': timestamp(*date)} for i, date in enumerate(dates)]
+
+
+def test_paging_stops_at_month_boundary(monkeypatch):
+    monkeypatch.setattr(ticket_fetcher, 'TICKET_PAGE_LIMIT', 3)
+    # Two tickets after the month, four in it (one at each edge), then years of history
+    dates = [(2024, 4, 2), (2024, 4, 1)]
+    dates += [(2024, 3, 31, 23), (2024, 3, 20), (2024, 3, 10), (2024, 3, 1, 0)]
+    dates += [(2024, 2, 29, 23)] + [(2023, month, 1) for month in range(12, 0, -1)]
+    api = FakeSupportPal({'SID1': make_tickets(1, dates)})
+    monkeypatch.setattr(ticket_fetcher.requests, 'get', api.get)
+
+    start_date, end_date = ticket_fetcher.get_month_range(3, 2024)
+    tickets = ticket_fetcher.fetch_service_tickets('SID1', start_date, end_date)
+
+    assert [ticket['id'] for ticket in tickets] == [3, 4, 5, 6]
+    # The third page reaches February, so nothing older is requested
+    assert api.requests == [('SID1', 1), ('SID1', 4), ('SID1', 7)]
+
+
+def test_short_last_page_ends_paging(monkeypatch):
+    monkeypatch.setattr(ticket_fetcher, 'TICKET_PAGE_LIMIT', 3)
+    api = FakeSupportPal({'SID1': make_tickets(1, [(2024, 3, 5), (2024, 3, 4), (2024, 3, 3), (2024, 3, 2)])})
+    monkeypatch.setattr(ticket_fetcher.requests, 'get', api.get)
+
+    start_date, end_date = ticket_fetcher.get_month_range(3, 2024)
+    assert len(ticket_fetcher.fetch_service_tickets('SID1', start_date, end_date)) == 4
+    assert api.requests == [('SID1', 1), ('SID1', 4)]
+
+
+def test_fetch_tickets_merges_service_ids_oldest_first(monkeypatch):
+    shared = {'id': 10, 'created_at': timestamp(2024, 3, 15)}
+    api = FakeSupportPal({
+        'SID1': make_tickets(1, [(2024, 3, 20), (2024, 2, 1)]) + [shared],
+        'SID2': make_tickets(5, [(2024, 3, 2)]) + [shared],
+    })
+    monkeypatch.setattr(ticket_fetcher.requests, 'get', api.get)
+
+    tickets = ticket_fetcher.fetch_tickets(['SID1', 'SID2'], 3, 2024)
+    assert [ticket['id'] for ticket in tickets] == [5, 10, 1]
+
+
+def test_api_error_fails_the_fetch(monkeypatch):
+    monkeypatch.setattr(ticket_fetcher.requests, 'get',
+                        lambda url, params=None, auth=None: FakeResponse({'status': 'error', 'message': 'Denied'}))
+    assert ticket_fetcher.fetch_tickets(['SID1'], 3, 2024) is None
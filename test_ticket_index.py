@@ -0,0 +1,56 @@
+import time
+from datetime import datetime, timezone
+from docx import Document
+import ticket_fetcher
+import ticket_index
+
+
+def make_ticket(ticket_id, created, service_id, **fields):
+    timestamp = int(created.timestamp())
+    ticket = {
+        'id': ticket_id,
+        'created_at': timestamp,
+        'updated_at': timestamp,
+        'customfields': [{'field_id': ticket_fetcher.SERVICE_ID_CUSTOM_FIELD, 'value': service_id}],
+    }
+    ticket.update(fields)
+    return ticket
+
+
+def test_store_and_query_leave_missing_fields_out(tmp_path):
+    index = ticket_index.TicketIndex(str(tmp_path / "tickets.db"))
+    index.store([
+        make_ticket(1, datetime(2024, 5, 3, tzinfo=timezone.utc), "AA01234",
+                    number="100", subject="Disk full", user={'email': 'ops@example.com'}),
+        make_ticket(2, datetime(2024, 5, 1, tzinfo=timezone.utc), "01234"),
+        make_ticket(3, datetime(2024, 5, 2, tzinfo=timezone.utc), "SS999", number="300"),
+        make_ticket(4, datetime(2024, 6, 2, tzinfo=timezone.utc), "1234", number="400"),
+    ])
+
+    start_date, end_date = ticket_fetcher.get_month_range(5, 2024)
+    tickets = index.query(["1234"], start_date, end_date)
+
+    # Prefixed and zero-padded Service IDs match the numbers read from customer_details.txt
+    assert [ticket['id'] for ticket in tickets] == [2, 1]
+    assert tickets[0].get('number', 'N/A') == 'N/A'
+    assert tickets[0].get('subject', 'N/A') == 'N/A'
+    assert tickets[0].get('user', {}).get('email', 'N/A') == 'N/A'
+    assert tickets[1]['number'] == "100"
+    assert tickets[1]['user']['email'] == 'ops@example.com'
+    assert tickets[1]['created_at_dt'] == datetime(2024, 5, 3, tzinfo=timezone.utc)
+
+
+def test_report_table_from_index_with_missing_fields(tmp_path, monkeypatch):
+    index = ticket_index.TicketIndex(str(tmp_path / "tickets.db"))
+    index.store([make_ticket(1, datetime(2024, 5, 3, tzinfo=timezone.utc), "1234", subject="No number or user")])
+    index.set_state('last_sync', time.time())
+    monkeypatch.setattr(ticket_index, '_index', index)
+    (tmp_path / "customer_details.txt").write_text("Project ID: AA01234\n")
+
+    doc = Document()
+    doc.add_paragraph(ticket_fetcher.TICKETS_ANCHOR)
+    ticket_fetcher.fetch_and_insert_tickets(doc, str(tmp_path), 5, 2024)
+
+    assert len(doc.tables) == 1
+    rows = [[cell.text for cell in row.cells] for row in doc.tables[0].rows]
+    assert rows[1] == ['1', 'N/A', '2024-05-03 08:00:00', 'No number or user', 'N/A']
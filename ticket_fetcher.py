@@ -3,25 +3,43 @@
 import requests
 from docx import Document
 from datetime import datetime, timedelta, timezone
-import time
 import os
 import re
 import csv
-from docx.enum.text import WD_BREAK
+from concurrent.futures import ThreadPoolExecutor
 from docx.oxml import OxmlElement
+import backend_scheduler
+import progress
+import report_builder
 
-def fetch_and_insert_tickets(document, customer_dir, month, year):
-    # Paths to files
+# Template sentence after which the ticket list is inserted
+TICKETS_ANCHOR = "help to keep track the progress of issued and requests raised and assess the responsiveness of the support team."
+
+# SupportPal API credentials
+SUPPORTPAL_API_URL = '<SUPPORTPAL_URL>'
+SUPPORTPAL_API_TOKEN = '<SUPPORTPAL_API>'  # Replace with your actual API token
+
+# The custom field ID for "Service ID"
+SERVICE_ID_CUSTOM_FIELD = 6  # Use the actual custom field ID
+
+# Tickets per page
+TICKET_PAGE_LIMIT = 100
+
+# Service IDs fetched at once; requests are rate limited by the 'supportpal' pool in backend_scheduler
+TICKET_FETCH_WORKERS = 4
+
+# Ticket dates are reported in UTC+8
+UTC_PLUS_8 = timezone(timedelta(hours=8))
+
+
+def get_service_ids(customer_dir):
+    # Service IDs of the customer's tickets (Subscription IDs and the Project ID), or None if there are none
     customer_details_path = os.path.join(customer_dir, 'customer_details.txt')
-    
-    # SupportPal API credentials
-    api_base_url = '<SUPPORTPAL_URL>'
-    api_token = '<SUPPORTPAL_API>'  # Replace with your actual API token
-    
+
     # Read Project ID and Subscription IDs from customer_details.txt
     service_id_values = set()
     project_id_num = None
-    
+
     with open(customer_details_path, 'r') as file:
         for line in file:
             line = line.strip()
@@ -45,172 +63,183 @@ def fetch_and_insert_tickets(document, customer_dir, month, year):
                     service_id_values.add(subscription_id_num)
                 else:
                     print(f"Could not extract numerical Service ID from Subscription ID: {subscription_id_value}")
-    
+
     if not service_id_values:
         if project_id_num:
             service_id_values.add(project_id_num)
         else:
             print("No 'Subscription ID' or 'Project ID' found in customer_details.txt.")
-            return
-    
+            return None
+
     # Remove any service ID values that are the same as the Project ID
     if project_id_num in service_id_values:
         service_id_values.remove(project_id_num)
-    
+
     # Now, add the project_id_num
     if project_id_num:
         service_id_values.add(project_id_num)
-    
+
     # Convert service_id_values to a list
-    service_id_values = list(service_id_values)
-    
-    # Define the UTC+8 timezone
-    utc_plus_8 = timezone(timedelta(hours=8))
-    
-    # Compute start and end timestamps for the given month and year
+    return list(service_id_values)
+
+
+def get_month_range(month, year):
+    # Start date is the first day of the month at 00:00:00 UTC+8
+    start_date = datetime(year, month, 1, tzinfo=UTC_PLUS_8)
+    # End date is the last day of the month at 23:59:59 UTC+8
+    if month == 12:
+        end_date = datetime(year + 1, 1, 1, tzinfo=UTC_PLUS_8) - timedelta(seconds=1)
+    else:
+        end_date = datetime(year, month + 1, 1, tzinfo=UTC_PLUS_8) - timedelta(seconds=1)
+    return start_date, end_date
+
+
+def parse_created_at(created_at):
+    # Parse 'created_at' into datetime object in UTC+8
     try:
-        # Start date is the first day of the month at 00:00:00 UTC+8
-        start_date = datetime(year, month, 1, tzinfo=utc_plus_8)
-        # End date is the last day of the month at 23:59:59 UTC+8
-        if month == 12:
-            end_date = datetime(year + 1, 1, tzinfo=utc_plus_8) - timedelta(seconds=1)
+        if isinstance(created_at, int):
+            # Normalize 'created_at' to seconds if necessary
+            if created_at > 1e12:  # Likely in milliseconds
+                created_at_sec = created_at // 1000
+            else:
+                created_at_sec = created_at
+            # Convert timestamp to datetime in UTC, then convert to UTC+8
+            dt_utc = datetime.fromtimestamp(created_at_sec, tz=timezone.utc)
+            return dt_utc.astimezone(UTC_PLUS_8)
         else:
-            end_date = datetime(year, month + 1, 1, tzinfo=utc_plus_8) - timedelta(seconds=1)
-    
+            # Handle other formats if necessary
+            return None
     except Exception as e:
-        print(f"Error computing date range: {e}")
+        print(f"Error parsing 'created_at': {e}")
+        return None
+
+
+def fetch_service_tickets(service_id_value, start_date, end_date):
+    # Tickets of one service ID created between start_date and end_date, or None on an API error.
+    # Pages are read newest first and paging stops at the first page reaching back before start_date,
+    # so older history is never downloaded.
+    # Set up Basic Authentication with API token as username and 'X' as password
+    auth = (SUPPORTPAL_API_TOKEN, 'X')
+    tickets = []
+    start = 1
+    while True:
+        # Prepare API request parameters for this service ID
+        params = {
+            'order_column': 'created_at',
+            'order_direction': 'desc',
+            'limit': TICKET_PAGE_LIMIT,
+            'internal': 0,  # Fetch non-internal tickets
+            'with': 'user',  # Include user data
+            'start': start,
+        }
+        params[f'customfield[{SERVICE_ID_CUSTOM_FIELD}]'] = service_id_value
+
+        with backend_scheduler.slot('supportpal'):
+            response = requests.get(f'{SUPPORTPAL_API_URL}/ticket/ticket', params=params, auth=auth)
+
+        # Print the request URL for debugging
+        print(f"Request URL: {response.url}")
+
+        # Raise exception for HTTP errors
+        response.raise_for_status()
+        tickets_data = response.json()
+
+        # Check for API errors
+        if tickets_data.get('status') == 'error':
+            print(f"API Error: {tickets_data.get('message')}")
+            return None
+
+        page_tickets = tickets_data.get('data', [])
+        if not page_tickets:
+            break
+
+        reached_start = False
+        for ticket in page_tickets:
+            created_at_dt = parse_created_at(ticket.get('created_at'))
+            if created_at_dt is None:
+                # Decide what to do if 'created_at' is None or couldn't be parsed
+                continue
+            if created_at_dt < start_date:
+                reached_start = True
+            elif created_at_dt <= end_date:
+                ticket['created_at_dt'] = created_at_dt  # Store the datetime object in the ticket
+                tickets.append(ticket)
+
+        # The last page, or everything after this one is older than the month
+        if reached_start or len(page_tickets) < TICKET_PAGE_LIMIT:
+            break
+
+        # Increment 'start' by the number of tickets received
+        start += len(page_tickets)
+
+    return tickets
+
+
+def fetch_tickets(service_id_values, month, year):
+    """Tickets of every service ID created in the month (UTC+8), oldest first, or None on an API error.
+
+    Service IDs are fetched concurrently; requests.exceptions.RequestException is raised on HTTP errors.
+    """
+    start_date, end_date = get_month_range(month, year)
+    with ThreadPoolExecutor(max_workers=TICKET_FETCH_WORKERS) as executor:
+        results = list(executor.map(
+            progress.wrap(fetch_service_tickets), service_id_values,
+            [start_date] * len(service_id_values), [end_date] * len(service_id_values)
+        ))
+    if any(result is None for result in results):
+        return None
+
+    # A ticket can carry several of the customer's service IDs
+    tickets = []
+    ticket_ids = set()  # To avoid duplicates
+    for service_tickets in results:
+        for ticket in service_tickets:
+            ticket_id = ticket.get('id')
+            if ticket_id not in ticket_ids:
+                tickets.append(ticket)
+                ticket_ids.add(ticket_id)
+
+    # Sort the filtered tickets by 'created_at_dt'
+    tickets.sort(key=lambda ticket: ticket['created_at_dt'])
+    return tickets
+
+
+def fetch_and_insert_tickets(document, customer_dir, month, year, insertion_point=None):
+    # insertion_point: report_builder.InsertionPoint after TICKETS_ANCHOR; looked up in the document when not given
+    if insertion_point is None:
+        insertion_point = report_builder.find_insertion_points(document, [TICKETS_ANCHOR])[TICKETS_ANCHOR]
+
+    service_id_values = get_service_ids(customer_dir)
+    if not service_id_values:
         return
-    
-    # Initialize 'limit'
-    limit = 100
-    
-    # The custom field ID for "Service ID"
-    CUSTOM_FIELD_ID = 6  # Use the actual custom field ID
-    
+
+    # ticket_index builds on this module, so it is imported here rather than at the top
+    import ticket_index
+
     try:
-        # Set up Basic Authentication with API token as username and 'X' as password
-        auth = (api_token, 'X')
-    
-        # Fetch tickets and implement pagination
-        tickets = []
-        ticket_ids = set()  # To avoid duplicates
-    
-        for service_id_value in service_id_values:
-            start = 1
-            while True:
-                # Prepare API request parameters for this service ID
-                params = {
-                    'order_column': 'created_at',
-                    'order_direction': 'asc',
-                    'limit': limit,
-                    'internal': 0,  # Fetch non-internal tickets
-                    'with': 'user',  # Include user data
-                    'start': start,
-                }
-                params[f'customfield[{CUSTOM_FIELD_ID}]'] = service_id_value
-    
-                response = requests.get(f'{api_base_url}/ticket/ticket', params=params, auth=auth)
-    
-                # Print the request URL for debugging
-                print(f"Request URL: {response.url}")
-    
-                # Raise exception for HTTP errors
-                response.raise_for_status()
-                tickets_data = response.json()
-    
-                # Check for API errors
-                if tickets_data.get('status') == 'error':
-                    print(f"API Error: {tickets_data.get('message')}")
-                    return
-    
-                page_tickets = tickets_data.get('data', [])
-                if not page_tickets:
-                    break
-    
-                for ticket in page_tickets:
-                    ticket_id = ticket.get('id')
-                    if ticket_id not in ticket_ids:
-                        tickets.append(ticket)
-                        ticket_ids.add(ticket_id)
-    
-                # Increment 'start' by the number of tickets received
-                start += len(page_tickets)
-    
-                # If the number of tickets returned is less than 'limit', we've reached the last page
-                if len(page_tickets) < limit:
-                    break
-    
-                # Sleep briefly to avoid hitting rate limits
-                time.sleep(0.5)
-    
-        # Function to parse 'created_at' into datetime object in UTC+8
-        def parse_created_at(created_at):
-            try:
-                if isinstance(created_at, int):
-                    # Normalize 'created_at' to seconds if necessary
-                    if created_at > 1e12:  # Likely in milliseconds
-                        created_at_sec = created_at // 1000
-                    else:
-                        created_at_sec = created_at
-                    # Convert timestamp to datetime in UTC, then convert to UTC+8
-                    dt_utc = datetime.utcfromtimestamp(created_at_sec).replace(tzinfo=timezone.utc)
-                    dt_utc_plus_8 = dt_utc.astimezone(utc_plus_8)
-                    return dt_utc_plus_8
-                else:
-                    # Handle other formats if necessary
-                    return None
-            except Exception as e:
-                print(f"Error parsing 'created_at': {e}")
-                return None
-    
-        # Filter tickets based on creation date in UTC+8
-        filtered_tickets = []
-        for ticket in tickets:
-            created_at = ticket.get('created_at')
-            created_at_dt = parse_created_at(created_at)
-            if created_at_dt is not None:
-                if start_date <= created_at_dt <= end_date:
-                    ticket['created_at_dt'] = created_at_dt  # Store the datetime object in the ticket
-                    filtered_tickets.append(ticket)
-            else:
-                # Decide what to do if 'created_at' is None or couldn't be parsed
-                pass
-        
+        # The local ticket index answers without touching SupportPal; fetch live when it cannot be used
+        filtered_tickets = ticket_index.get_tickets(service_id_values, month, year)
+        if filtered_tickets is None:
+            filtered_tickets = fetch_tickets(service_id_values, month, year)
+        if filtered_tickets is None:
+            return
+
         if not filtered_tickets:
             print(f"No tickets found for Service IDs: {service_id_values} in {month}/{year}")
             # Instead of returning, proceed to insert the sentence into the document
-            # Find the paragraph where we want to insert after
-            for i, paragraph in enumerate(document.paragraphs):
-                if "help to keep track the progress of issued and requests raised and assess the responsiveness of the support team." in paragraph.text:
-                    insert_index = i + 1  # We will insert after this paragraph
-                    break
-            else:
+            if insertion_point is None:
                 print("The phrase was not found in the document.")
                 return
 
-            # Get the paragraph where we want to insert after
-            p = document.paragraphs[insert_index - 1]
-
-            # Get the document body
-            body = document._body
-            body_elm = body._body
-            p_index = body_elm.index(p._p)
-
             # Insert a new paragraph with the sentence
-            new_paragraph = document.add_paragraph("No ticket has been raised on this month.")
-            body_elm.insert(p_index + 1, new_paragraph._p)
+            insertion_point.paragraph("No ticket has been raised on this month.")
 
             # Insert a page break after the sentence
-            page_break_paragraph = document.add_paragraph()
-            page_break_paragraph.add_run().add_break(WD_BREAK.PAGE)
-            body_elm.insert(p_index + 2, page_break_paragraph._p)
+            insertion_point.page_break()
 
             print(f"Inserted message into the document indicating no tickets were raised in {month}/{year}.")
             return  # Exit the function after inserting the message
         else:
-            # Sort the filtered tickets by 'created_at_dt'
-            filtered_tickets.sort(key=lambda ticket: ticket['created_at_dt'])
-
             # Write tickets to CSV file
             month_dir = os.path.join(customer_dir, f"{year}-{str(month).zfill(2)}")
             os.makedirs(month_dir, exist_ok=True)
@@ -242,26 +271,12 @@ def fetch_and_insert_tickets(document, customer_dir, month, year):
                     })
 
             # Now, insert the table into the document
-            # Find the paragraph that contains the specific sentence
-            for i, paragraph in enumerate(document.paragraphs):
-                if "help to keep track the progress of issued and requests raised and assess the responsiveness of the support team." in paragraph.text:
-                    insert_index = i + 1  # We will insert after this paragraph
-                    break
-            else:
+            if insertion_point is None:
                 print("The phrase was not found in the document.")
                 return
 
-            # Get the paragraph where we want to insert after
-            p = document.paragraphs[insert_index - 1]
-
-            # Get the document body
-            body = document._body
-            body_elm = body._body
-            p_index = body_elm.index(p._p)
-
             # Insert a new paragraph (line break) after the target paragraph
-            line_break_paragraph = document.add_paragraph()
-            body_elm.insert(p_index + 1, line_break_paragraph._p)
+            insertion_point.paragraph()
 
             # Create the table
             table = document.add_table(rows=1, cols=5)
@@ -295,12 +310,10 @@ def fetch_and_insert_tickets(document, customer_dir, month, year):
                 row_cells[4].text = email  # Populate email column
 
             # Insert the table after the line break paragraph
-            body_elm.insert(p_index + 2, table._tbl)
+            insertion_point.element(table._tbl)
 
             # Insert a page break after the table
-            page_break_paragraph = document.add_paragraph()
-            page_break_paragraph.add_run().add_break(WD_BREAK.PAGE)
-            body_elm.insert(p_index + 3, page_break_paragraph._p)
+            insertion_point.page_break()
 
             print(f"Tickets inserted into the document and CSV file '{csv_filename}' created.")
     
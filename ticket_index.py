@@ -0,0 +1,249 @@
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import requests
+import backend_scheduler
+import ticket_fetcher
+
+# Local copy of the SupportPal tickets, indexed by Service ID and creation time, so reports
+# read a month's tickets locally. Run "python ticket_index.py sync" periodically (e.g. hourly
+# from cron) to spread the SupportPal load; only tickets updated since the last sync are fetched.
+TICKET_INDEX_PATH = "/home/almalinux/.tickets/ticket_index.db"
+
+# Reports top the index up first when its last sync is older than this
+TICKET_INDEX_MAX_AGE_SECONDS = 900
+
+# Tickets updated this long before the watermark are fetched again, in case they changed mid-sync
+SYNC_OVERLAP_SECONDS = 300
+
+_index = None
+_index_unavailable = False
+_index_lock = threading.Lock()
+_sync_lock = threading.Lock()
+
+
+def to_seconds(timestamp):
+    # SupportPal timestamps are seconds, sometimes milliseconds
+    if not isinstance(timestamp, int):
+        return None
+    return timestamp // 1000 if timestamp > 1e12 else timestamp
+
+
+def get_service_id(ticket):
+    # The number of the "Service ID" custom field, without prefix or leading zeros like
+    # ticket_fetcher.get_service_ids() reads them (e.g. "AA01234" -> "1234"), or None
+    for field in ticket.get('customfields') or []:
+        if field.get('field_id') == ticket_fetcher.SERVICE_ID_CUSTOM_FIELD and field.get('value') not in (None, ''):
+            match = re.search(r'(?:AA0*|AA|SS0*|SS)?(\d+)', str(field['value']))
+            return match.group(1).lstrip('0') if match else None
+    return None
+
+
+class TicketIndex:
+    """SupportPal tickets kept in SQLite (WAL), queried by Service ID and creation time."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tickets ("
+            " id INTEGER PRIMARY KEY,"
+            " service_id TEXT,"
+            " created_at INTEGER NOT NULL,"
+            " updated_at INTEGER NOT NULL,"
+            " data TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS tickets_service_created ON tickets (service_id, created_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+
+    def _connect(self):
+        # One connection per thread; autocommit so every write is its own short transaction
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_state(self, name):
+        row = self._connect().execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, name, value):
+        self._connect().execute(
+            "INSERT INTO sync_state (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (name, value)
+        )
+
+    def store(self, tickets):
+        # Upserts a page of tickets; returns the newest updated_at among them
+        rows = []
+        newest = 0
+        for ticket in tickets:
+            created_at = to_seconds(ticket.get('created_at'))
+            updated_at = to_seconds(ticket.get('updated_at')) or created_at
+            if ticket.get('id') is None or created_at is None:
+                continue
+            # Only the fields SupportPal returned, so the report's 'N/A' defaults apply as for live tickets
+            data = {'id': ticket['id'], 'created_at': created_at}
+            for key in ('number', 'subject'):
+                if ticket.get(key) is not None:
+                    data[key] = ticket[key]
+            email = (ticket.get('user') or {}).get('email')
+            data['user'] = {'email': email} if email is not None else {}
+            rows.append((ticket['id'], get_service_id(ticket), created_at, updated_at, json.dumps(data)))
+            newest = max(newest, updated_at)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO tickets (id, service_id, created_at, updated_at, data) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET service_id = excluded.service_id, created_at = excluded.created_at,"
+                " updated_at = excluded.updated_at, data = excluded.data",
+                rows
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return newest
+
+    def sync(self, full=False):
+        """Fetch the tickets updated since the watermark (every ticket when full). Returns how many were stored."""
+        watermark = None if full else self.get_state('watermark')
+        since = watermark - SYNC_OVERLAP_SECONDS if watermark is not None else None
+        auth = (ticket_fetcher.SUPPORTPAL_API_TOKEN, 'X')
+        started = time.time()
+        stored = 0
+        newest = watermark or 0
+        start = 1
+        while True:
+            params = {
+                'order_column': 'updated_at',
+                'order_direction': 'desc',
+                'limit': ticket_fetcher.TICKET_PAGE_LIMIT,
+                'internal': 0,  # Fetch non-internal tickets
+                'with': 'user,customfields',
+                'start': start,
+            }
+            with backend_scheduler.slot('supportpal'):
+                response = requests.get(f'{ticket_fetcher.SUPPORTPAL_API_URL}/ticket/ticket', params=params, auth=auth)
+            response.raise_for_status()
+            tickets_data = response.json()
+            if tickets_data.get('status') == 'error':
+                raise ValueError(f"API Error: {tickets_data.get('message')}")
+
+            page_tickets = tickets_data.get('data', [])
+            if since is not None:
+                page_tickets = [t for t in page_tickets if (to_seconds(t.get('updated_at')) or 0) >= since]
+            if page_tickets:
+                newest = max(newest, self.store(page_tickets))
+                stored += len(page_tickets)
+
+            # The last page, or the rest was already synced
+            returned = len(tickets_data.get('data', []))
+            if returned < ticket_fetcher.TICKET_PAGE_LIMIT or len(page_tickets) < returned:
+                break
+            start += returned
+
+        self.set_state('watermark', newest)
+        self.set_state('last_sync', started)
+        print(f"Synced {stored} updated tickets into the ticket index" + (" (full sync)" if watermark is None else ""))
+        return stored
+
+    def is_fresh(self):
+        last_sync = self.get_state('last_sync')
+        return last_sync is not None and time.time() - last_sync < TICKET_INDEX_MAX_AGE_SECONDS
+
+    def query(self, service_ids, start_date, end_date):
+        # Tickets of the service IDs created between start_date and end_date, oldest first
+        placeholders = ", ".join("?" for _ in service_ids)
+        rows = self._connect().execute(
+            f"SELECT data FROM tickets WHERE service_id IN ({placeholders}) AND created_at BETWEEN ? AND ?"
+            " ORDER BY created_at, id",
+            list(service_ids) + [int(start_date.timestamp()), int(end_date.timestamp())]
+        ).fetchall()
+        tickets = []
+        for (data,) in rows:
+            ticket = json.loads(data)
+            ticket['created_at_dt'] = ticket_fetcher.parse_created_at(ticket['created_at'])
+            tickets.append(ticket)
+        return tickets
+
+    def stats(self):
+        conn = self._connect()
+        count = conn.execute("SELECT COUNT(*) FROM tickets").fetchone()[0]
+        return {'tickets': count, 'watermark': self.get_state('watermark'), 'last_sync': self.get_state('last_sync')}
+
+
+def get_index():
+    # The shared ticket index, or None when it is disabled or cannot be opened
+    global _index, _index_unavailable
+    with _index_lock:
+        if _index is None and TICKET_INDEX_PATH and not _index_unavailable:
+            try:
+                _index = TicketIndex(TICKET_INDEX_PATH)
+            except Exception as e:
+                print(f"Ticket index unavailable, fetching tickets from SupportPal: {e}")
+                _index_unavailable = True
+        return _index
+
+
+def get_tickets(service_id_values, month, year):
+    """The month's tickets from the index, topped up first if stale; None when the index cannot be used."""
+    index = get_index()
+    if index is None:
+        return None
+    try:
+        if index.get_state('last_sync') is None:
+            # Never synced: the first full sync belongs to "ticket_index.py sync", not to a report
+            return None
+        if not index.is_fresh():
+            # One thread tops the index up; the others wait and find it fresh
+            with _sync_lock:
+                if not index.is_fresh():
+                    index.sync()
+        start_date, end_date = ticket_fetcher.get_month_range(month, year)
+        tickets = index.query(service_id_values, start_date, end_date)
+    except (requests.exceptions.RequestException, sqlite3.Error, ValueError) as e:
+        print(f"Ticket index could not be used, fetching tickets from SupportPal: {e}")
+        return None
+    print(f"Loaded {len(tickets)} tickets for Service IDs {service_id_values} from the ticket index")
+    return tickets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the local SupportPal ticket index in sync.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="Fetch tickets updated since the last sync")
+    sync_parser.add_argument("--full", action='store_true', help="Fetch every ticket again, ignoring the watermark")
+    subparsers.add_parser("stats", help="Show the number of indexed tickets and the sync watermark")
+    args = parser.parse_args()
+
+    index = get_index()
+    if index is None:
+        sys.exit(1)
+    if args.command == "sync":
+        try:
+            index.sync(full=args.full)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Ticket sync failed: {e}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        print(index.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, abort
+from flask import Flask, render_template, request, jsonify, send_from_directory, abort, Response
 import os
 import subprocess
 import shutil
@@ -6,17 +6,41 @@ import requests
 import csv
 from datetime import datetime, timedelta
 from collections import Counter
-import threading
-import uuid
 import sys
 import logging
 import json
 from logging.handlers import RotatingFileHandler
 
+# Make the export and report scripts in the parent directory importable
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PARENT_DIR not in sys.path:
+    sys.path.insert(0, PARENT_DIR)
+
+import network_topology
+import export_orchestrator
+import backend_scheduler
+from task_runner import TaskRunner, INTERACTIVE, BATCH
+from task_store import TaskStore
+import task_output
+
+# Start the CPU worker processes while this is the only thread; forking once the task and request
+# threads run could hand the children locks those threads hold
+backend_scheduler.get_process_pool()
+
 app = Flask(__name__)
 
-task_statuses = {}  # A dictionary to keep track of task statuses.
-task_status_lock = threading.Lock()
+# Task statuses live in SQLite so every app process answers /task_status for every task
+TASK_DB_PATH = '/var/lib/app/tasks.db'
+TASK_TTL_SECONDS = 86400  # Finished tasks are forgotten after a day
+TASK_EVENTS_KEEPALIVE_SECONDS = 15  # A /task_events stream without news sends a comment this often
+task_store = TaskStore(TASK_DB_PATH, ttl_seconds=TASK_TTL_SECONDS)
+# Tasks of an app process that stopped (crash, restart) are marked failed once its heartbeat is missing
+task_store.start_heartbeat()
+
+# Number of background actions that run at the same time; the rest wait in FIFO queues.
+# Interactive actions go before batch jobs, and TASK_INTERACTIVE_WORKERS workers never take batch jobs.
+TASK_WORKERS = 3
+TASK_INTERACTIVE_WORKERS = 1
 
 # Set up logging
 log_directory = '/var/log/app'
@@ -101,6 +125,11 @@ def create_project(project_id, project_name, host_group_name, server_tags, racks
     return True, f"Project '{project_id}' created successfully at {project_dir}."
 
 
+def api_pool(zabbix_api_url):
+    # Requests from the web app share the export pools; being interactive they go before batch work
+    return 'network_zabbix_api' if zabbix_api_url == NETWORK_ZABBIX_API_URL else 'zabbix_api'
+
+
 def zabbix_login_api(session, zabbix_api_url, username, password):
     payload = {
         "jsonrpc": "2.0",
@@ -109,7 +138,8 @@ def zabbix_login_api(session, zabbix_api_url, username, password):
         "id": 1,
         "auth": None
     }
-    response = session.post(zabbix_api_url, json=payload)
+    with backend_scheduler.slot(api_pool(zabbix_api_url)):
+        response = session.post(zabbix_api_url, json=payload)
     result = response.json()
     if 'result' in result:
         return result['result']
@@ -126,7 +156,8 @@ def get_hostgroup_id(auth_token, session, zabbix_api_url, group_name):
         "auth": auth_token,
         "id": 2
     }
-    response = session.post(zabbix_api_url, json=payload)
+    with backend_scheduler.slot(api_pool(zabbix_api_url)):
+        response = session.post(zabbix_api_url, json=payload)
     result = response.json()
     if result.get('result'):
         group_id = result['result'][0]['groupid']
@@ -136,279 +167,101 @@ def get_hostgroup_id(auth_token, session, zabbix_api_url, group_name):
         app.logger.warning(f"Host group '{group_name}' not found.")
         return None
 
-def get_hosts(auth_token, session, rack):
-    payload = {
-        "jsonrpc": "2.0",
-        "method": "host.get",
-        "params": {
-            "output": ["hostid", "host", "name"],
-            "search": {
-                "host": rack,
-                "name": rack
-            },
-            "searchCaseInsensitive": True
-        },
-        "auth": auth_token,
-        "id": 2
-    }
-    response = session.post(NETWORK_ZABBIX_API_URL, json=payload)
-    result = response.json()
-    hosts = result.get('result', [])
-    return hosts
-
-def get_graphs(auth_token, session, host_id, server_tag):
-    payload = {
-        "jsonrpc": "2.0",
-        "method": "graph.get",
-        "params": {
-            "output": ["graphid", "name"],
-            "hostids": host_id,
-            "search": {
-                "name": server_tag
-            },
-            "searchCaseInsensitive": True
-        },
-        "auth": auth_token,
-        "id": 3
-    }
-    response = session.post(NETWORK_ZABBIX_API_URL, json=payload)
-    return response.json().get('result', [])
-
 def verify_network_host(auth_token, session, rack, server_tag):
-    # Initialize hosts as empty list
-    hosts = []
-
-    # Check if the rack starts with 'MAH-'
-    if rack.startswith('MAH-'):
-        # Try searching for hosts with 'MAH-<Anything>'
-        hosts = get_hosts(auth_token, session, rack)
-        if not hosts:
-            # If no hosts found, try 'AIMS-<Anything>'
-            aims_rack = 'AIMS-' + rack[len('MAH-'):]
-            app.logger.info(f"No hosts found for '{rack}', trying '{aims_rack}'")
-            hosts = get_hosts(auth_token, session, aims_rack)
-    else:
-        # For other racks, search as usual
-        hosts = get_hosts(auth_token, session, rack)
+    # Resolve the rack (with its MAH- to AIMS- fallback) from the cached network topology
+    tagged_hosts = network_topology.find_tagged_graphs(session, NETWORK_ZABBIX_API_URL, auth_token, rack, server_tag)
 
-    if not hosts:
+    if not tagged_hosts:
         app.logger.warning(f"No hosts found containing rack '{rack}'.")
         return False
 
-    # For each host, check if graphs matching server_tag exist
-    for host in hosts:
-        host_id = host['hostid']
-        graphs = get_graphs(auth_token, session, host_id, server_tag)
-        if graphs:
-            return True
-    return False
+    # Check if any host has graphs matching server_tag
+    return any(graphs for _, graphs in tagged_hosts)
 
 
-def run_script_async(command, task_id=None):
-    def target():
-        app.logger.debug(f"Running command: {' '.join(command)}")
-        try:
-            result = subprocess.run(command, capture_output=True, text=True, check=True)
-            app.logger.debug(f"Command output: {result.stdout}")
-            if task_id:
-                # Update task status to 'completed' upon success
-                with task_status_lock:
-                    task_statuses[task_id] = {
-                        'status': 'completed',
-                        'message': 'Task completed successfully.'
-                    }
-        except subprocess.CalledProcessError as e:
-            error_message = f"Command '{' '.join(command)}' failed with return code {e.returncode}\n"
-            if e.stderr:
-                error_message += f"Stderr: {e.stderr}\n"
-            if e.stdout:
-                error_message += f"Stdout: {e.stdout}\n"
-            app.logger.error(error_message)
-            if task_id:
-                # Update task status to 'failed' upon error
-                with task_status_lock:
-                    task_statuses[task_id] = {
-                        'status': 'failed',
-                        'message': error_message
-                    }
-        except Exception as e:
-            app.logger.exception(f"Unexpected error: {e}")
-            if task_id:
-                # Update task status to 'failed', including the exception message
-                with task_status_lock:
-                    task_statuses[task_id] = {
-                        'status': 'failed',
-                        'message': f'Unexpected error: {str(e)}'
-                    }
+# What a task prints goes to a bounded in-memory tail and a rotating per-task log file
+TASK_LOG_DIRECTORY = os.path.join(log_directory, 'tasks')
+TASK_OUTPUT_LINES = 500
+task_outputs = task_output.TaskOutputs(TASK_LOG_DIRECTORY, max_lines=TASK_OUTPUT_LINES, max_log_age_seconds=TASK_TTL_SECONDS)
+task_output.install_stream_routing()
 
-    if task_id:
-        # Set initial status to 'in progress'
-        with task_status_lock:
-            task_statuses[task_id] = {'status': 'in progress', 'message': 'Task is running.'}
+# Recompress exported graph PNGs before they are embedded in reports (png_optimizer.py)
+OPTIMIZE_PNG = False
+KEEP_ORIGINAL_PNG = False
+PNG_OPTIONS = {'optimize_png': OPTIMIZE_PNG, 'keep_original_png': KEEP_ORIGINAL_PNG}
+
+# How Grafana reports with Llama selected are analyzed: 'auto' assesses ping, CPU, memory and
+# disk graphs from their data and sends only the rest to Llama; 'vision' sends every graph
+ANALYSIS_MODE = 'auto'
+
+# Warm workers shared by every background action; the export and report modules are already imported
+task_runner = TaskRunner(
+    TASK_WORKERS, task_store.set, task_store.add_event, task_outputs.open, reserved_interactive=TASK_INTERACTIVE_WORKERS
+)
 
-    thread = threading.Thread(target=target)
-    thread.start()
-    return thread
 
+def submit_task(key, description, func, *args, priority=INTERACTIVE, **kwargs):
+    task_id, created = task_runner.submit(key, func, *args, priority=priority, **kwargs)
+    if not created:
+        return True, f"Task {task_id} for {description} is already queued or running for this project.", task_id
+    return True, f"Task {task_id} queued for {description}.", task_id
 
 
 def export_graph(month, year, project_id):
-    task_id = str(uuid.uuid4())
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    script_path = os.path.join(os.path.dirname(script_dir), 'zabbix_graph_export.py')
-    command = ["python3", script_path, "--month", month, "--year", year, "--customer", project_id]
-    run_script_async(command, task_id)
-    return True, f"Task {task_id} started for exporting graphs.", task_id
+    return submit_task(
+        ('export_graph', project_id, month, year), "exporting graphs",
+        export_orchestrator.export_zabbix_graphs, month, year, project_id, base_directory=BASE_DIR, **PNG_OPTIONS
+    )
 
 def export_network_graph(month, year, project_id):
-    task_id = str(uuid.uuid4())
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    script_path = os.path.join(os.path.dirname(script_dir), 'network_graph_export.py')
-    command = ["python3", script_path, "--month", month, "--year", year, "--customer", project_id]
-    run_script_async(command, task_id)
-    return True, f"Task {task_id} started for exporting network graphs.", task_id
+    return submit_task(
+        ('export_network_graph', project_id, month, year), "exporting network graphs",
+        export_orchestrator.export_network_graphs, month, year, project_id, base_directory=BASE_DIR, **PNG_OPTIONS
+    )
 
 def export_grafana_graph(month, year, project_id):
-    task_id = str(uuid.uuid4())
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    script_path = os.path.join(os.path.dirname(script_dir), 'grafana_graph_export.py')
-    command = ["python3", script_path, "--month", month, "--year", year, "--customer", project_id]
-    run_script_async(command, task_id)
-    return True, f"Task {task_id} started for exporting Grafana graphs.", task_id
+    return submit_task(
+        ('export_grafana_graph', project_id, month, year), "exporting Grafana graphs",
+        export_orchestrator.export_grafana_graphs, month, year, project_id, base_directory=BASE_DIR, **PNG_OPTIONS
+    )
 
 
 def generate_report(month, year, project_id):
-    task_id = str(uuid.uuid4())
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    script_path = os.path.join(os.path.dirname(script_dir), 'generate_report.py')
-    command = ["python3", script_path, "--month", month, "--year", year, "--customer", project_id]
-    run_script_async(command, task_id)
-    return True, f"Task {task_id} started for generating report.", task_id
+    return submit_task(
+        ('generate_report', project_id, month, year), "generating report",
+        export_orchestrator.generate_zabbix_report, month, year, project_id, base_directory=BASE_DIR
+    )
 
 def generate_grafana_report(month, year, project_id, llama_selected=False):
-    task_id = str(uuid.uuid4())
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    script_path = os.path.join(os.path.dirname(script_dir), 'generate_report_grafana.py')
-    command = ["python3", script_path, "--month", month, "--year", year, "--customer", project_id]
-    if llama_selected:
-        command.append("--llama")
-    run_script_async(command, task_id)
-    return True, f"Task {task_id} started for generating Grafana report.", task_id
+    return submit_task(
+        ('generate_grafana_report', project_id, month, year, llama_selected), "generating Grafana report",
+        export_orchestrator.generate_grafana_report, month, year, project_id, llama_selected, base_directory=BASE_DIR,
+        analysis_mode=ANALYSIS_MODE
+    )
 
 
 def export_and_generate_report(month, year, project_id):
-    task_id = str(uuid.uuid4())
-
-    def target():
-        with task_status_lock:
-            task_statuses[task_id] = {'status': 'in progress', 'message': 'Task is running.'}
-        try:
-            # Start the export scripts asynchronously
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            parent_dir = os.path.dirname(script_dir)
-            # Start the export scripts asynchronously
-            task_id1 = str(uuid.uuid4())
-            thread1 = run_script_async(
-                ["python3", os.path.join(parent_dir, "zabbix_graph_export.py"), "--month", month, "--year", year, "--customer", project_id],
-                task_id=task_id1
-            )
-            task_id2 = str(uuid.uuid4())
-            thread2 = run_script_async(
-                ["python3", os.path.join(parent_dir, "network_graph_export.py"), "--month", month, "--year", year, "--customer", project_id],
-                task_id=task_id2
-            )
-            # Wait for both export scripts to complete
-            thread1.join()
-            thread2.join()
-            # Check the statuses
-            with task_status_lock:
-                status1 = task_statuses.get(task_id1)
-                status2 = task_statuses.get(task_id2)
-            if status1['status'] != 'completed':
-                with task_status_lock:
-                    task_statuses[task_id] = {'status': 'failed', 'message': f"zabbix_graph_export.py failed: {status1['message']}"}
-                return
-            if status2['status'] != 'completed':
-                with task_status_lock:
-                    task_statuses[task_id] = {'status': 'failed', 'message': f"network_graph_export.py failed: {status2['message']}"}
-                return
-            # Now start the report generation script
-            task_id3 = str(uuid.uuid4())
-            thread3 = run_script_async(
-                ["python3", os.path.join(parent_dir, "generate_report.py"), "--month", month, "--year", year, "--customer", project_id],
-                task_id=task_id3
-            )
-            # Wait for report generation to complete
-            thread3.join()
-            # Update task status to 'completed'
-            with task_status_lock:
-                status3 = task_statuses.get(task_id3)
-            if status3['status'] != 'completed':
-                with task_status_lock:
-                    task_statuses[task_id] = {'status': 'failed', 'message': f"generate_report.py failed: {status3['message']}"}
-                return
-            # If all succeeded
-            with task_status_lock:
-                task_statuses[task_id] = {'status': 'completed', 'message': 'Export and report generation completed.'}
-        except Exception as e:
-            # Update task status to 'failed'
-            with task_status_lock:
-                task_statuses[task_id] = {'status': 'failed', 'message': f'Task failed: {str(e)}'}
-
-    # Start the process in a separate thread
-    process_thread = threading.Thread(target=target)
-    process_thread.start()
-    return True, f"Task {task_id} started for exporting and generating report.", task_id
+    # Both exports and the report run in one worker, sharing logins and customer details
+    return submit_task(
+        ('export_and_generate', project_id, month, year), "exporting and generating report",
+        export_orchestrator.export_and_generate_report, month, year, project_id, base_directory=BASE_DIR, **PNG_OPTIONS
+    )
 
 def export_and_generate_grafana_report(month, year, project_id, llama_selected=False):
-    task_id = str(uuid.uuid4())
+    return submit_task(
+        ('export_and_generate_grafana', project_id, month, year, llama_selected), "exporting and generating Grafana report",
+        export_orchestrator.export_and_generate_grafana_report, month, year, project_id, llama_selected,
+        base_directory=BASE_DIR, analysis_mode=ANALYSIS_MODE, **PNG_OPTIONS
+    )
 
-    def target():
-        with task_status_lock:
-            task_statuses[task_id] = {'status': 'in progress', 'message': 'Task is running.'}
-        try:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            parent_dir = os.path.dirname(script_dir)
-
-            # Run the Grafana graph export script
-            task_id1 = str(uuid.uuid4())
-            thread1 = run_script_async(
-                ["python3", os.path.join(parent_dir, "grafana_graph_export.py"), "--month", month, "--year", year, "--customer", project_id],
-                task_id=task_id1
-            )
-            thread1.join()
-
-            with task_status_lock:
-                status1 = task_statuses.get(task_id1)
-            if status1['status'] != 'completed':
-                with task_status_lock:
-                    task_statuses[task_id] = {'status': 'failed', 'message': f"grafana_graph_export.py failed: {status1['message']}"}
-                return
-
-            # Run the Grafana report generation script with llama_selected parameter
-            task_id2 = str(uuid.uuid4())
-            cmd = ["python3", os.path.join(parent_dir, "generate_report_grafana.py"), "--month", month, "--year", year, "--customer", project_id]
-            if llama_selected:
-                cmd.append("--llama")
-            thread2 = run_script_async(cmd, task_id=task_id2)
-            thread2.join()
-
-            with task_status_lock:
-                status2 = task_statuses.get(task_id2)
-            if status2['status'] != 'completed':
-                with task_status_lock:
-                    task_statuses[task_id] = {'status': 'failed', 'message': f"generate_report_grafana.py failed: {status2['message']}"}
-                return
 
-            with task_status_lock:
-                task_statuses[task_id] = {'status': 'completed', 'message': 'Export and report generation for Grafana completed.'}
-        except Exception as e:
-            with task_status_lock:
-                task_statuses[task_id] = {'status': 'failed', 'message': f'Task failed: {str(e)}'}
-
-    process_thread = threading.Thread(target=target)
-    process_thread.start()
-    return True, f"Task {task_id} started for exporting and generating Grafana report.", task_id
+def batch_generate_reports(month, year, selector, customer_ids, llama_selected=False):
+    # One task runs the whole month-end batch; its own scheduler limits concurrency per backend
+    return submit_task(
+        ('batch_generate', month, year, selector, tuple(customer_ids), llama_selected), "month-end batch report generation",
+        export_orchestrator.run_batch, month, year, selector, customer_ids, llama_selected,
+        priority=BATCH, base_directory=BASE_DIR, analysis_mode=ANALYSIS_MODE, **PNG_OPTIONS
+    )
 
 
 def find_missing_timestamps(csv_file_path):
@@ -720,6 +573,16 @@ def action():
     elif action_type == 'export_and_generate_grafana':
         llama_selected = 'llama' in request.form
         success, message, task_id = export_and_generate_grafana_report(month, year, project_id, llama_selected)
+    elif action_type == 'batch_generate':
+        selector = request.form.get('selector', 'all')
+        customer_ids = request.form.get('customer_ids', '').replace(',', ' ').split()
+        llama_selected = 'llama' in request.form
+        if selector not in ('all', 'grafana', 'list'):
+            success, message = False, f"Unknown customer selection '{selector}'."
+        elif selector == 'list' and not customer_ids:
+            success, message = False, "No Project IDs given for the batch."
+        else:
+            success, message, task_id = batch_generate_reports(month, year, selector, customer_ids, llama_selected)
 
 
     response_data = {'success': success, 'message': message}
@@ -734,14 +597,64 @@ def action():
 
 @app.route('/task_status/<task_id>', methods=['GET'])
 def task_status(task_id):
-    with task_status_lock:
-        status_info = task_statuses.get(task_id)
+    status_info = task_store.get(task_id)
     if status_info:
         return jsonify(status_info)
     else:
         return jsonify({'status': 'unknown', 'message': 'Task ID not found.'})
 
 
+@app.route('/task_events/<task_id>', methods=['GET'])
+def task_events(task_id):
+    # Server-sent events: every status change and progress event of the task, until it finishes
+    last_seq = request.headers.get('Last-Event-ID', '0')
+    last_seq = int(last_seq) if last_seq.isdigit() else 0
+
+    def stream(after_seq):
+        # Wakes up when this process writes a status or event, rather than polling the store
+        last_position = None
+        while True:
+            version = task_store.change_version()
+            status_info = task_store.get(task_id)
+            if status_info is None:
+                yield f"event: status\ndata: {json.dumps({'status': 'unknown', 'message': 'Task ID not found.'})}\n\n"
+                return
+
+            for seq, event, data in task_store.get_events(task_id, after_seq):
+                after_seq = seq
+                yield f"id: {seq}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+            if status_info['status'] in ('completed', 'failed'):
+                return
+
+            # The queue position changes without an event of its own, when other tasks change status
+            position = status_info.get('position')
+            if position is not None and position != last_position:
+                last_position = position
+                yield f"event: status\ndata: {json.dumps(status_info)}\n\n"
+
+            if not task_store.wait_for_change(version, TASK_EVENTS_KEEPALIVE_SECONDS):
+                yield ": keepalive\n\n"
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream(last_seq), mimetype='text/event-stream', headers=headers)
+
+
+@app.route('/task_output/<task_id>', methods=['GET'])
+def task_output_route(task_id):
+    count = min(request.args.get('lines', 100, type=int), TASK_OUTPUT_LINES)
+    lines = task_outputs.tail(task_id, count)
+    if lines is None:
+        return jsonify({'success': False, 'message': 'No output found for this task.'})
+    return jsonify({'success': True, 'lines': lines})
+
+
+@app.route('/scheduler_stats', methods=['GET'])
+def scheduler_stats():
+    # Queue depth and wait times per backend pool, plus the background task queue of this process
+    return jsonify({'pools': backend_scheduler.stats(), 'tasks': task_runner.stats()})
+
+
 # Route to delete a file or directory
 @app.route('/delete', methods=['POST'])
 def delete():
@@ -0,0 +1,160 @@
+import os
+import re
+import sys
+import time
+import logging
+import threading
+from collections import deque, OrderedDict
+from logging.handlers import RotatingFileHandler
+import progress
+
+# '\r' ends a line too, so progress bars redrawn in place do not pile up in one line
+LINE_END = re.compile(r'\r\n|\r|\n')
+
+# Output without any line end is stored in pieces of at most this many characters
+MAX_LINE_CHARS = 8192
+
+
+class TaskLogHandler(RotatingFileHandler):
+    # Write and rotate errors (e.g. disk full) are reported on the process's own stderr: from a
+    # task thread sys.stderr routes back into the TaskOutput that is writing, which holds its lock
+
+    def handleError(self, record):
+        stream = getattr(sys.stderr, 'original', sys.stderr)
+        if logging.raiseExceptions and stream is not None:
+            stream.write(f"Could not write task log {self.baseFilename}: {sys.exc_info()[1]}\n")
+
+
+class TaskOutput:
+    """Output of one task: the last max_lines lines in memory and everything in a rotating log file."""
+
+    def __init__(self, path, max_lines, max_bytes, backup_count):
+        self.path = path
+        self.lines = deque(maxlen=max_lines)
+        self._partial = ''
+        self._lock = threading.Lock()
+        self._handler = TaskLogHandler(path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self._handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+
+    def write(self, text):
+        # Only complete lines are stored; the remainder waits for the next write, as does a
+        # trailing '\r' that may be the start of '\r\n'
+        with self._lock:
+            buffer = self._partial + text
+            held = '\r' if buffer.endswith('\r') else ''
+            *complete, partial = LINE_END.split(buffer[:len(buffer) - len(held)])
+            while len(partial) > MAX_LINE_CHARS:
+                complete.append(partial[:MAX_LINE_CHARS])
+                partial = partial[MAX_LINE_CHARS:]
+            self._partial = partial + held
+            for line in complete:
+                self._append(line)
+        return len(text)
+
+    def _append(self, line):
+        record = logging.LogRecord('task', logging.INFO, '', 0, line.rstrip('\r'), None, None)
+        self.lines.append(self._handler.format(record))
+        self._handler.handle(record)
+
+    def close(self):
+        with self._lock:
+            if self._partial:
+                self._append(self._partial)
+                self._partial = ''
+        self._handler.close()
+
+    def tail(self, count):
+        with self._lock:
+            return list(self.lines)[-count:]
+
+
+class TaskOutputs:
+    """Creates the per-task outputs and keeps the most recent ones in memory for /task_output."""
+
+    def __init__(self, log_directory, max_lines=500, max_bytes=5000000, backup_count=2, keep=50,
+                 max_log_age_seconds=86400):
+        self.log_directory = log_directory
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.keep = keep
+        self.max_log_age_seconds = max_log_age_seconds
+        self._outputs = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_purge = 0
+        if not os.path.exists(log_directory):
+            os.makedirs(log_directory)
+        self.purge_old_logs()
+
+    def log_path(self, task_id):
+        return os.path.join(self.log_directory, f"{task_id}.log")
+
+    def open(self, task_id):
+        output = TaskOutput(self.log_path(task_id), self.max_lines, self.max_bytes, self.backup_count)
+        with self._lock:
+            self._outputs[task_id] = output
+            while len(self._outputs) > self.keep:
+                self._outputs.popitem(last=False)
+        if time.time() - self._last_purge > 3600:
+            self.purge_old_logs()
+        return output
+
+    def tail(self, task_id, count):
+        # Lines from memory when this process ran the task, otherwise from the end of its log file
+        with self._lock:
+            output = self._outputs.get(task_id)
+        if output is not None:
+            return output.tail(count)
+
+        path = self.log_path(task_id)
+        if not os.path.isfile(path):
+            return None
+        # Read only the end of the file; the first line may be cut and is dropped
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - count * 512))
+            data = f.read().decode('utf-8', errors='replace')
+        lines = data.split('\n')
+        if size > count * 512:
+            lines = lines[1:]
+        if lines and lines[-1] == '':
+            lines = lines[:-1]
+        return lines[-count:]
+
+    def purge_old_logs(self):
+        self._last_purge = time.time()
+        cutoff = time.time() - self.max_log_age_seconds
+        for filename in os.listdir(self.log_directory):
+            path = os.path.join(self.log_directory, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class ThreadRoutedStream:
+    # Sends writes from a thread running a task into that task's output, everything else to the original stream
+
+    def __init__(self, original):
+        self.original = original
+
+    def write(self, text):
+        output = progress.get_output()
+        if output is None:
+            return self.original.write(text)
+        return output.write(text)
+
+    def flush(self):
+        self.original.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.original, name)
+
+
+def install_stream_routing():
+    if not isinstance(sys.stdout, ThreadRoutedStream):
+        sys.stdout = ThreadRoutedStream(sys.stdout)
+    if not isinstance(sys.stderr, ThreadRoutedStream):
+        sys.stderr = ThreadRoutedStream(sys.stderr)
@@ -0,0 +1,129 @@
+import logging
+import threading
+import uuid
+from collections import deque
+import progress
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+
+class TaskRunner:
+    """Fixed pool of long-lived worker threads consuming two FIFO job queues.
+
+    Jobs are plain callables returning (success, message). Interactive jobs
+    are always picked before batch jobs, and the first reserved_interactive
+    workers never pick batch jobs, so an operator's action starts right away
+    even while month-end batches occupy the other workers. Submitting a job
+    whose key matches one that is still queued or running returns the
+    existing task id instead of queueing a duplicate. Progress emitted by
+    a job is passed to add_event(task_id, 'progress', data), and whatever
+    it prints goes to the sink returned by open_output(task_id).
+    """
+
+    def __init__(self, max_workers, set_status, add_event=None, open_output=None, reserved_interactive=1):
+        self.max_workers = max_workers
+        self.reserved_interactive = min(reserved_interactive, max_workers - 1)
+        self.set_status = set_status
+        self.add_event = add_event
+        self.open_output = open_output
+        self._queues = {INTERACTIVE: deque(), BATCH: deque()}  # (task_id, key, func, args, kwargs)
+        self._active = {}  # key -> task_id for queued and running jobs
+        self._running = {}  # task_id -> lane
+        self._condition = threading.Condition()
+        for i in range(max_workers):
+            lanes = (INTERACTIVE,) if i < self.reserved_interactive else (INTERACTIVE, BATCH)
+            worker = threading.Thread(target=self._worker, args=(lanes,), name=f"task-worker-{i + 1}", daemon=True)
+            worker.start()
+
+    def submit(self, key, func, *args, priority=INTERACTIVE, **kwargs):
+        # Returns (task_id, created); created is False when an identical job was already pending
+        with self._condition:
+            task_id = self._active.get(key)
+            if task_id is not None:
+                return task_id, False
+
+            task_id = str(uuid.uuid4())
+            self._active[key] = task_id
+            queue = self._queues[priority]
+            queue.append((task_id, key, func, args, kwargs))
+            self.set_status(task_id, 'queued', f"Queued at position {len(queue)}.", lane=priority)
+            self._condition.notify_all()
+            return task_id, True
+
+    def stats(self):
+        with self._condition:
+            return {
+                'workers': self.max_workers,
+                'reserved_interactive': self.reserved_interactive,
+                'running': len(self._running),
+                'running_batch': sum(1 for lane in self._running.values() if lane == BATCH),
+                'queued_interactive': len(self._queues[INTERACTIVE]),
+                'queued_batch': len(self._queues[BATCH]),
+            }
+
+    def _next_job(self, lanes):
+        for lane in lanes:
+            if self._queues[lane]:
+                return lane, self._queues[lane].popleft()
+        return None, None
+
+    def _worker(self, lanes):
+        while True:
+            with self._condition:
+                lane, job = self._next_job(lanes)
+                while job is None:
+                    self._condition.wait()
+                    lane, job = self._next_job(lanes)
+                task_id, key, func, args, kwargs = job
+                self._running[task_id] = lane
+
+            try:
+                status, message = self._run(task_id, lane, func, args, kwargs)
+            except Exception as e:
+                # Recording the start or opening the output failed, e.g. the database was locked
+                logger.exception(f"Could not run task {task_id}: {e}")
+                status, message = 'failed', f'Unexpected error: {str(e)}'
+            finally:
+                with self._condition:
+                    self._running.pop(task_id, None)
+                    self._active.pop(key, None)
+
+            try:
+                self.set_status(task_id, status, message)
+            except Exception as e:
+                logger.exception(f"Could not record status '{status}' of task {task_id}: {e}")
+                try:
+                    self.set_status(task_id, 'failed', f"Could not record the task's result: {str(e)}")
+                except Exception:
+                    logger.exception(f"Could not mark task {task_id} as failed")
+
+    def _run(self, task_id, lane, func, args, kwargs):
+        # Returns the job's (status, message); raises only when the task could not be set up or torn down
+        self.set_status(task_id, 'in progress', 'Task is running.')
+        output = None
+        try:
+            if self.add_event is not None:
+                progress.set_reporter(self._make_reporter(task_id))
+            output = self.open_output(task_id) if self.open_output is not None else None
+            progress.set_output(output)
+            progress.set_priority(lane)
+            try:
+                success, message = func(*args, **kwargs)
+                return ('completed' if success else 'failed'), message
+            except Exception as e:
+                logger.exception(f"Unexpected error in task {task_id}: {e}")
+                return 'failed', f'Unexpected error: {str(e)}'
+        finally:
+            progress.set_reporter(None)
+            progress.set_output(None)
+            progress.set_priority(None)
+            if output is not None:
+                output.close()
+
+    def _make_reporter(self, task_id):
+        def reporter(stage, message, data):
+            self.add_event(task_id, 'progress', dict(data, stage=stage, message=message))
+        return reporter
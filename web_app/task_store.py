@@ -0,0 +1,214 @@
+import os
+import json
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+FINISHED_STATUSES = ('completed', 'failed')
+
+
+class TaskStore:
+    """Task statuses and progress events kept in SQLite so every app process sees the same tasks.
+
+    The database runs in WAL mode, so status reads never wait for writers.
+    Finished tasks are evicted after ttl_seconds. Each process records a heartbeat
+    every heartbeat_seconds (start_heartbeat()); the queued and running tasks of a
+    process without one for owner_timeout_seconds are marked failed, and tasks
+    left unfinished are evicted after stale_seconds.
+    """
+
+    def __init__(self, path, ttl_seconds=86400, stale_seconds=172800, evict_interval_seconds=300,
+                 heartbeat_seconds=15, owner_timeout_seconds=60):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.evict_interval_seconds = evict_interval_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.owner_timeout_seconds = owner_timeout_seconds
+        # Identifies the tasks queued by this process, whose queue order is local to it
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._last_eviction = 0
+        # Bumped on every status change and event written by this process, for wait_for_change()
+        self._version = 0
+        self._changed = threading.Condition()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " task_id TEXT NOT NULL UNIQUE,"
+            " owner TEXT NOT NULL,"
+            " lane TEXT NOT NULL DEFAULT 'interactive',"
+            " status TEXT NOT NULL,"
+            " message TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        # Databases created before priority lanes existed lack the lane column
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(tasks)")]
+        if 'lane' not in columns:
+            conn.execute("ALTER TABLE tasks ADD COLUMN lane TEXT NOT NULL DEFAULT 'interactive'")
+        conn.execute("CREATE INDEX IF NOT EXISTS tasks_queue ON tasks (owner, status, seq)")
+        conn.execute("CREATE INDEX IF NOT EXISTS tasks_expiry ON tasks (status, updated_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS task_events ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " task_id TEXT NOT NULL,"
+            " event TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS task_events_task ON task_events (task_id, seq)")
+        conn.execute("CREATE TABLE IF NOT EXISTS owners (owner TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+        self.beat()
+        self.evict_expired()
+
+    def _connect(self):
+        # One connection per thread; autocommit so every write is its own short transaction
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def set(self, task_id, status, message, lane='interactive'):
+        # lane is only recorded when the task is first stored
+        now = time.time()
+        conn = self._connect()
+        # The status row and its 'status' event are written together so streams never miss a transition
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO tasks (task_id, owner, lane, status, message, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(task_id) DO UPDATE SET status = excluded.status, message = excluded.message,"
+                " updated_at = excluded.updated_at",
+                (task_id, self.owner, lane, status, message, now, now)
+            )
+            conn.execute(
+                "INSERT INTO task_events (task_id, event, data, created_at) VALUES (?, 'status', ?, ?)",
+                (task_id, json.dumps({'status': status, 'message': message}), now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._notify_change()
+        if status in FINISHED_STATUSES and now - self._last_eviction > self.evict_interval_seconds:
+            self.evict_expired()
+
+    def get(self, task_id):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT seq, owner, lane, status, message FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        seq, owner, lane, status, message = row
+        status_info = {'status': status, 'message': message}
+        if status == 'queued':
+            # Queued tasks report their current place in their process's queues;
+            # every queued interactive task goes before any batch task
+            if lane == 'batch':
+                query = "SELECT COUNT(*) FROM tasks WHERE owner = ? AND status = 'queued' AND (lane = 'interactive' OR seq <= ?)"
+            else:
+                query = "SELECT COUNT(*) FROM tasks WHERE owner = ? AND status = 'queued' AND lane = 'interactive' AND seq <= ?"
+            position = conn.execute(query, (owner, seq)).fetchone()[0]
+            status_info['position'] = position
+            status_info['message'] = f"Queued at position {position}."
+        return status_info
+
+    def add_event(self, task_id, event, data):
+        self._connect().execute(
+            "INSERT INTO task_events (task_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+            (task_id, event, json.dumps(data), time.time())
+        )
+        self._notify_change()
+
+    def _notify_change(self):
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    def change_version(self):
+        # Read before querying, then pass to wait_for_change() so no write in between is missed
+        with self._changed:
+            return self._version
+
+    def wait_for_change(self, version, timeout):
+        # Blocks until this process writes a status or event after version; False on timeout.
+        # Writes by other processes sharing the database are only seen on the next query.
+        with self._changed:
+            return self._changed.wait_for(lambda: self._version != version, timeout)
+
+    def get_events(self, task_id, after_seq=0):
+        # Returns [(seq, event, data)] recorded for the task after after_seq, oldest first
+        rows = self._connect().execute(
+            "SELECT seq, event, data FROM task_events WHERE task_id = ? AND seq > ? ORDER BY seq",
+            (task_id, after_seq)
+        ).fetchall()
+        return [(seq, event, json.loads(data)) for seq, event, data in rows]
+
+    def beat(self):
+        # Records that this process is alive
+        self._connect().execute(
+            "INSERT INTO owners (owner, heartbeat) VALUES (?, ?)"
+            " ON CONFLICT(owner) DO UPDATE SET heartbeat = excluded.heartbeat",
+            (self.owner, time.time())
+        )
+
+    def fail_interrupted(self, message="Interrupted: the app process running it stopped."):
+        # Marks as failed the queued and running tasks of processes whose heartbeat stopped
+        # owner_timeout_seconds ago (tasks of owners that never recorded one count from their
+        # last update). Returns how many were marked.
+        rows = self._connect().execute(
+            "SELECT tasks.task_id FROM tasks LEFT JOIN owners ON owners.owner = tasks.owner"
+            " WHERE tasks.owner != ? AND tasks.status NOT IN (?, ?)"
+            " AND COALESCE(owners.heartbeat, tasks.updated_at) < ?",
+            (self.owner,) + FINISHED_STATUSES + (time.time() - self.owner_timeout_seconds,)
+        ).fetchall()
+        for (task_id,) in rows:
+            self.set(task_id, 'failed', message)
+        return len(rows)
+
+    def start_heartbeat(self):
+        # Beats and fails the tasks of stopped processes every heartbeat_seconds, in a daemon thread
+        def run():
+            while True:
+                try:
+                    self.beat()
+                    self.fail_interrupted()
+                except sqlite3.Error as e:
+                    print(f"Task store heartbeat failed: {e}")
+                time.sleep(self.heartbeat_seconds)
+
+        threading.Thread(target=run, name="task-store-heartbeat", daemon=True).start()
+
+    def evict_expired(self):
+        now = time.time()
+        self._last_eviction = now
+        conn = self._connect()
+        expired = (
+            "SELECT task_id FROM tasks WHERE (status IN (?, ?) AND updated_at < ?)"
+            " OR (status NOT IN (?, ?) AND updated_at < ?)"
+        )
+        params = FINISHED_STATUSES + (now - self.ttl_seconds,) + FINISHED_STATUSES + (now - self.stale_seconds,)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"DELETE FROM task_events WHERE task_id IN ({expired})", params)
+            conn.execute(f"DELETE FROM tasks WHERE task_id IN ({expired})", params)
+            conn.execute("DELETE FROM owners WHERE heartbeat < ?", (now - self.stale_seconds,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
@@ -6,6 +6,9 @@ from datetime import datetime, timezone
 import calendar
 from collections import Counter
 import statistics
+import progress
+import backend_scheduler
+import network_topology
 
 # Zabbix server details
 ZABBIX_URL = "<ZABBIX_URL>"
@@ -22,7 +25,8 @@ def zabbix_login_api(session):
         "id": 1,
         "auth": None
     }
-    response = session.post(ZABBIX_API_URL, json=payload)
+    with backend_scheduler.slot('zabbix_api'):
+        response = session.post(ZABBIX_API_URL, json=payload)
     result = response.json()
     if 'result' in result:
         return result['result']
@@ -30,6 +34,12 @@ def zabbix_login_api(session):
         print("Failed to authenticate with Zabbix API.", file=sys.stderr)
         sys.exit(1)
 
+def api_response(response, payload):
+    # The decoded API answer; raises network_topology.SessionRejected when the session expired
+    data = response.json()
+    network_topology.check_api_session(data, payload['method'])
+    return data
+
 def get_directory_name(host_name, project_id, project_name):
     parts = host_name.split(' - ')
     project_id = project_id.strip()
@@ -60,8 +70,9 @@ def get_disk_space_items(auth_token, session, host_id):
         "auth": auth_token,
         "id": 8
     }
-    response = session.post(ZABBIX_API_URL, json=payload)
-    result = response.json()
+    with backend_scheduler.slot('zabbix_api'):
+        response = session.post(ZABBIX_API_URL, json=payload)
+    result = api_response(response, payload)
     if 'result' in result:
         return result['result']
     else:
@@ -88,13 +99,15 @@ def download_pie_chart(session, graph_id, stime, etime, output_path):
 
     print(f"Downloading pie chart with parameters: {params}")
 
-    response = session.get(chart_url, params=params, stream=True)
+    with backend_scheduler.slot('zabbix_renderer'):
+        response = session.get(chart_url, params=params, stream=True)
 
     if response.headers.get('Content-Type', '').startswith('image/'):
         with open(output_path, 'wb') as img_file:
             img_file.write(response.content)
         print(f"Pie chart {graph_id} saved to {output_path}")
     else:
+        network_topology.check_chart_session(response)
         print(f"Failed to download pie chart {graph_id}. Received non-image content.")
         print(f"Response status code: {response.status_code}")
         print("Response content (for debugging):", response.text)
@@ -106,7 +119,8 @@ def download_pie_chart(session, graph_id, stime, etime, output_path):
 def zabbix_web_login(session):
     login_url = f"{ZABBIX_URL}/index.php"
     data = {"name": USERNAME, "password": PASSWORD, "autologin": 1, "enter": "Sign in"}
-    response = session.post(login_url, data=data)
+    with backend_scheduler.slot('zabbix_renderer'):
+        response = session.post(login_url, data=data)
     if "zbx_session" in session.cookies or "zbx_sessionid" in session.cookies:
         print("Successfully logged in to the Zabbix web interface.")
     else:
@@ -122,8 +136,9 @@ def get_hostgroup_id(auth_token, session, group_name):
         "auth": auth_token,
         "id": 2
     }
-    response = session.post(ZABBIX_API_URL, json=payload)
-    result = response.json()
+    with backend_scheduler.slot('zabbix_api'):
+        response = session.post(ZABBIX_API_URL, json=payload)
+    result = api_response(response, payload)
     if result['result']:
         group_id = result['result'][0]['groupid']
         print(f"Found host group '{group_name}' with ID {group_id}")
@@ -147,8 +162,9 @@ def get_hosts(auth_token, session, group_id):
         "auth": auth_token,
         "id": 3
     }
-    response = session.post(ZABBIX_API_URL, json=payload)
-    result = response.json()
+    with backend_scheduler.slot('zabbix_api'):
+        response = session.post(ZABBIX_API_URL, json=payload)
+    result = api_response(response, payload)
     hosts = result.get('result', [])
     print(f"Retrieved enabled hosts for group ID {group_id}:")
     for host in hosts:
@@ -174,8 +190,9 @@ def get_graphs(auth_token, session, host_id, search_terms=None):
         "auth": auth_token,
         "id": 4
     }
-    response = session.post(ZABBIX_API_URL, json=payload)
-    return response.json()['result']
+    with backend_scheduler.slot('zabbix_api'):
+        response = session.post(ZABBIX_API_URL, json=payload)
+    return api_response(response, payload)['result']
 
 
 
@@ -198,23 +215,26 @@ def download_graph(session, graph_id, stime, etime, output_path):
 
     print(f"Downloading graph with parameters: {params}")
 
-    response = session.get(graph_url, params=params, stream=True)
+    with backend_scheduler.slot('zabbix_renderer'):
+        response = session.get(graph_url, params=params, stream=True)
 
     if response.headers.get('Content-Type', '').startswith('image/'):
         with open(output_path, 'wb') as img_file:
             img_file.write(response.content)
         print(f"Graph {graph_id} saved to {output_path}")
     else:
+        network_topology.check_chart_session(response)
         print(f"Failed to download graph {graph_id}. Received non-image content.")
         print(f"Response status code: {response.status_code}")
         print("Response content (for debugging):", response.text)
         print(f"Request URL: {response.url}")
 
 # Export graphs for each customer
-def export_graphs_for_customer(customer_dir, specified_month, specified_year):
-    # Load customer details
-    with open(os.path.join(customer_dir, "customer_details.txt"), "r") as f:
-        details = dict(line.strip().split(": ", 1) for line in f if ": " in line)
+def export_graphs_for_customer(customer_dir, specified_month, specified_year, session=None, auth_token=None, details=None):
+    # Load customer details unless the caller already did
+    if details is None:
+        with open(os.path.join(customer_dir, "customer_details.txt"), "r") as f:
+            details = dict(line.strip().split(": ", 1) for line in f if ": " in line)
 
     project_id = details.get("Project ID")
     project_name = details.get("Project Name")
@@ -243,10 +263,11 @@ def export_graphs_for_customer(customer_dir, specified_month, specified_year):
     print(f"Start time (stime): {stime} ({first_day})")
     print(f"End time (etime): {etime} ({last_day})")
 
-    # Create session and authenticate
-    session = requests.Session()
-    auth_token = zabbix_login_api(session)
-    zabbix_web_login(session)
+    # Create session and authenticate, unless an already logged-in session is shared
+    if session is None:
+        session = requests.Session()
+        auth_token = zabbix_login_api(session)
+        zabbix_web_login(session)
 
     # Get host group ID
     group_id = get_hostgroup_id(auth_token, session, hostgroup_name)
@@ -258,7 +279,9 @@ def export_graphs_for_customer(customer_dir, specified_month, specified_year):
 
     # Get hosts and download graphs
     hosts = get_hosts(auth_token, session, group_id)
-    for host in hosts:
+    progress.emit('hosts', f"Discovered {len(hosts)} hosts in '{hostgroup_name}'", count=len(hosts))
+    graph_count = 0
+    for host_index, host in enumerate(hosts, start=1):
         host_id = host['hostid']
         host_name = host['name']
         directory_name = get_directory_name(host_name, project_id, project_name)
@@ -311,6 +334,12 @@ def export_graphs_for_customer(customer_dir, specified_month, specified_year):
                 output_file = os.path.join(host_dir, f"{graph_name}_{stime}.png")
                 download_pie_chart(session, graph_id, stime, etime, output_file)
 
+        graph_count += len(all_graphs) + len(disk_graphs)
+        progress.emit(
+            'graphs', f"Rendered graphs for {host_index}/{len(hosts)} hosts ({graph_count} graphs)",
+            done=host_index, total=len(hosts), graphs=graph_count
+        )
+
         # --- SLA Calculation Starts Here ---
         # Get ping item ID
         item_id, item_key = get_ping_item_id(auth_token, session, host_id)
@@ -339,6 +368,7 @@ def export_graphs_for_customer(customer_dir, specified_month, specified_year):
 
 
         print(f"SLA Uptime for host '{host_name}': {sla_uptime:.2f}%")
+        progress.emit('sla', f"SLA computed for '{host_name}': {sla_uptime:.2f}%", host=host_name, uptime=round(sla_uptime, 2))
 
         # Export historical data to CSV
         csv_output_file = os.path.join(host_dir, f"{host_name}_{item_key}_history_{specified_year}_{specified_month:02d}.csv")
@@ -370,8 +400,9 @@ def get_ping_item_id(auth_token, session, host_id):
             "auth": auth_token,
             "id": 5
         }
-        response = session.post(ZABBIX_API_URL, json=payload)
-        result = response.json()
+        with backend_scheduler.slot('zabbix_api'):
+            response = session.post(ZABBIX_API_URL, json=payload)
+        result = api_response(response, payload)
         if result['result']:
             item_id = result['result'][0]['itemid']
             print(f"Found {key} item ID: {item_id} for host ID: {host_id}")
@@ -399,8 +430,9 @@ def fetch_item_history(session, auth_token, item_id, stime, etime):
             "auth": auth_token,
             "id": 6
         }
-        response = session.post(ZABBIX_API_URL, json=payload)
-        result = response.json().get('result', [])
+        with backend_scheduler.slot('zabbix_api'):
+            response = session.post(ZABBIX_API_URL, json=payload)
+        result = api_response(response, payload).get('result', [])
         history_data.extend(result)
         print(f"Fetched {len(result)} history data points for history type {history_type}")
     
@@ -420,8 +452,9 @@ def fetch_item_history(session, auth_token, item_id, stime, etime):
         "auth": auth_token,
         "id": 7
     }
-    response = session.post(ZABBIX_API_URL, json=payload)
-    trend_data = response.json().get('result', [])
+    with backend_scheduler.slot('zabbix_api'):
+        response = session.post(ZABBIX_API_URL, json=payload)
+    trend_data = api_response(response, payload).get('result', [])
     print(f"Fetched {len(trend_data)} trend data points")
 
     # Merge history and trend data
@@ -455,8 +488,9 @@ def fetch_item_trends(session, auth_token, item_id, stime, etime):
         "auth": auth_token,
         "id": 7
     }
-    response = session.post(ZABBIX_API_URL, json=payload)
-    return response.json().get('result', [])
+    with backend_scheduler.slot('zabbix_api'):
+        response = session.post(ZABBIX_API_URL, json=payload)
+    return api_response(response, payload).get('result', [])
 
 def determine_expected_interval(combined_data):
     time_differences = [